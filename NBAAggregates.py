@@ -0,0 +1,282 @@
+'''
+Precomputed per-game summaries, so questions like "all overtime games of
+2016" are a lookup instead of a scan over every saved game.
+
+A summary is computed when a game is saved by the scraper (or by build_season
+for games saved before this existed) and stored in FILE_DIR/aggregates.db:
+
+    games    - one row per game: teams, final score, winner, periods,
+               overtimes, lead changes, largest leads and the average score
+               diff metric of NBATestScrape (away - home)
+    quarters - points per team for every period of every game
+    team_games (view) - one row per team per game, from the team's side
+
+    python NBAAggregates.py 15 16 --processes 4
+'''
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import NBADecode
+import NBAScoring
+import NBAUtils
+
+
+AGGREGATES_FNAME = 'aggregates.db' # lives directly under FILE_DIR
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    gameid         TEXT PRIMARY KEY,
+    season         TEXT,
+    season_type    TEXT,
+    away           TEXT,
+    home           TEXT,
+    away_score     INTEGER,
+    home_score     INTEGER,
+    winner         TEXT,
+    final          INTEGER,
+    periods        INTEGER,
+    overtimes      INTEGER,
+    lead_changes   INTEGER,
+    ties           INTEGER,
+    away_max_lead  INTEGER,
+    home_max_lead  INTEGER,
+    avg_score_diff REAL,
+    events         INTEGER,
+    updated_at     REAL
+);
+CREATE INDEX IF NOT EXISTS games_season ON games (season, season_type);
+CREATE TABLE IF NOT EXISTS quarters (
+    gameid      TEXT,
+    period      INTEGER,
+    away_points INTEGER,
+    home_points INTEGER,
+    PRIMARY KEY (gameid, period)
+);
+CREATE VIEW IF NOT EXISTS team_games AS
+    SELECT gameid, season, season_type, away AS team, home AS opponent, 0 AS home,
+           away_score AS points, home_score AS opp_points, winner = away AS won,
+           periods, away_max_lead AS max_lead, avg_score_diff
+    FROM games
+    UNION ALL
+    SELECT gameid, season, season_type, home, away, 1,
+           home_score, away_score, winner = home,
+           periods, home_max_lead, -avg_score_diff
+    FROM games;
+'''
+GAME_COLUMNS = ['gameid', 'season', 'season_type', 'away', 'home', 'away_score',
+                'home_score', 'winner', 'final', 'periods', 'overtimes', 'lead_changes',
+                'ties', 'away_max_lead', 'home_max_lead', 'avg_score_diff', 'events']
+
+
+##### SUMMARIES
+def lead_changes(margins):
+    '''
+    Given the margin (away - home) after every score, returns (lead changes,
+    ties). A lead change is the lead going from one team to the other, even
+    with a tie in between.
+    '''
+
+    leaders = np.sign(margins)
+    leaders = leaders[leaders != 0]
+    changes = int((leaders[1:] != leaders[:-1]).sum())
+    ties = int(((margins[1:] == 0) & (margins[:-1] != 0)).sum()) if len(margins) else 0
+    return (changes, ties)
+
+
+def summarize_game(data):
+    '''
+    Given all rows of data (list of lists), returns (summary, quarters):
+    a dict with the GAME_COLUMNS of the games table, and a list of
+    (period, away points, home points).
+    '''
+
+    gameid = NBAUtils.get_gameid(data)
+    decoded = NBADecode.decode_game(data)
+    decoded['offsets'] = np.array([0, len(data)])
+    away, home = NBAUtils.get_sides(data)
+
+    has_score = decoded['away_score'] != NBADecode.NO_SCORE
+    away_scores = decoded['away_score'][has_score]
+    home_scores = decoded['home_score'][has_score]
+    margins = np.concatenate([[0], away_scores - home_scores])
+    changes, ties = lead_changes(margins)
+    away_score = int(away_scores[-1]) if len(away_scores) else 0
+    home_score = int(home_scores[-1]) if len(home_scores) else 0
+
+    periods = int(decoded['period'].max()) if len(data) else 0
+    diffs, _ = NBAScoring.average_score_diffs_decoded(decoded)
+
+    # Score at the end of every period, from the last row of each period
+    away_filled = NBADecode.fill_scores(decoded['away_score'])
+    home_filled = NBADecode.fill_scores(decoded['home_score'])
+    quarters = []
+    previous = (0, 0)
+    for period in range(1, periods + 1):
+        rows = np.flatnonzero(decoded['period'] == period)
+        if not len(rows):
+            continue
+        end = (int(away_filled[rows[-1]]), int(home_filled[rows[-1]]))
+        quarters.append((period, end[0] - previous[0], end[1] - previous[1]))
+        previous = end
+
+    summary = {
+        'gameid': gameid,
+        'season': gameid[3:5],
+        'season_type': gameid[2],
+        'away': away,
+        'home': home,
+        'away_score': away_score,
+        'home_score': home_score,
+        'winner': NBAUtils.get_winner(data),
+        'final': int(NBAUtils.is_final(data)),
+        'periods': periods,
+        'overtimes': max(periods - NBADecode.NUM_PERIODS, 0),
+        'lead_changes': changes,
+        'ties': ties,
+        'away_max_lead': int(max(margins.max(), 0)),
+        'home_max_lead': int(max(-margins.min(), 0)),
+        'avg_score_diff': float(diffs[0, -1]) if diffs.size else 0.0,
+        'events': len(data),
+    }
+    return (summary, quarters)
+
+
+##### TABLE
+class Aggregates(object):
+    '''The SQLite tables of game summaries. Safe to share between threads.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def record(self, summary, quarters):
+        '''Stores the output of summarize_game, replacing any older summary of the game.'''
+
+        values = [summary[c] for c in GAME_COLUMNS] + [time.time()]
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.execute('INSERT OR REPLACE INTO games VALUES ({})'.format(
+                    ', '.join('?' * len(values))), values)
+                self.conn.execute('DELETE FROM quarters WHERE gameid = ?', (summary['gameid'],))
+                self.conn.executemany('INSERT INTO quarters VALUES (?, ?, ?, ?)',
+                                      [(summary['gameid'],) + q for q in quarters])
+                self.conn.execute('COMMIT')
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def record_game(self, data):
+        '''Summarizes and stores all rows of a game.'''
+
+        self.record(*summarize_game(data))
+
+    def query(self, sql, args=()):
+        '''Runs sql against the tables and returns the rows as dicts.'''
+
+        with self.lock:
+            cursor = self.conn.execute(sql, args)
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in cursor]
+
+    def games(self, year=None, season_type=None, where='1', args=()):
+        '''
+        Returns the summaries of a season and/or season type ('2' regular,
+        '4' playoffs) matching an optional SQL condition, ordered by gameid.
+        '''
+
+        query = 'SELECT * FROM games WHERE ({})'.format(where)
+        args = list(args)
+        if year is not None:
+            query += ' AND season = ?'
+            args.append('{:02d}'.format(int(year)))
+        if season_type is not None:
+            query += ' AND season_type = ?'
+            args.append(str(season_type))
+        return self.query(query + ' ORDER BY gameid', args)
+
+    def game(self, gameid):
+        '''Returns the summary of gameid, or None.'''
+
+        rows = self.query('SELECT * FROM games WHERE gameid = ?', (gameid,))
+        return rows[0] if rows else None
+
+    def overtime_games(self, year=None, season_type=None):
+        return self.games(year, season_type, where='overtimes > 0')
+
+    def team_games(self, year, teamname):
+        '''Returns a team's games of a season from the team's side (see team_games view).'''
+
+        return self.query('SELECT * FROM team_games WHERE season = ? AND team = ? '
+                          'ORDER BY gameid', ('{:02d}'.format(int(year)), teamname))
+
+    def quarters(self, gameid):
+        '''Returns [(period, away points, home points)] of gameid.'''
+
+        with self.lock:
+            return list(self.conn.execute(
+                'SELECT period, away_points, home_points FROM quarters '
+                'WHERE gameid = ? ORDER BY period', (gameid,)))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_aggregates = {}
+_aggregates_lock = threading.Lock()
+
+
+def get_aggregates(file_dir):
+    '''Returns the shared Aggregates for the data rooted at file_dir.'''
+
+    path = os.path.abspath(os.path.join(file_dir, AGGREGATES_FNAME))
+    with _aggregates_lock:
+        if path not in _aggregates:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            _aggregates[path] = Aggregates(path)
+        return _aggregates[path]
+
+
+##### BUILDING
+def build_season(year, processes=None):
+    '''
+    Summarizes every saved game of a year (regular season and playoffs).
+    Games are summarized in a process pool if processes is set. Returns the
+    number of games summarized.
+    '''
+
+    aggregates = get_aggregates(NBAUtils.FILE_DIR)
+    generators = [NBAUtils.playoff_data_generator] # skips rounds that weren't saved
+    if os.path.isdir(os.path.join(NBAUtils.FILE_DIR, NBAUtils.season_dirname(year))):
+        generators.insert(0, NBAUtils.regular_data_generator)
+    count = 0
+    for generator in generators:
+        for summary, quarters in generator(year, func=summarize_game, processes=processes,
+                                           ordered=False):
+            aggregates.record(summary, quarters)
+            count += 1
+    return count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Summarize saved games into aggregates.db.')
+    parser.add_argument('years', type=int, nargs='+')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='summarize games in a pool of this many processes')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for year in args.years:
+        print 'Summarized {} games of {}'.format(build_season(year, args.processes), year)
@@ -0,0 +1,373 @@
+'''
+Sharded backfill of many seasons across processes or hosts. The game-ID
+space is split deterministically: every regular season game, and every
+playoff series (whose games have to be discovered in order), belongs to
+shard crc32(key) % N. A shard scrapes into its own folder, laid out like
+FILE_DIR with its own manifest, indexes and aggregates, so shards never
+share a file:
+
+    FILE_DIR/.shards/shard-<i>-of-<N>/manifest.db, 15/..., DONE
+
+A shard writes a DONE marker once every game it owns is accounted for,
+and is skipped when run again; an unfinished shard resumes from its
+manifest. merge_shards then copies the games of every shard into FILE_DIR,
+indexing and recording them as the scraper would.
+
+On one machine, with a local NBAMockServer standing in for stats.nba.com:
+
+    python NBABackfill.py 97 98 99 --local 4 --base-url http://127.0.0.1:8000/stats/playbyplayv2
+
+On several hosts, run one shard each, copy the shard folders into one
+shard root and merge:
+
+    python NBABackfill.py 97 98 99 --shards 8 --shard 3 --shard-root /scratch/shards
+    python NBABackfill.py 97 98 99 --merge --shard-root /scratch/shards --compact
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import zlib
+import NBAAggregates
+import NBAFiles
+import NBAHttp
+import NBAManifest
+import NBAMetrics
+import NBAScrapeGames
+import NBAUtils
+from NBAMetrics import log
+
+
+SHARDS_DIRNAME = '.shards' # default shard root, under FILE_DIR
+DONE_FNAME = 'DONE'
+
+
+def shard_of(key, num_shards):
+    '''Returns the shard (0 to num_shards - 1) a key belongs to, the same on every host.'''
+
+    return (zlib.crc32(key) & 0xffffffff) % num_shards
+
+
+def series_key(year, p_round, series):
+    return '{}-{}-{}'.format(year, p_round, series)
+
+
+def shard_name(shard, num_shards):
+    return 'shard-{}-of-{}'.format(shard, num_shards)
+
+
+def default_shard_root():
+    return os.path.join(NBAUtils.FILE_DIR, SHARDS_DIRNAME)
+
+
+def use_file_dir(file_dir):
+    '''Points the scraper and the loaders at file_dir. Returns the previous FILE_DIR.'''
+
+    previous = NBAUtils.FILE_DIR
+    NBAScrapeGames.FILE_DIR = NBAUtils.FILE_DIR = file_dir
+    return previous
+
+
+def shard_parts(years, regular=True, playoffs=True):
+    '''Returns the names of the parts of a backfill, e.g. ['15-regular', '15-playoffs'].'''
+
+    parts = []
+    for year in years:
+        if regular:
+            parts.append('{}-regular'.format(year))
+        if playoffs:
+            parts.append('{}-playoffs'.format(year))
+    return parts
+
+
+##### SHARDS
+def regular_shard_jobs(year, shard, num_shards):
+    '''Generator for the (url, prefix) jobs of a regular season that belong to a shard.'''
+
+    for url, prefix in NBAScrapeGames.regular_season_jobs(year):
+        if shard_of(NBAScrapeGames.parse_url(url)[1]['GameID'][0], num_shards) == shard:
+            yield (url, prefix)
+
+
+def playoff_shard_series(year, shard, num_shards):
+    '''Returns the (round, series) of the playoff series of a year that belong to a shard.'''
+
+    return [(p_round, s)
+            for p_round, num_series in zip(range(1, 5), NBAScrapeGames.NUM_SERIES)
+            for s in range(num_series)
+            if shard_of(series_key(year, p_round, s), num_shards) == shard]
+
+
+def save_shard_series(year, shard, num_shards, manifest, workers=1):
+    '''Saves the playoff series of a year that belong to a shard, each until it is decided.'''
+
+    NBAScrapeGames.run_workers(
+        lambda job: NBAScrapeGames.save_series(year, job[0], job[1], manifest),
+        playoff_shard_series(year, shard, num_shards), workers=workers)
+
+
+def read_done(shard_dir):
+    '''Returns the DONE marker of a shard as a dict, or None if it isn't finished.'''
+
+    try:
+        with open(os.path.join(shard_dir, DONE_FNAME), 'r') as infile:
+            return json.load(infile)
+    except (IOError, ValueError):
+        return None
+
+
+def is_done(shard_dir, parts):
+    done = read_done(shard_dir)
+    return bool(done) and set(parts) <= set(done['parts'])
+
+
+def run_shard(years, shard, num_shards, shard_root=None, regular=True, playoffs=True,
+              workers=NBAScrapeGames.MAX_WORKERS, pipeline=False):
+    '''
+    Scrapes the games of years that belong to one shard into its folder
+    under shard_root. Failed games are retried once, and playoff series are
+    walked again after that so those cut short by a failure are finished; if
+    no failed games are left, the shard is marked done. Returns True if the
+    shard is done.
+    '''
+
+    shard_dir = os.path.join(shard_root or default_shard_root(), shard_name(shard, num_shards))
+    parts = shard_parts(years, regular, playoffs)
+    if is_done(shard_dir, parts):
+        log('Shard {} of {} is already done. Skipping.'.format(shard, num_shards))
+        return True
+
+    previous = use_file_dir(shard_dir)
+    try:
+        manifest = NBAScrapeGames.get_manifest()
+        for year in years:
+            assert len(str(year)) <= 2
+            if regular:
+                jobs = regular_shard_jobs(year, shard, num_shards)
+                if pipeline:
+                    NBAScrapeGames.pipeline_games(jobs, fetchers=workers)
+                else:
+                    NBAScrapeGames.save_games(jobs, workers=workers)
+            if playoffs:
+                save_shard_series(year, shard, num_shards, manifest, workers)
+
+        if manifest.failed():
+            NBAScrapeGames.retry_dead_letters(workers=workers)
+            # A series stops at its first failed game, so the games after it
+            # are only found by walking the series again
+            if playoffs:
+                for year in years:
+                    save_shard_series(year, shard, num_shards, manifest, workers)
+        failed = len(manifest.failed())
+        if failed:
+            log('Shard {} of {}: {} games failed, not marking it done'.format(
+                shard, num_shards, failed))
+            return False
+
+        done = read_done(shard_dir) or {'parts': []}
+        marker = {'shard': shard, 'shards': num_shards, 'finished_at': time.time(),
+                  'parts': sorted(set(done['parts']) | set(parts)),
+                  'games': len(manifest.gameids(status=NBAManifest.FETCHED))}
+        NBAFiles.atomic_write(os.path.join(shard_dir, DONE_FNAME), json.dumps(marker))
+        return True
+    finally:
+        use_file_dir(previous)
+
+
+def run_local(years, num_shards, shard_root=None, regular=True, playoffs=True,
+              workers=NBAScrapeGames.MAX_WORKERS, rate=NBAHttp.REQUESTS_PER_SECOND,
+              base_url=None, pipeline=False):
+    '''
+    Runs every shard as its own process on this machine and waits for
+    them. The request rate is split between the shards. Returns the shards
+    that didn't finish.
+    '''
+
+    script = os.path.abspath(__file__)
+    if script.endswith('.pyc'):
+        script = script[:-1]
+    command = [sys.executable, script] + [str(y) for y in years] + [
+        '--shards', str(num_shards), '--workers', str(workers),
+        '--rate', str(float(rate) / num_shards),
+        '--shard-root', shard_root or default_shard_root(),
+        '--base-url', base_url or NBAScrapeGames.BASE_URL]
+    if not regular:
+        command.append('--no-regular')
+    if not playoffs:
+        command.append('--no-playoffs')
+    if pipeline:
+        command.append('--pipeline')
+    if NBAMetrics.QUIET:
+        command.append('--quiet')
+
+    processes = [subprocess.Popen(command + ['--shard', str(shard)])
+                 for shard in range(num_shards)]
+    return [shard for shard, p in enumerate(processes) if p.wait() != 0]
+
+
+def shard_status(shard_root=None):
+    '''Returns (shard folder, DONE marker or None, {status: games}) for every shard.'''
+
+    shard_root = shard_root or default_shard_root()
+    if not os.path.isdir(shard_root):
+        return []
+    report = []
+    for name in sorted(os.listdir(shard_root)):
+        shard_dir = os.path.join(shard_root, name)
+        if not os.path.isfile(os.path.join(shard_dir, NBAManifest.MANIFEST_FNAME)):
+            continue
+        manifest = NBAManifest.get_manifest(shard_dir)
+        counts = {}
+        for gameid in manifest.gameids():
+            status = manifest.status(gameid)
+            counts[status] = counts.get(status, 0) + 1
+        report.append((shard_dir, read_done(shard_dir), counts))
+    return report
+
+
+##### MERGE
+def game_relpath(gameid):
+    '''Returns the folder of a game relative to FILE_DIR, e.g. '15' or '15/Round2'.'''
+
+    season = NBAUtils.season_dirname(gameid[3:5])
+    if gameid[2] == '4':
+        return os.path.join(season, 'Round' + gameid[-3])
+    return season
+
+
+def merge_shard(shard_dir):
+    '''
+    Merges one shard folder into FILE_DIR: saved games that FILE_DIR
+    doesn't have as fetched are copied, indexed, summarized and recorded,
+    and nonexistent and failed games are recorded where FILE_DIR has no
+    better status. Safe to run again. Returns the number of games copied.
+    '''
+
+    shard_manifest = NBAManifest.get_manifest(shard_dir)
+    manifest = NBAScrapeGames.get_manifest()
+    aggregates = NBAAggregates.get_aggregates(NBAUtils.FILE_DIR)
+    saved = (NBAManifest.FETCHED, NBAManifest.PARTIAL)
+    copied = 0
+
+    for gameid in shard_manifest.gameids():
+        entry = shard_manifest.entry(gameid)
+        status = entry['status']
+        current = manifest.status(gameid)
+        prefix = os.path.join(NBAUtils.FILE_DIR, game_relpath(gameid))
+
+        if status not in saved:
+            if current in (None, NBAManifest.FAILED, NBAManifest.EMPTY):
+                manifest.record(gameid, status, url=entry['url'], prefix=prefix,
+                                error=entry['error'])
+            continue
+        if current == NBAManifest.FETCHED and NBAUtils.has_game(prefix, gameid):
+            continue
+
+        src = os.path.join(shard_dir, game_relpath(gameid), gameid)
+        try:
+            data = NBAUtils.read_game_file(src)
+            with open(src, 'rb') as infile:
+                text = infile.read()
+        except (IOError, NBAUtils.CorruptGameError) as e:
+            log('Can\'t merge {}: {}'.format(src, e))
+            if current is None:
+                manifest.record(gameid, NBAManifest.FAILED, url=entry['url'], prefix=prefix,
+                                error='unreadable in shard {}'.format(os.path.basename(shard_dir)))
+            continue
+
+        NBAScrapeGames.make_dirs(prefix)
+        NBAScrapeGames.write_game(os.path.join(prefix, gameid), text)
+        NBAUtils.index_game(prefix, data)
+        NBAUtils.index_players(prefix, data)
+        aggregates.record_game(data)
+        manifest.record(gameid, status, url=entry['url'], prefix=prefix, nbytes=len(text))
+        copied += 1
+
+    return copied
+
+
+def merge_shards(shard_root=None, compact_years=None):
+    '''
+    Merges every shard under shard_root into FILE_DIR, then compacts the
+    seasons in compact_years into their columnar stores. Returns the number
+    of games copied.
+    '''
+
+    copied = 0
+    for shard_dir, done, _ in shard_status(shard_root):
+        if not done:
+            log('Shard {} is not done; merging what it has'.format(shard_dir))
+        n = merge_shard(shard_dir)
+        log('Merged {} games from {}'.format(n, shard_dir))
+        copied += n
+    for year in compact_years or []:
+        NBAUtils.compact_season(year)
+    return copied
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Backfill seasons in shards.')
+    parser.add_argument('years', nargs='*', type=int,
+                        help='last two digits of the beginning year of each season')
+    parser.add_argument('--shards', type=int, default=1, help='total number of shards')
+    parser.add_argument('--shard', type=int, help='run this one shard (0 to shards - 1)')
+    parser.add_argument('--local', type=int, metavar='N',
+                        help='run N shards as processes on this machine, then merge them')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge every shard under the shard root into FILE_DIR')
+    parser.add_argument('--status', action='store_true', help='print the state of every shard')
+    parser.add_argument('--compact', action='store_true',
+                        help='compact the merged seasons into their columnar stores')
+    parser.add_argument('--shard-root', default=None,
+                        help='folder holding the shard folders (default FILE_DIR/.shards)')
+    parser.add_argument('--workers', type=int, default=NBAScrapeGames.MAX_WORKERS,
+                        help='max number of games fetched at once per shard')
+    parser.add_argument('--rate', type=float, default=NBAHttp.REQUESTS_PER_SECOND,
+                        help='max requests per second (per shard; --local splits it)')
+    parser.add_argument('--base-url', default=NBAScrapeGames.BASE_URL,
+                        help='play-by-play endpoint, e.g. of a local NBAMockServer')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='save regular seasons through NBAScrapeGames.pipeline_games')
+    parser.add_argument('--no-regular', dest='regular', action='store_false')
+    parser.add_argument('--no-playoffs', dest='playoffs', action='store_false')
+    parser.add_argument('--quiet', action='store_true', help="don't print a line for every game")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    NBAMetrics.QUIET = args.quiet
+    NBAScrapeGames.BASE_URL = args.base_url
+    compact_years = args.years if args.compact else None
+
+    if args.status:
+        for shard_dir, done, counts in shard_status(args.shard_root):
+            print '{}: {} | {}'.format(shard_dir, 'done' if done else 'not done', ', '.join(
+                '{} {}'.format(status, n) for status, n in sorted(counts.items())))
+    elif args.merge:
+        print 'Merged {} games'.format(merge_shards(args.shard_root, compact_years))
+    elif args.local:
+        unfinished = run_local(args.years, args.local, args.shard_root, args.regular,
+                               args.playoffs, args.workers, args.rate, args.base_url,
+                               args.pipeline)
+        if unfinished:
+            print 'Shards {} did not finish; run again to resume them'.format(unfinished)
+        print 'Merged {} games'.format(merge_shards(args.shard_root, compact_years))
+    elif args.shard is not None:
+        assert 0 <= args.shard < args.shards
+        NBAHttp.configure(pool_size=args.workers, rate=args.rate)
+        done = run_shard(args.years, args.shard, args.shards, args.shard_root, args.regular,
+                         args.playoffs, args.workers, args.pipeline)
+        print 'Shard {} of {}: {} | {}'.format(args.shard, args.shards,
+                                              'done' if done else 'not done',
+                                              NBAMetrics.METRICS.summary())
+        raise SystemExit(0 if done else 1)
+    else:
+        raise SystemExit('Pass --shard, --local, --merge or --status')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Throughput benchmark for the scraper, run against a local NBAMockServer.
+Reports games/sec, p50/p99 fetch latency, bytes written and the time spent
+in each stage (see NBAMetrics) for save_regular_season and save_playoffs at
+each worker count, and with --pipeline for the regular season saved through
+NBAScrapeGames.pipeline_games with that many fetchers.
+
+    python NBABenchmark.py --games 200 --workers 1 4 16 --latency 0.05 --pipeline
+'''
+
+import argparse
+import shutil
+import tempfile
+import time
+import NBAHttp
+import NBAManifest
+import NBAMetrics
+import NBAMockServer
+import NBAScrapeGames
+import NBAUtils
+
+
+YEAR = 15
+
+
+def run(name, save, workers, server):
+    '''Runs save(YEAR, workers=workers) into a fresh FILE_DIR and returns its report.'''
+
+    file_dir = tempfile.mkdtemp(prefix='nba-bench-')
+    NBAScrapeGames.FILE_DIR = NBAUtils.FILE_DIR = file_dir
+    NBAHttp.configure(pool_size=workers)
+    requests_before = server.counts.get('requests', 0)
+    metrics = NBAMetrics.METRICS
+    metrics.reset()
+
+    start = time.time()
+    save(YEAR, workers=workers)
+    elapsed = time.time() - start
+    stages = metrics.snapshot()['stages']
+
+    manifest = NBAScrapeGames.get_manifest()
+    fetched = manifest.gameids(YEAR, NBAManifest.FETCHED)
+    progress = manifest.progress(YEAR)
+    manifest.close()
+    NBAManifest._manifests.clear()
+    shutil.rmtree(file_dir)
+
+    return {
+        'name': name,
+        'workers': workers,
+        'games': len(fetched),
+        'requests': server.counts.get('requests', 0) - requests_before,
+        'seconds': elapsed,
+        'games_per_sec': len(fetched) / elapsed if elapsed else 0.0,
+        'p50': metrics.percentile('http', 50),
+        'p99': metrics.percentile('http', 99),
+        'bytes': sum(c['bytes'] for c in progress.values()),
+        'stages': dict((stage, s['seconds']) for stage, s in stages.items()),
+    }
+
+
+def pipeline_regular_season(year, workers=1):
+    NBAScrapeGames.pipeline_games(NBAScrapeGames.regular_season_jobs(year), fetchers=workers)
+
+
+def print_report(report):
+    print '{name:>8} workers={workers:<3} games={games:<5} requests={requests:<5} ' \
+          '{games_per_sec:8.1f} games/s  p50={p50_ms:7.1f}ms  p99={p99_ms:7.1f}ms  ' \
+          '{mb:7.2f} MB written'.format(p50_ms=report['p50'] * 1000,
+                                        p99_ms=report['p99'] * 1000,
+                                        mb=report['bytes'] / 1e6, **report)
+    print '{:>8} busy seconds by stage: {}'.format('', '  '.join(
+        '{}={:.2f}'.format(stage, seconds) for stage, seconds in sorted(report['stages'].items())))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the scraper against a mock server.')
+    parser.add_argument('--games', type=int, default=200,
+                        help='regular season games to scrape')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='mean seconds the mock server adds to every response')
+    parser.add_argument('--throttle', type=float, default=0.0,
+                        help='fraction of requests answered with 429')
+    parser.add_argument('--timeouts', type=float, default=0.0,
+                        help='fraction of requests that hang past the client timeout')
+    parser.add_argument('--no-playoffs', dest='playoffs', action='store_false')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='also run the regular season through the staged pipeline')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    NBAMetrics.QUIET = True # the scraper logs every game
+    NBAMockServer.REGULAR_GAMES = args.games
+    NBAScrapeGames.MAX_REGULAR_GAMES = args.games
+    server = NBAMockServer.MockStatsServer(
+        latency=args.latency, throttle_rate=args.throttle, timeout_rate=args.timeouts,
+        hang=NBAHttp.READ_TIMEOUT + 1).start()
+    NBAScrapeGames.BASE_URL = server.base_url
+    NBAHttp.configure(rate=0, backoff_base=0.05, backoff_max=1.0)
+    NBAHttp.BREAKER.cooldown = 1.0
+
+    try:
+        for workers in args.workers:
+            print_report(run('regular', NBAScrapeGames.save_regular_season, workers, server))
+            if args.playoffs:
+                print_report(run('playoffs', NBAScrapeGames.save_playoffs, workers, server))
+            if args.pipeline:
+                print_report(run('pipeline', pipeline_regular_season, workers, server))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+'''
+Layout of a play-by-play row: the column headers of the playbyplayv2
+response and the indexes of the columns the other modules read. Kept free
+of imports so every module, including those NBAUtils itself imports, can
+take them from here.
+'''
+
+
+# Names of the 33 columns of a row, as in the playbyplayv2 response
+ROW_HEADERS = [
+    'GAME_ID', 'EVENTNUM', 'EVENTMSGTYPE', 'EVENTMSGACTIONTYPE', 'PERIOD',
+    'WCTIMESTRING', 'PCTIMESTRING', 'HOMEDESCRIPTION', 'NEUTRALDESCRIPTION',
+    'VISITORDESCRIPTION', 'SCORE', 'SCOREMARGIN',
+    'PERSON1TYPE', 'PLAYER1_ID', 'PLAYER1_NAME', 'PLAYER1_TEAM_ID',
+    'PLAYER1_TEAM_CITY', 'PLAYER1_TEAM_NICKNAME', 'PLAYER1_TEAM_ABBREVIATION',
+    'PERSON2TYPE', 'PLAYER2_ID', 'PLAYER2_NAME', 'PLAYER2_TEAM_ID',
+    'PLAYER2_TEAM_CITY', 'PLAYER2_TEAM_NICKNAME', 'PLAYER2_TEAM_ABBREVIATION',
+    'PERSON3TYPE', 'PLAYER3_ID', 'PLAYER3_NAME', 'PLAYER3_TEAM_ID',
+    'PLAYER3_TEAM_CITY', 'PLAYER3_TEAM_NICKNAME', 'PLAYER3_TEAM_ABBREVIATION',
+]
+
+GAMEID_INDEX = 0
+EVENT_NUM_INDEX = 1
+EVENT_TYPE_INDEX = 2
+ACTION_TYPE_INDEX = 3
+PERIOD_INDEX = 4
+PERIOD_TIME_INDEX = 6
+SCORE_INDEX = 10
+PLAYER_ID_INDICES = [13, 20, 27]
+PLAYER_NAME_INDICES = [14, 21, 28]
+TABBREV_INDICES = [18, 25, 32]
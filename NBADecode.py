@@ -0,0 +1,178 @@
+'''
+Batch decoding of play-by-play rows into NumPy arrays. A whole game, or a
+whole season, is turned into typed columns in one pass instead of parsing
+the clock and score of every row in a Python loop.
+'''
+
+import os
+import numpy as np
+import NBAStore
+import NBAUtils
+from NBAColumns import EVENT_TYPE_INDEX, PERIOD_INDEX, PERIOD_TIME_INDEX, SCORE_INDEX
+
+
+PERIOD_LENGTH = 12 * 60
+OT_LENGTH = 5 * 60
+NUM_PERIODS = 4 # regulation
+NO_SCORE = -1   # score of rows that don't carry one
+
+
+def period_start(period):
+    '''Seconds elapsed in the game when period starts. Works on arrays too.'''
+
+    period = np.asarray(period)
+    return np.where(period <= NUM_PERIODS,
+                    (period - 1) * PERIOD_LENGTH,
+                    NUM_PERIODS * PERIOD_LENGTH + (period - NUM_PERIODS - 1) * OT_LENGTH)
+
+
+def period_length(period):
+    '''Length in seconds of period (overtimes are shorter). Works on arrays too.'''
+
+    return np.where(np.asarray(period) <= NUM_PERIODS, PERIOD_LENGTH, OT_LENGTH)
+
+
+def game_length(max_period):
+    '''Length in seconds of a game that went to max_period. Works on arrays too.'''
+
+    return period_start(max_period) + period_length(max_period)
+
+
+def decode_clocks(clocks):
+    '''Turns a sequence of 'M:SS' strings into an int array of seconds (0 for None).'''
+
+    clocks = np.array(['0:00' if c is None else c for c in clocks], dtype=str)
+    if not len(clocks):
+        return np.zeros(0, dtype=np.int32)
+    minutes, _, seconds = np.char.partition(clocks, ':').T
+    return minutes.astype(np.int32) * 60 + seconds.astype(np.int32)
+
+
+def decode_scores(scores):
+    '''
+    Turns a sequence of 'away - home' strings (or None) into two int arrays
+    (away, home), with NO_SCORE where a row has no score.
+    '''
+
+    scores = np.array(['' if s is None else s for s in scores], dtype=str)
+    away = np.full(len(scores), NO_SCORE, dtype=np.int32)
+    home = np.full(len(scores), NO_SCORE, dtype=np.int32)
+    has_score = scores != ''
+    if has_score.any():
+        left, _, right = np.char.partition(scores[has_score], '-').T
+        away[has_score] = np.char.strip(left).astype(np.int32)
+        home[has_score] = np.char.strip(right).astype(np.int32)
+    return (away, home)
+
+
+def fill_scores(scores):
+    '''Carries the last known score forward over NO_SCORE rows (0 before the first).'''
+
+    scores = np.asarray(scores)
+    known = np.where(scores != NO_SCORE, np.arange(len(scores)), -1)
+    last = np.maximum.accumulate(known) if len(scores) else known
+    return np.where(last >= 0, scores[np.maximum(last, 0)], 0)
+
+
+def decode_columns(period, clocks, scores, event_type):
+    '''Builds the decoded arrays from the raw period, clock, score and event type columns.'''
+
+    period = np.asarray(period, dtype=np.int32)
+    seconds_left = decode_clocks(clocks)
+    away, home = decode_scores(scores)
+    return {
+        'period': period,
+        'seconds_left': seconds_left,
+        'seconds_elapsed': period_start(period) + period_length(period) - seconds_left,
+        'away_score': away,
+        'home_score': home,
+        'event_type': np.asarray(event_type, dtype=np.int32),
+    }
+
+
+def decode_game(data):
+    '''
+    Decodes all rows of a game (list of lists) into a dict of arrays:
+    period, seconds_left, seconds_elapsed, away_score, home_score and
+    event_type. Overtime periods are 5 minutes long.
+    '''
+
+    columns = zip(*data) if data else [()] * (SCORE_INDEX + 1)
+    return decode_columns(columns[PERIOD_INDEX], columns[PERIOD_TIME_INDEX],
+                          columns[SCORE_INDEX], columns[EVENT_TYPE_INDEX])
+
+
+def decode_store(store):
+    '''
+    Decodes every row of a SeasonStore at once. Dictionary encoded columns
+    (clock, score) are decoded once per distinct value and then looked up by
+    code. Also returns the gameids and row offsets of the store.
+    '''
+
+    def lookup(i, decode):
+        codes = np.asarray(store.column(i))
+        vocab = store.vocabs[i]
+        if vocab is None: # only nulls, which are stored as an int column
+            return decode([None] * len(codes))
+        decoded = decode(vocab + [None]) # code -1 (null) picks the trailing entry
+        if isinstance(decoded, tuple):
+            return tuple(d[codes] for d in decoded)
+        return decoded[codes]
+
+    seconds_left = lookup(PERIOD_TIME_INDEX, decode_clocks)
+    away, home = lookup(SCORE_INDEX, decode_scores)
+    period = np.asarray(store.column(PERIOD_INDEX)).astype(np.int32)
+    return {
+        'gameids': list(store.gameids),
+        'offsets': np.array(store.offsets),
+        'period': period,
+        'seconds_left': seconds_left,
+        'seconds_elapsed': period_start(period) + period_length(period) - seconds_left,
+        'away_score': away,
+        'home_score': home,
+        'event_type': np.asarray(store.column(EVENT_TYPE_INDEX)).astype(np.int32),
+    }
+
+
+def decode_path(path):
+    '''
+    Decodes every game saved at path (a season or round folder) into one set
+    of arrays, like decode_store. Games still saved as JSON are decoded too.
+    '''
+
+    store = NBAStore.open_store(path)
+    stored = set(store.gameids) if store else set()
+    rows = []
+    gameids = []
+    offsets = [0]
+    for gameid in NBAUtils.game_ids(path):
+        if gameid in stored:
+            continue
+        data = NBAUtils.load_game(path, gameid)
+        rows.extend(data)
+        gameids.append(gameid)
+        offsets.append(offsets[-1] + len(data))
+
+    decoded = decode_game(rows)
+    decoded['gameids'] = gameids
+    decoded['offsets'] = np.array(offsets)
+    if not store:
+        return decoded
+
+    from_store = decode_store(store)
+    merged = {}
+    for key in decoded:
+        if key == 'gameids':
+            merged[key] = from_store[key] + decoded[key]
+        elif key == 'offsets':
+            merged[key] = np.concatenate([from_store[key],
+                                          decoded[key][1:] + from_store[key][-1]])
+        else:
+            merged[key] = np.concatenate([from_store[key], decoded[key]])
+    return merged
+
+
+def decode_season(year):
+    '''Decodes every regular season row of a year. See decode_path.'''
+
+    return decode_path(os.path.join(NBAUtils.FILE_DIR, NBAUtils.season_dirname(year)))
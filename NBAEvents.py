@@ -0,0 +1,269 @@
+'''
+Compact in-memory representation of a game's play-by-play.
+
+Instead of a list of 33-element lists per game, a PlayByPlay keeps one
+small NumPy array per useful column (struct of arrays). Clocks and scores
+are stored as ints, and player names and team abbreviations as codes into
+vocabularies shared by every game in the process, so each distinct string
+is held once. Descriptions, locations and other unused columns are dropped.
+
+Indexing a PlayByPlay gives an Event, a two-slot view with named accessors.
+Events also answer row[i] for the kept columns with the same values as the
+raw row, so helpers written against rows keep working.
+'''
+
+import os
+import threading
+import numpy as np
+import NBADecode
+import NBAStore
+import NBAUtils
+from NBAColumns import ACTION_TYPE_INDEX, EVENT_NUM_INDEX, EVENT_TYPE_INDEX, GAMEID_INDEX, \
+    PERIOD_INDEX, PERIOD_TIME_INDEX, PLAYER_ID_INDICES, PLAYER_NAME_INDICES, SCORE_INDEX, \
+    TABBREV_INDICES
+
+
+NULL = -1 # code / id of a missing value
+
+
+class Vocabulary(object):
+    '''Interns strings as small int codes. Shared by every game, safe across threads.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        if value is None:
+            return NULL
+        code = self.codes.get(value)
+        if code is None:
+            with self.lock:
+                code = self.codes.get(value)
+                if code is None:
+                    code = self.codes[value] = len(self.values)
+                    self.values.append(value)
+        return code
+
+    def encode_all(self, values):
+        return np.array([self.encode(v) for v in values], dtype=np.int32)
+
+    def decode(self, code):
+        return None if code == NULL else self.values[code]
+
+
+PLAYER_NAMES = Vocabulary()
+TEAM_ABBREVS = Vocabulary()
+
+
+def nullable_ints(values):
+    return np.array([NULL if v is None else v for v in values], dtype=np.int64)
+
+
+class PlayByPlay(object):
+    '''All events of one game, column by column.'''
+
+    __slots__ = ('gameid', 'event_num', 'event_type', 'action_type', 'period',
+                 'seconds_left', 'away_score', 'home_score', 'player_ids',
+                 'player_names', 'team_abbrevs')
+
+    @classmethod
+    def from_rows(cls, data):
+        '''Builds a PlayByPlay from all rows of a game (list of lists).'''
+
+        self = cls()
+        columns = zip(*data) if data else [()] * (TABBREV_INDICES[-1] + 1)
+        decoded = NBADecode.decode_game(data)
+        self.gameid = str(data[0][GAMEID_INDEX]) if data else None
+        self.event_num = nullable_ints(columns[EVENT_NUM_INDEX]).astype(np.int32)
+        self.event_type = decoded['event_type'].astype(np.int8)
+        self.action_type = nullable_ints(columns[ACTION_TYPE_INDEX]).astype(np.int16)
+        self.period = decoded['period'].astype(np.int8)
+        self.seconds_left = decoded['seconds_left'].astype(np.int16)
+        self.away_score = decoded['away_score'].astype(np.int16)
+        self.home_score = decoded['home_score'].astype(np.int16)
+        self.player_ids = np.column_stack(
+            [nullable_ints(columns[i]) for i in PLAYER_ID_INDICES]).astype(np.int32)
+        self.player_names = np.column_stack(
+            [PLAYER_NAMES.encode_all(columns[i]) for i in PLAYER_NAME_INDICES])
+        self.team_abbrevs = np.column_stack(
+            [TEAM_ABBREVS.encode_all(columns[i]) for i in TABBREV_INDICES]).astype(np.int16)
+        return self
+
+    @classmethod
+    def from_store(cls, store, gameid):
+        '''
+        Builds a PlayByPlay for gameid straight from a SeasonStore's column
+        arrays, without making row lists. Store codes are mapped to the
+        shared vocabularies once per distinct value.
+        '''
+
+        start, stop = store.game_slice(gameid)
+
+        def ints(i):
+            array = np.asarray(store.column(i)[start:stop])
+            if store.kinds[i] == NBAStore.DICT: # not all ints after all
+                return nullable_ints(store.decode(i, start, stop))
+            return np.where(array == np.iinfo(array.dtype).min, NULL, array).astype(np.int64)
+
+        def codes(i, vocab):
+            if store.kinds[i] == NBAStore.INT: # only nulls
+                return np.full(stop - start, NULL, dtype=np.int32)
+            mapping = vocab.encode_all(store.vocabs[i] + [None]) # -1 picks the None
+            return mapping[np.asarray(store.column(i)[start:stop])]
+
+        self = cls()
+        self.gameid = gameid
+        self.event_num = ints(EVENT_NUM_INDEX).astype(np.int32)
+        self.event_type = ints(EVENT_TYPE_INDEX).astype(np.int8)
+        self.action_type = ints(ACTION_TYPE_INDEX).astype(np.int16)
+        self.period = ints(PERIOD_INDEX).astype(np.int8)
+        self.seconds_left = NBADecode.decode_clocks(
+            store.decode(PERIOD_TIME_INDEX, start, stop)).astype(np.int16)
+        away, home = NBADecode.decode_scores(store.decode(SCORE_INDEX, start, stop))
+        self.away_score = away.astype(np.int16)
+        self.home_score = home.astype(np.int16)
+        self.player_ids = np.column_stack(
+            [ints(i) for i in PLAYER_ID_INDICES]).astype(np.int32)
+        self.player_names = np.column_stack(
+            [codes(i, PLAYER_NAMES) for i in PLAYER_NAME_INDICES])
+        self.team_abbrevs = np.column_stack(
+            [codes(i, TEAM_ABBREVS) for i in TABBREV_INDICES]).astype(np.int16)
+        return self
+
+    def __len__(self):
+        return len(self.period)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return Event(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Event(self, i)
+
+    @property
+    def seconds_elapsed(self):
+        period = self.period.astype(np.int32)
+        return (NBADecode.period_start(period) + NBADecode.period_length(period)
+                - self.seconds_left)
+
+    def teams(self):
+        '''Returns the two teams involved, in order of first appearance.'''
+
+        codes = self.team_abbrevs.ravel() # row by row, like get_teams
+        codes = codes[codes != NULL]
+        _, first = np.unique(codes, return_index=True)
+        return [TEAM_ABBREVS.decode(codes[i]) for i in sorted(first)[:2]]
+
+    def nbytes(self):
+        '''Returns the bytes held by the column arrays.'''
+
+        return sum(getattr(self, name).nbytes for name in self.__slots__ if name != 'gameid')
+
+
+class Event(object):
+    '''One event of a PlayByPlay.'''
+
+    __slots__ = ('pbp', 'i')
+
+    def __init__(self, pbp, i):
+        self.pbp = pbp
+        self.i = i
+
+    @property
+    def gameid(self):
+        return self.pbp.gameid
+
+    @property
+    def event_type(self):
+        return int(self.pbp.event_type[self.i])
+
+    @property
+    def period(self):
+        return int(self.pbp.period[self.i])
+
+    @property
+    def seconds_left(self):
+        return int(self.pbp.seconds_left[self.i])
+
+    @property
+    def seconds_elapsed(self):
+        period = self.period
+        return int(NBADecode.period_start(period) + NBADecode.period_length(period)
+                   - self.seconds_left)
+
+    @property
+    def clock(self):
+        return '{}:{:02d}'.format(self.seconds_left // 60, self.seconds_left % 60)
+
+    @property
+    def score(self):
+        '''Returns [awayScore, homeScore], or None if the event has no score.'''
+
+        away = int(self.pbp.away_score[self.i])
+        if away == NBADecode.NO_SCORE:
+            return None
+        return [away, int(self.pbp.home_score[self.i])]
+
+    @property
+    def player_ids(self):
+        return [None if v == NULL else int(v) for v in self.pbp.player_ids[self.i]]
+
+    @property
+    def player_names(self):
+        return [PLAYER_NAMES.decode(c) for c in self.pbp.player_names[self.i]]
+
+    @property
+    def team_abbrevs(self):
+        return [TEAM_ABBREVS.decode(c) for c in self.pbp.team_abbrevs[self.i]]
+
+    def __getitem__(self, index):
+        '''Returns column index of the raw row, for the columns that are kept.'''
+
+        if index == GAMEID_INDEX:
+            return self.gameid
+        if index == EVENT_NUM_INDEX:
+            return int(self.pbp.event_num[self.i])
+        if index == EVENT_TYPE_INDEX:
+            return self.event_type
+        if index == ACTION_TYPE_INDEX:
+            return int(self.pbp.action_type[self.i])
+        if index == PERIOD_INDEX:
+            return self.period
+        if index == PERIOD_TIME_INDEX:
+            return self.clock
+        if index == SCORE_INDEX:
+            score = self.score
+            return '{} - {}'.format(*score) if score else None
+        for indices, values in ((PLAYER_ID_INDICES, self.player_ids),
+                                (PLAYER_NAME_INDICES, self.player_names),
+                                (TABBREV_INDICES, self.team_abbrevs)):
+            if index in indices:
+                return values[indices.index(index)]
+        raise KeyError('Column {} is not kept by PlayByPlay'.format(index))
+
+
+def load_events(path, gameid):
+    '''
+    Returns the PlayByPlay of a game saved at path. Compacted games are read
+    from the store's columns directly; others go through NBAUtils.load_game.
+    '''
+
+    fpath = os.path.join(path, gameid)
+    if not os.path.isfile(fpath):
+        store = NBAStore.open_store(path)
+        if store and gameid in store:
+            return PlayByPlay.from_store(store, gameid)
+    return PlayByPlay.from_rows(NBAUtils.load_game(path, gameid))
+
+
+def events_generator(path):
+    '''Generator of the PlayByPlay of every game saved at path.'''
+
+    for gameid in NBAUtils.game_ids(path):
+        yield load_events(path, gameid)
@@ -0,0 +1,145 @@
+'''
+Crash-safe file writes. A file is written to a hidden temp file next to its
+final path, fsynced, and renamed over the final path, so readers only ever
+see the old file or the complete new one, never a truncated one.
+
+fsync is the expensive part. With a GroupCommit, writes from many threads
+are batched: each writer leaves its temp file unsynced, and one of them
+syncs and renames the whole batch, then wakes the others. A write still
+only returns once its file is durable.
+'''
+
+import os
+import threading
+import time
+
+
+SYNC = True # fsync before renaming; off trades durability for speed
+
+
+def temp_path(path):
+    '''Returns a hidden temp path in the same folder as path (so rename is atomic).'''
+
+    folder, name = os.path.split(path)
+    return os.path.join(folder, '.{}.tmp-{}-{}'.format(
+        name, os.getpid(), threading.current_thread().ident))
+
+
+def fsync_path(path):
+    '''fsyncs a file or folder by path.'''
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_temp(path, data, sync=SYNC):
+    '''Writes data to a temp file for path and returns the temp file's path.'''
+
+    tmp_path = temp_path(path)
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(data)
+        outfile.flush()
+        if sync:
+            os.fsync(outfile.fileno())
+    return tmp_path
+
+
+def atomic_write(path, data, sync=None):
+    '''Replaces path with data atomically. With sync, the write is durable on return.'''
+
+    sync = SYNC if sync is None else sync
+    tmp_path = write_temp(path, data, sync=sync)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+    if sync:
+        fsync_path(os.path.dirname(path) or '.')
+
+
+class Batch(object):
+    def __init__(self):
+        self.entries = [] # (temp path, final path)
+        self.leader = False
+        self.done = False
+        self.error = None
+
+
+class GroupCommit(object):
+    '''
+    Shares the cost of fsync between concurrent writers. The first writer of
+    a batch waits up to max_delay seconds for others to join (or until
+    max_batch files are waiting), then syncs every file of the batch, renames
+    them into place and syncs their folders once. Safe to share between threads.
+    '''
+
+    def __init__(self, max_batch=32, max_delay=0.05):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.cond = threading.Condition()
+        self.pending = Batch()
+        self.commits = 0
+        self.files = 0
+
+    def write(self, path, data):
+        '''Replaces path with data; returns once the batch holding it is committed.'''
+
+        tmp_path = write_temp(path, data, sync=False)
+        with self.cond:
+            batch = self.pending
+            if len(batch.entries) >= self.max_batch: # full, its leader just hasn't woken up
+                batch = self.pending = Batch()
+            batch.entries.append((tmp_path, path))
+            if len(batch.entries) >= self.max_batch:
+                self.cond.notify_all()
+            if batch.leader:
+                while not batch.done:
+                    self.cond.wait()
+                if batch.error:
+                    raise batch.error
+                return
+
+            batch.leader = True
+            deadline = time.time() + self.max_delay
+            while len(batch.entries) < self.max_batch and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+            if self.pending is batch:
+                self.pending = Batch() # later writers start the next batch
+
+        try:
+            self.commit(batch.entries)
+        except BaseException as e: # every writer of the batch has to hear about it
+            batch.error = e
+            raise
+        finally:
+            with self.cond:
+                batch.done = True
+                self.cond.notify_all()
+
+    def commit(self, entries):
+        '''Syncs and renames a batch. If that fails, the temp files not yet renamed are removed.'''
+
+        renamed = 0
+        try:
+            if SYNC:
+                for tmp_path, _ in entries:
+                    fsync_path(tmp_path)
+            for tmp_path, path in entries:
+                os.rename(tmp_path, path)
+                renamed += 1
+        except BaseException:
+            for tmp_path, _ in entries[renamed:]:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            raise
+        if SYNC:
+            for folder in set(os.path.dirname(path) or '.' for _, path in entries):
+                fsync_path(folder)
+        self.commits += 1
+        self.files += len(entries)
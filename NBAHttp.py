@@ -0,0 +1,242 @@
+'''
+Shared HTTP layer for requests to stats.nba.com.
+
+All fetches go through one requests.Session so connections are pooled and
+kept alive between games instead of doing a new TCP handshake per request.
+'''
+
+import email.utils
+import random
+import threading
+import time
+import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from NBAMetrics import count
+
+
+POOL_SIZE = 8        # keep-alive connections kept per host
+CONNECT_TIMEOUT = 2  # seconds
+READ_TIMEOUT = 2     # seconds
+REQUESTS_PER_SECOND = 4.0 # per host, shared by all threads
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0   # seconds, doubled after every failed attempt
+BACKOFF_MAX = 60.0   # seconds
+RETRY_STATUSES = set([429, 500, 502, 503, 504])
+THROTTLE_STATUSES = set([429, 503])
+BODY_ERRORS = (requests.ConnectionError, requests.Timeout, # while reading a streamed body
+               requests.exceptions.ChunkedEncodingError,
+               requests.exceptions.ContentDecodingError)
+BREAKER_THRESHOLD = 3 # consecutive throttled responses before pausing everyone
+BREAKER_COOLDOWN = 30.0 # seconds
+HEADERS = {
+    'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12) AppleWebKit/602.1.43 (KHTML, like Gecko) Version/10.0 Safari/602.1.43',
+    'referer': 'http://stats.nba.com/scores/',
+    'accept-encoding': 'gzip, deflate',
+    'connection': 'keep-alive',
+}
+
+
+class RateLimiter(object):
+    '''
+    Spaces out requests to each host so that all threads together make at
+    most `rate` requests per second to it. A rate of None means no limit.
+    '''
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = {} # host -> earliest time the next request may start
+
+    def wait(self, host):
+        '''Blocks until a request to host is allowed.'''
+
+        if not self.rate:
+            return
+
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_time.get(host, now))
+            self.next_time[host] = start + 1.0 / self.rate
+
+        if start > now:
+            time.sleep(start - now)
+
+
+class CircuitBreaker(object):
+    '''
+    Pauses every thread once upstream has throttled `threshold` requests in a
+    row. While open, wait() blocks until the cooldown (or a longer Retry-After)
+    has passed. Any successful response closes it again.
+    '''
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.throttled = 0
+        self.open_until = 0
+
+    def wait(self):
+        '''Blocks while the breaker is open.'''
+
+        while True:
+            with self.lock:
+                delay = self.open_until - time.time()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def record_success(self):
+        with self.lock:
+            self.throttled = 0
+
+    def record_throttle(self, retry_after=None):
+        with self.lock:
+            self.throttled += 1
+            if self.throttled >= self.threshold:
+                pause = max(self.cooldown, retry_after or 0)
+                self.open_until = max(self.open_until, time.time() + pause)
+
+
+class FetchError(requests.RequestException):
+    '''Raised when a request still fails after all retries.'''
+
+
+RATE_LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+BREAKER = CircuitBreaker()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(pool_size=POOL_SIZE):
+    '''Creates a session with HEADERS set and a keep-alive pool of pool_size.'''
+
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    '''Returns the shared session, creating it on first use.'''
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session(POOL_SIZE)
+        return _session
+
+
+def configure(pool_size=None, connect_timeout=None, read_timeout=None, rate=None,
+              max_retries=None, backoff_base=None, backoff_max=None):
+    '''
+    Changes the settings of the shared HTTP layer. Only the passed-in values
+    are changed. Changing pool_size replaces the shared session.
+    '''
+
+    global _session, POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT
+    global MAX_RETRIES, BACKOFF_BASE, BACKOFF_MAX
+
+    if pool_size is not None:
+        with _session_lock:
+            POOL_SIZE = pool_size
+            if _session is not None:
+                _session.close()
+            _session = create_session(pool_size)
+    if connect_timeout is not None:
+        CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        READ_TIMEOUT = read_timeout
+    if rate is not None:
+        RATE_LIMITER.rate = rate
+    if max_retries is not None:
+        MAX_RETRIES = max_retries
+    if backoff_base is not None:
+        BACKOFF_BASE = backoff_base
+    if backoff_max is not None:
+        BACKOFF_MAX = backoff_max
+
+
+def parse_retry_after(response):
+    '''Returns the Retry-After header of response in seconds, or None.'''
+
+    value = response.headers.get('retry-after')
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    parsed = email.utils.parsedate_tz(value) # HTTP-date form
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+
+def backoff_delay(attempt):
+    '''Exponential backoff with full jitter for the given (0-based) attempt.'''
+
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def fetch(base, params=None, consume=None, **kwargs):
+    '''
+    GETs base with params through the shared session, waiting on the circuit
+    breaker and rate limiter first. Timeouts, connection errors and
+    RETRY_STATUSES are retried up to MAX_RETRIES times with exponential
+    backoff and jitter, honoring Retry-After. Other non-2xx responses raise
+    right away; running out of retries raises FetchError.
+
+    With consume set (for stream=True), consume(response) is called to read
+    the body and its result is returned instead of the response. A body cut
+    short by a timeout or a dropped connection is retried like a failed
+    request, so consume must start over on every call.
+    '''
+
+    host = urlparse.urlparse(base).netloc
+    error = None
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            count('retries')
+            time.sleep(delay)
+
+        BREAKER.wait()
+        RATE_LIMITER.wait(host)
+        try:
+            response = get_session().get(base, params=params,
+                                         timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            count('timeouts' if isinstance(e, requests.Timeout) else 'connection_errors')
+            error = e
+            delay = backoff_delay(attempt)
+            continue
+
+        if response.status_code in RETRY_STATUSES:
+            error = requests.HTTPError('{} for url {}'.format(response.status_code, response.url),
+                                       response=response)
+            retry_after = parse_retry_after(response)
+            if response.status_code in THROTTLE_STATUSES:
+                count('throttled')
+                BREAKER.record_throttle(retry_after)
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            response.close()
+            continue
+
+        response.raise_for_status() # Raise exception if invalid response
+        count('requests')
+        BREAKER.record_success()
+        if consume is None:
+            return response
+        try:
+            return consume(response)
+        except BODY_ERRORS as e:
+            count('timeouts' if isinstance(e, requests.Timeout) else 'body_errors')
+            error = e
+            delay = backoff_delay(attempt)
+            response.close()
+
+    count('fetch_errors')
+    raise FetchError('Giving up on {} after {} attempts: {}'.format(
+        base, MAX_RETRIES + 1, error))
@@ -0,0 +1,149 @@
+'''
+Persistent record of what has been scraped, so resumed runs know which
+games are done, which don't exist and which failed without touching the
+game files or the network.
+'''
+
+import os
+import sqlite3
+import threading
+import time
+
+
+MANIFEST_FNAME = 'manifest.db' # lives directly under FILE_DIR
+
+# Game statuses
+FETCHED = 'fetched'  # saved to disk
+PARTIAL = 'partial'  # saved to disk, but the game wasn't over yet
+EMPTY = 'empty'      # upstream returned no rows, i.e. the game doesn't exist
+FAILED = 'failed'    # request kept failing, see the error column
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    gameid      TEXT PRIMARY KEY,
+    season      TEXT,
+    season_type TEXT,
+    status      TEXT,
+    url         TEXT,
+    prefix      TEXT,
+    bytes       INTEGER,
+    fetched_at  REAL,
+    error       TEXT
+)
+'''
+
+
+def season_of(gameid):
+    '''Returns (season, season_type) of a gameid, e.g. ('15', '2') for 0021500001.'''
+
+    return (gameid[3:5], gameid[2])
+
+
+class Manifest(object):
+    '''
+    SQLite backed table of gameid -> status. Statuses are also kept in memory,
+    so status() lookups never hit the disk. Safe to share between threads.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(SCHEMA)
+        self.statuses = dict(self.conn.execute('SELECT gameid, status FROM games'))
+
+    def status(self, gameid):
+        '''Returns the status of gameid, or None if it has never been tried.'''
+
+        return self.statuses.get(gameid)
+
+    def record(self, gameid, status, url=None, prefix=None, nbytes=None, error=None):
+        '''Records the outcome of fetching gameid.'''
+
+        season, season_type = season_of(gameid)
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (gameid, season, season_type, status, url, prefix, nbytes,
+                 time.time(), error))
+            self.statuses[gameid] = status
+
+    def entry(self, gameid):
+        '''Returns the full row for gameid as a dict, or None.'''
+
+        with self.lock:
+            cursor = self.conn.execute('SELECT * FROM games WHERE gameid = ?', (gameid,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([d[0] for d in cursor.description], row))
+
+    def gameids(self, year=None, status=None):
+        '''Returns the sorted gameids for a season and/or status.'''
+
+        query = 'SELECT gameid FROM games WHERE 1'
+        args = []
+        if year is not None:
+            query += ' AND season = ?'
+            args.append('{:02d}'.format(int(year)))
+        if status is not None:
+            query += ' AND status = ?'
+            args.append(status)
+        with self.lock:
+            return [r[0] for r in self.conn.execute(query + ' ORDER BY gameid', args)]
+
+    def recent(self, year, since):
+        '''Returns the sorted gameids of a season saved at or after time since.'''
+
+        with self.lock:
+            return [r[0] for r in self.conn.execute(
+                'SELECT gameid FROM games WHERE season = ? AND status IN (?, ?) '
+                'AND fetched_at >= ? ORDER BY gameid',
+                ('{:02d}'.format(int(year)), FETCHED, PARTIAL, since))]
+
+    def failed(self):
+        '''Returns the (url, prefix) jobs of every failed game.'''
+
+        with self.lock:
+            return list(self.conn.execute(
+                'SELECT url, prefix FROM games WHERE status = ? ORDER BY gameid', (FAILED,)))
+
+    def progress(self, year):
+        '''
+        Returns a dict of season_type -> {status: count, 'bytes': total bytes}
+        for a season.
+        '''
+
+        report = {}
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT season_type, status, COUNT(*), SUM(bytes) FROM games '
+                'WHERE season = ? GROUP BY season_type, status',
+                ('{:02d}'.format(int(year)),))
+            for season_type, status, count, nbytes in rows:
+                counts = report.setdefault(season_type, {'bytes': 0})
+                counts[status] = count
+                counts['bytes'] += nbytes or 0
+        return report
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(file_dir):
+    '''Returns the shared Manifest for the data rooted at file_dir.'''
+
+    path = os.path.abspath(os.path.join(file_dir, MANIFEST_FNAME))
+    with _manifests_lock:
+        if path not in _manifests:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            _manifests[path] = Manifest(path)
+        return _manifests[path]
@@ -0,0 +1,204 @@
+'''
+Counters and per-stage timers for the scraper, so a run can tell whether it
+is network-, parse- or disk-bound without printing every game.
+
+Stages are timed with `with timed('http'):` and counters bumped with
+count('empty_games'). Everything lands in the shared METRICS registry, which
+can be exported as Prometheus text (e.g. for node_exporter's textfile
+collector) or appended as JSON lines:
+
+    python NBAScrapeGames.py 15 --quiet --metrics metrics.jsonl --metrics-interval 10
+'''
+
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+PREFIX = 'nba_scrape_'
+BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0] # seconds
+MAX_SAMPLES = 10000 # recent durations kept per stage for percentiles
+QUIET = False # when set, log() prints nothing
+
+
+class StageTimer(object):
+    '''Count, total, max, histogram and recent samples of one stage's durations.'''
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.samples = collections.deque(maxlen=MAX_SAMPLES)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.samples.append(seconds)
+
+    def percentile(self, p):
+        '''Returns the p-th percentile (0-100) of the recent samples, nearest rank.'''
+
+        if not self.samples:
+            return 0.0
+        values = sorted(self.samples)
+        return values[int(round(p / 100.0 * (len(values) - 1)))]
+
+
+class Registry(object):
+    '''Named counters and stage timers. Safe to share between threads.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = collections.defaultdict(int)
+            self.timers = collections.defaultdict(StageTimer)
+            self.started = time.time()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.timers[stage].observe(seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        '''Times the with block as one run of stage, even if it raises.'''
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.time() - start)
+
+    def percentile(self, stage, p):
+        with self.lock:
+            return self.timers[stage].percentile(p) if stage in self.timers else 0.0
+
+    def snapshot(self):
+        '''Returns the current values as a JSON-serializable dict.'''
+
+        with self.lock:
+            return {
+                'time': time.time(),
+                'uptime': time.time() - self.started,
+                'counters': dict(self.counters),
+                'stages': dict((stage, {
+                    'count': t.count,
+                    'seconds': t.total,
+                    'max': t.max,
+                    'p50': t.percentile(50),
+                    'p99': t.percentile(99),
+                }) for stage, t in self.timers.items()),
+            }
+
+    def prometheus(self):
+        '''Returns the metrics in the Prometheus text exposition format.'''
+
+        lines = []
+        with self.lock:
+            for name in sorted(self.counters):
+                metric = PREFIX + name + '_total'
+                lines.append('# TYPE {} counter'.format(metric))
+                lines.append('{} {}'.format(metric, self.counters[name]))
+
+            metric = PREFIX + 'stage_seconds'
+            lines.append('# TYPE {} histogram'.format(metric))
+            for stage in sorted(self.timers):
+                t = self.timers[stage]
+                for bound, n in zip(BUCKETS, t.buckets):
+                    lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                        metric, stage, bound, n))
+                lines.append('{}_bucket{{stage="{}",le="+Inf"}} {}'.format(metric, stage, t.count))
+                lines.append('{}_sum{{stage="{}"}} {}'.format(metric, stage, t.total))
+                lines.append('{}_count{{stage="{}"}} {}'.format(metric, stage, t.count))
+        return '\n'.join(lines) + '\n'
+
+    def json_line(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def write(self, path, fmt='jsonl'):
+        '''
+        Exports the metrics to path. JSON lines are appended, one line per
+        call; Prometheus text replaces the file atomically.
+        '''
+
+        if fmt == 'jsonl':
+            with open(path, 'a') as outfile:
+                outfile.write(self.json_line() + '\n')
+        elif fmt == 'prometheus':
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as outfile:
+                outfile.write(self.prometheus())
+            os.rename(tmp_path, path)
+        else:
+            raise ValueError('Unknown metrics format {}'.format(fmt))
+
+    def summary(self):
+        '''Returns a one-line human readable breakdown of where the time went.'''
+
+        snapshot = self.snapshot()
+        stages = ', '.join('{} {:.2f}s/{}'.format(stage, s['seconds'], s['count'])
+                           for stage, s in sorted(snapshot['stages'].items()))
+        counters = ', '.join('{} {}'.format(name, n)
+                             for name, n in sorted(snapshot['counters'].items()))
+        return 'stages: {} | counters: {}'.format(stages or '-', counters or '-')
+
+
+class MetricsWriter(object):
+    '''Exports the registry to a file every interval seconds on a background thread.'''
+
+    def __init__(self, registry, path, fmt='jsonl', interval=10.0):
+        self.registry = registry
+        self.path = path
+        self.fmt = fmt
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.registry.write(self.path, self.fmt)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        '''Stops the thread and writes a final export.'''
+
+        self.stopped.set()
+        self.thread.join()
+        self.registry.write(self.path, self.fmt)
+
+
+METRICS = Registry()
+
+
+def count(name, n=1):
+    METRICS.count(name, n)
+
+
+def timed(stage):
+    return METRICS.timed(stage)
+
+
+def log(message):
+    '''Prints a progress message unless QUIET is set.'''
+
+    if not QUIET:
+        sys.stdout.write(message + '\n')
@@ -0,0 +1,296 @@
+'''
+Local stand-in for the stats.nba.com play-by-play endpoint, so the scraper
+can be tested and benchmarked offline.
+
+Games are served from a folder of recorded payloads (either saved game files,
+i.e. a rowSet, or full playbyplayv2 responses) named by GameID. GameIDs with
+no recording get a synthetic game if they are in the configured season,
+and an empty rowSet otherwise, just like upstream. Responses carry an
+ETag and honor If-None-Match. Latency, 429s, requests that hang past the
+client's timeout and bodies that stall halfway through can be injected.
+
+    python NBAMockServer.py --port 8000 --latency 0.05 --throttle 0.01
+    python NBAScrapeGames.py 15 --base-url http://127.0.0.1:8000/stats/playbyplayv2
+'''
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from cStringIO import StringIO
+from NBAUtils import ROW_HEADERS, TEAMS
+
+
+PATH = '/stats/playbyplayv2'
+REGULAR_GAMES = 1230
+PLAYOFF_ROUNDS = 4
+EVENTS_PER_GAME = 450
+SORTED_TEAMS = sorted(TEAMS)
+
+
+##### SYNTHETIC GAMES
+def synthetic_row(gameid, event, event_type, period, clock, score=None, team=None,
+                  player=None, home=True):
+    row = [None] * len(ROW_HEADERS)
+    row[0:7] = [gameid, event, event_type, 0, period, '7:30 PM', clock]
+    description = 'Event {}'.format(event)
+    if home:
+        row[7] = description
+    else:
+        row[9] = description
+    row[10] = score
+    if team:
+        row[12:19] = [4, player, 'Player {}'.format(player),
+                      1610612700 + SORTED_TEAMS.index(team), None, None, team]
+    return row
+
+
+def synthetic_game(gameid, away, home, winner=None, events=EVENTS_PER_GAME):
+    '''
+    Makes up a plausible game between away and home. The rows follow the
+    saved format: made shots carry a 'away - home' score and the scorer's
+    team. If winner is given, that team wins.
+    '''
+
+    rand = random.Random(gameid)
+    periods = 4 + (rand.random() < 0.06) + (rand.random() < 0.02)
+    lengths = [12 * 60] * 4 + [5 * 60] * (periods - 4)
+    per_period = events // periods
+    scores = {away: 0, home: 0}
+    rows = []
+    for period, length in zip(range(1, periods + 1), lengths):
+        for i in range(per_period):
+            left = length - (i + 1) * length // per_period
+            clock = '{}:{:02d}'.format(left // 60, left % 60)
+            team = rand.choice([away, home])
+            player = rand.randint(1, 15) + 100 * SORTED_TEAMS.index(team)
+            last = period == periods and i == per_period - 1
+            if rand.random() < 0.45 or (last and winner): # made shot
+                points = rand.choice([1, 2, 2, 2, 3])
+                if last and winner:
+                    # last basket decides it
+                    team = winner
+                    loser = home if winner == away else away
+                    points = max(points, scores[loser] - scores[winner] + 1)
+                scores[team] += points
+                score = '{} - {}'.format(scores[away], scores[home])
+                rows.append(synthetic_row(gameid, len(rows), 1, period, clock, score,
+                                          team, player, home=team == home))
+            else:
+                rows.append(synthetic_row(gameid, len(rows), rand.choice([2, 4, 5, 6]),
+                                          period, clock, None, team, player,
+                                          home=team == home))
+        rows.append(synthetic_row(gameid, len(rows), 13, period, '0:00'))
+    return rows
+
+
+def synthetic_playoff_game(gameid):
+    '''
+    Makes up a playoff game, or returns [] if the series was over by then.
+    The higher seed loses the first (length - 4) games and wins the rest.
+    '''
+
+    p_round, series, game = int(gameid[-3]), int(gameid[-2]), int(gameid[-1])
+    rand = random.Random(gameid[:-1])
+    length = rand.randint(4, 7)
+    if p_round > PLAYOFF_ROUNDS or game > length:
+        return []
+    high, low = rand.sample(SORTED_TEAMS, 2)
+    winner = low if game <= length - 4 else high
+    home, away = (high, low) if game in (1, 2, 5, 7) else (low, high)
+    return synthetic_game(gameid, away, home, winner=winner)
+
+
+def synthetic_rows(gameid):
+    '''Returns the rows served for gameid when there is no recording.'''
+
+    if gameid[2] == '2':
+        if not 1 <= int(gameid[-4:]) <= REGULAR_GAMES:
+            return []
+        rand = random.Random(gameid)
+        away, home = rand.sample(SORTED_TEAMS, 2)
+        return synthetic_game(gameid, away, home, winner=rand.choice([away, home]))
+    if gameid[2] == '4':
+        return synthetic_playoff_game(gameid)
+    return []
+
+
+##### SERVER
+class MockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+
+    def do_GET(self):
+        server = self.server
+        parsed = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(parsed.query)
+        server.count('requests')
+
+        if server.latency:
+            time.sleep(server.latency * server.rand.uniform(0.5, 1.5))
+        if server.rand.random() < server.timeout_rate:
+            server.count('timeouts')
+            time.sleep(server.hang) # client gives up first
+        if server.rand.random() < server.throttle_rate:
+            server.count('throttled')
+            return self.send_body(429, '', headers={'Retry-After': str(server.retry_after)})
+        if parsed.path != PATH or 'GameID' not in params:
+            return self.send_body(400, '')
+
+        gameid = params['GameID'][0]
+        body = json.dumps(server.payload(gameid, params))
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get('if-none-match') == etag:
+            server.count('not_modified')
+            return self.send_body(304, '', headers={'ETag': etag})
+        self.send_body(200, body, headers={'Content-Type': 'application/json', 'ETag': etag},
+                       stall=server.rand.random() < server.stall_rate)
+
+    def send_body(self, status, body, headers=None, stall=False):
+        if body and 'gzip' in self.headers.get('accept-encoding', ''):
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+                gz.write(body)
+            body = buf.getvalue()
+            headers = dict(headers or {}, **{'Content-Encoding': 'gzip'})
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if stall: # half the body, then nothing until the client gives up
+            self.server.count('stalled')
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            time.sleep(self.server.hang)
+            self.close_connection = 1
+            return
+        self.wfile.write(body)
+        self.server.count('bytes', len(body))
+
+    def log_message(self, *args):
+        pass
+
+
+class MockStatsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    The stand-in server. Inputs:
+    recordings    - folder of payloads named by GameID (optional)
+    synthetic     - make up games that have no recording
+    latency       - mean seconds added to every response
+    throttle_rate - fraction of requests answered with 429
+    timeout_rate  - fraction of requests that hang for `hang` seconds
+    stall_rate    - fraction of responses that send their headers and half
+                    their body, then hang for `hang` seconds
+    bad_responses - dict of gameid -> number of times to answer it with a
+                    response that has no rowSet before serving it properly
+    '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), recordings=None, synthetic=True,
+                 latency=0.0, throttle_rate=0.0, timeout_rate=0.0, hang=5.0,
+                 retry_after=0, seed=0, stall_rate=0.0, bad_responses=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, MockHandler)
+        self.recordings = recordings
+        self.synthetic = synthetic
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.timeout_rate = timeout_rate
+        self.stall_rate = stall_rate
+        self.bad_responses = dict(bad_responses or {})
+        self.hang = hang
+        self.retry_after = retry_after
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}{}'.format(self.server_address[0], self.server_address[1], PATH)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def payload(self, gameid, params):
+        '''Returns the playbyplayv2 response for gameid.'''
+
+        with self.lock:
+            bad = self.bad_responses.get(gameid, 0)
+            if bad:
+                self.bad_responses[gameid] = bad - 1
+        if bad:
+            self.count('bad_responses')
+            return {'resource': 'playbyplay', 'resultSets': []}
+
+        rows = []
+        fpath = os.path.join(self.recordings, gameid) if self.recordings else None
+        if fpath and os.path.isfile(fpath):
+            with open(fpath, 'r') as infile:
+                recorded = json.load(infile)
+            if isinstance(recorded, dict): # full response
+                return recorded
+            rows = recorded
+        elif self.synthetic:
+            rows = synthetic_rows(gameid)
+
+        return {
+            'resource': 'playbyplay',
+            'parameters': dict((k, v[0]) for k, v in params.items()),
+            'resultSets': [
+                {'name': 'PlayByPlay', 'headers': ROW_HEADERS, 'rowSet': rows},
+                {'name': 'AvailableVideo', 'headers': ['VIDEO_AVAILABLE_FLAG'],
+                 'rowSet': [[1 if rows else 0]]},
+            ],
+        }
+
+    def handle_error(self, request, client_address):
+        pass # clients hanging up on injected timeouts
+
+    def start(self):
+        '''Serves on a background thread. Returns self.'''
+
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Local stand-in for stats.nba.com.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--recordings', help='folder of recorded payloads named by GameID')
+    parser.add_argument('--no-synthetic', dest='synthetic', action='store_false',
+                        help='serve empty rowSets for games without a recording')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='mean seconds added to every response')
+    parser.add_argument('--throttle', type=float, default=0.0,
+                        help='fraction of requests answered with 429')
+    parser.add_argument('--timeouts', type=float, default=0.0,
+                        help='fraction of requests that hang past the client timeout')
+    parser.add_argument('--stalls', type=float, default=0.0,
+                        help='fraction of responses whose body stalls halfway through')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = MockStatsServer(('127.0.0.1', args.port), recordings=args.recordings,
+                             synthetic=args.synthetic, latency=args.latency,
+                             throttle_rate=args.throttle, timeout_rate=args.timeouts,
+                             stall_rate=args.stalls)
+    print 'Serving play-by-play at {}'.format(server.base_url)
+    server.serve_forever()
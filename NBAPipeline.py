@@ -0,0 +1,131 @@
+'''
+A small staged pipeline: items flow through a chain of stages, each run by
+its own pool of worker threads, with a bounded queue in front of every
+stage. A stage that falls behind fills its queue and blocks the stage
+before it, so memory stays bounded and the whole chain runs at the pace of
+its slowest stage while the others overlap with it.
+
+    pipeline = Pipeline([Stage('fetch', fetch, workers=8),
+                         Stage('parse', parse, workers=2, processes=True),
+                         Stage('save', save, workers=2)], queue_size=16)
+    pipeline.run(items)
+
+A stage function takes one item and returns the item for the next stage,
+or None to drop it. Stages with processes=True run their function in a
+multiprocessing pool of `workers` processes instead (it and its items must
+pickle), for CPU-bound work that would otherwise hold the GIL.
+
+Every call is timed in NBAMetrics under the stage's name, and the time a
+stage spends blocked on a full queue under '<name>_stall', so a run shows
+which stage is the bottleneck.
+'''
+
+import multiprocessing
+import threading
+import time
+import Queue
+import NBAMetrics
+
+
+QUEUE_SIZE = 16 # items waiting in front of each stage
+DONE = None # queue sentinel; stage functions returning None drop their item instead
+
+
+class Stage(object):
+    def __init__(self, name, func, workers=1, processes=False, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.processes = processes
+        self.queue_size = queue_size
+
+
+class Pipeline(object):
+    '''
+    Runs items through a list of Stages. The first exception raised by a
+    stage function stops the pipeline and is re-raised by run once every
+    worker has stopped; stage functions should handle per-item errors they
+    can recover from themselves.
+    '''
+
+    def __init__(self, stages, queue_size=QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.errors = []
+
+    def run(self, items):
+        '''Feeds items through the stages and returns once all of them are done.'''
+
+        queues = [Queue.Queue(maxsize=stage.queue_size or self.queue_size)
+                  for stage in self.stages]
+        pools = [multiprocessing.Pool(stage.workers) if stage.processes else None
+                 for stage in self.stages]
+        threads = []
+        try:
+            for i, stage in enumerate(self.stages):
+                out = queues[i + 1] if i + 1 < len(queues) else None
+                next_workers = self.stages[i + 1].workers if out else 0
+                live = [stage.workers]
+                lock = threading.Lock()
+                for _ in range(stage.workers):
+                    t = threading.Thread(target=self.work, args=(
+                        stage, pools[i], queues[i], out, next_workers, live, lock))
+                    t.daemon = True
+                    t.start()
+                    threads.append(t)
+
+            first = self.stages[0]
+            for item in items:
+                if self.errors:
+                    break
+                self.put(queues[0], item, 'feed')
+            for _ in range(first.workers):
+                queues[0].put(DONE)
+            for t in threads:
+                t.join()
+        finally:
+            for pool in pools:
+                if pool:
+                    pool.terminate()
+                    pool.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+    def work(self, stage, pool, inbox, out, next_workers, live, lock):
+        '''Worker loop of one stage. The last worker to finish tells the next stage.'''
+
+        while True:
+            item = inbox.get()
+            if item is DONE:
+                break
+            if self.errors: # another worker failed, drain without working
+                continue
+            try:
+                with NBAMetrics.timed(stage.name):
+                    if pool:
+                        result = pool.apply(stage.func, (item,))
+                    else:
+                        result = stage.func(item)
+            except Exception as e:
+                self.errors.append(e)
+                continue
+            if result is not None and out is not None:
+                self.put(out, result, stage.name)
+
+        with lock:
+            live[0] -= 1
+            last = live[0] == 0
+        if last and out is not None:
+            for _ in range(next_workers):
+                out.put(DONE)
+
+    def put(self, queue, item, name):
+        '''Puts item on queue, timing how long a full queue holds it up.'''
+
+        try:
+            queue.put_nowait(item)
+        except Queue.Full:
+            start = time.time()
+            queue.put(item)
+            NBAMetrics.METRICS.observe(name + '_stall', time.time() - start)
@@ -0,0 +1,229 @@
+'''
+Ad-hoc queries over saved play-by-play, e.g. all fourth quarter events of a
+player in two seasons:
+
+    rows = select([15, 16], periods=[4], players=[201939],
+                  columns=['game_id', 'pctimestring', 'score', 'player1_name'])
+
+Filters are pushed down as far as the data allows:
+- seasons and season types pick the folders to read
+- teams and players pick games through the team and player indexes, so
+  other games are never opened
+- periods, players, event types and other fields are matched against the
+  store's column codes for a whole folder at once, and only the projected
+  columns of matching rows are decoded
+Games not compacted into a store (or saved again since) are loaded and
+filtered row by row.
+'''
+
+import os
+import numpy as np
+import NBAStore
+import NBAUtils
+
+
+COLUMNS = dict((name.lower(), i) for i, name in enumerate(NBAUtils.ROW_HEADERS))
+PERIOD_INDEX = NBAUtils.PERIOD_INDEX
+EVENT_TYPE_INDEX = NBAUtils.EVENT_TYPE_INDEX
+PLAYER_ID_INDICES = NBAUtils.PLAYER_ID_INDICES
+REGULAR = NBAUtils.REGULAR
+PLAYOFFS = NBAUtils.PLAYOFFS
+
+
+def column_index(column):
+    '''Returns the index of a column given by index or (case-insensitive) header name.'''
+
+    if isinstance(column, (int, long)):
+        return column
+    try:
+        return COLUMNS[column.lower()]
+    except KeyError:
+        raise KeyError('Unknown column {}; see NBAUtils.ROW_HEADERS'.format(column))
+
+
+class Query(object):
+    '''
+    A query over one or more seasons. Inputs (all optional but years; list
+    filters match any of their values, and all filters must match):
+    years        - seasons, e.g. [15, 16]
+    season_types - REGULAR and/or PLAYOFFS
+    rounds       - playoff rounds to read
+    teams        - games involving any of these teams
+    periods      - rows in these periods (5 and up are overtimes)
+    players      - rows involving any of these player ids
+    event_types  - rows of these event types
+    fields       - dict of column -> allowed values for any other column
+    where        - function of a projected row, for anything else
+    columns      - columns to return, by index or name (default all)
+
+    Iterating yields the projected rows. stats counts what was skipped.
+    '''
+
+    def __init__(self, years, season_types=None, rounds=None, teams=None, periods=None,
+                 players=None, event_types=None, fields=None, where=None, columns=None):
+        self.years = years
+        self.season_types = set(season_types or [REGULAR, PLAYOFFS])
+        self.rounds = rounds or range(1, 5)
+        self.teams = set(teams) if teams else None
+        self.players = set(players) if players else None
+        self.where = where
+        self.columns = [column_index(c) for c in columns] if columns else None
+
+        # (columns, values): a row matches if any of the columns holds any of the values
+        self.filters = []
+        if periods:
+            self.filters.append(([PERIOD_INDEX], set(periods)))
+        if event_types:
+            self.filters.append(([EVENT_TYPE_INDEX], set(event_types)))
+        if players:
+            self.filters.append((PLAYER_ID_INDICES, set(players)))
+        for column, values in (fields or {}).items():
+            self.filters.append(([column_index(column)], set(values)))
+
+        self.stats = {'folders': 0, 'games': 0, 'games_skipped': 0,
+                      'rows_scanned': 0, 'rows_matched': 0}
+
+    def folders(self, year):
+        '''Returns the (path, relpath) of the folders of a year to read.'''
+
+        season_dir = os.path.join(NBAUtils.FILE_DIR, NBAUtils.season_dirname(year))
+        folders = []
+        if REGULAR in self.season_types:
+            folders.append((season_dir, ''))
+        if PLAYOFFS in self.season_types:
+            folders.extend((os.path.join(season_dir, 'Round' + str(r)), 'Round' + str(r))
+                           for r in self.rounds)
+        return [(path, relpath) for path, relpath in folders if os.path.isdir(path)]
+
+    def game_filter(self, year):
+        '''
+        Returns a function of (relpath, gameid) telling whether a game can
+        involve self.teams and self.players, answered from the team and
+        player indexes, or None if every game can match. The function returns
+        None for games it can't rule out but whose teams aren't indexed, i.e.
+        they have to be checked against their rows.
+        '''
+
+        if not self.teams and not self.players:
+            return None
+        team_index = NBAUtils.load_team_index(year) if self.teams else None
+        player_index, player_indexed = NBAUtils.read_player_index(year) \
+            if self.players else (None, None)
+        player_games = set()
+        for playerid in self.players or ():
+            player_games.update(player_index.get(playerid, {}))
+
+        def keep(relpath, gameid):
+            if self.players and gameid in player_indexed and gameid not in player_games:
+                return False
+            if not self.teams:
+                return True
+            entry = team_index.get(gameid)
+            if entry is None or entry[2] != relpath:
+                return None
+            return bool(self.teams.intersection(entry[0]))
+        return keep
+
+    def project(self, row):
+        return [row[i] for i in self.columns] if self.columns else list(row)
+
+    def row_matches(self, row):
+        return all(any(row[i] in values for i in indices) for indices, values in self.filters)
+
+    def scan_store(self, store, keep, exclude):
+        '''Yields the projected matching rows of the games of a store, but those in exclude.'''
+
+        # Which games to read
+        wanted = np.array([gameid not in exclude for gameid in store.gameids], dtype=bool)
+        excluded = len(store) - int(wanted.sum())
+        unknown = []
+        if keep:
+            for g, gameid in enumerate(store.gameids):
+                if not wanted[g]:
+                    continue
+                known = keep(gameid)
+                if known is None:
+                    unknown.append(g)
+                else:
+                    wanted[g] = known
+            for g in unknown: # not in the team index, so check the rows
+                start, stop = store.game_slice(store.gameids[g])
+                teams = set()
+                for i in NBAUtils.TABBREV_INDICES:
+                    teams.update(store.decode(i, start, stop))
+                wanted[g] = bool(self.teams.intersection(teams))
+        self.stats['games'] += int(wanted.sum())
+        self.stats['games_skipped'] += int((~wanted).sum()) - excluded
+        if not wanted.any():
+            return
+
+        # Which rows, from the column codes alone
+        mask = np.repeat(wanted, np.diff(store.offsets))
+        self.stats['rows_scanned'] += int(mask.sum())
+        for indices, values in self.filters:
+            if not mask.any():
+                return
+            match = np.zeros(len(mask), dtype=bool)
+            for i in indices:
+                if i < store.num_columns:
+                    match |= store.match(i, values)
+            mask &= match
+        rows = np.flatnonzero(mask)
+        if not len(rows):
+            return
+
+        columns = self.columns if self.columns is not None else range(store.num_columns)
+        values = [store.decode_at(i, rows) if i < store.num_columns else [None] * len(rows)
+                  for i in columns]
+        for row in zip(*values):
+            row = list(row)
+            if self.where is None or self.where(row):
+                self.stats['rows_matched'] += 1
+                yield row
+
+    def scan_json(self, path, gameids, keep):
+        '''Yields the projected matching rows of games saved as JSON files.'''
+
+        for gameid in gameids:
+            known = keep(gameid) if keep else True
+            if known is False:
+                self.stats['games_skipped'] += 1
+                continue
+            data = NBAUtils.load_game(path, gameid)
+            if known is None and not self.teams.intersection(NBAUtils.get_teams(data)):
+                self.stats['games_skipped'] += 1
+                continue
+            self.stats['games'] += 1
+            self.stats['rows_scanned'] += len(data)
+            for row in data:
+                if not self.row_matches(row):
+                    continue
+                row = self.project(row)
+                if self.where is None or self.where(row):
+                    self.stats['rows_matched'] += 1
+                    yield row
+
+    def __iter__(self):
+        for year in self.years:
+            game_filter = self.game_filter(year)
+            for path, relpath in self.folders(year):
+                self.stats['folders'] += 1
+                keep = (lambda gameid: game_filter(relpath, gameid)) if game_filter else None
+                store = NBAStore.open_store(path)
+                json_ids = NBAUtils.json_game_ids(path)
+                if store:
+                    # Only games saved (again) since compacting are read from JSON
+                    compacted = os.path.getmtime(
+                        os.path.join(NBAStore.store_path(path), NBAStore.META_FNAME))
+                    json_ids = [g for g in json_ids if g not in store or
+                                os.path.getmtime(os.path.join(path, g)) > compacted]
+                    for row in self.scan_store(store, keep, set(json_ids)):
+                        yield row
+                for row in self.scan_json(path, sorted(json_ids), keep):
+                    yield row
+
+
+def select(years, **filters):
+    '''Returns the rows matching filters as a list. See Query for the filters.'''
+
+    return list(Query(years, **filters))
@@ -0,0 +1,188 @@
+'''
+Cache of raw play-by-play responses, so data can be re-derived or
+re-validated without fetching every game again.
+
+Entries are keyed by the normalized request url and remember the ETag,
+Last-Modified and fetch time of the response. Bodies are stored gzip
+compressed under the SHA-1 of their content, so identical payloads (e.g.
+the empty responses of games that don't exist) are stored once:
+
+    FILE_DIR/.responses/index.db            - key -> hash, validators, times
+    FILE_DIR/.responses/blobs/ab/abcd...gz  - compressed bodies
+'''
+
+import gzip
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib
+import zlib
+
+
+CACHE_DIRNAME = '.responses'
+INDEX_FNAME = 'index.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key             TEXT PRIMARY KEY,
+    hash            TEXT,
+    etag            TEXT,
+    last_modified   TEXT,
+    fetched_at      REAL,
+    validated_at    REAL,
+    size            INTEGER,
+    compressed_size INTEGER
+)
+'''
+
+
+def normalize_url(base, params):
+    '''Returns a canonical url for base and params (as from parse_url): params sorted.'''
+
+    pairs = []
+    for name in sorted(params):
+        values = params[name]
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        pairs.extend((name, v) for v in sorted(values))
+    return base + '?' + urllib.urlencode(pairs)
+
+
+class BlobWriter(object):
+    '''Compresses and hashes a body as it is written, chunk by chunk.'''
+
+    def __init__(self, tmp_dir):
+        fd, self.tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        self.file = os.fdopen(fd, 'wb')
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+
+    def write(self, chunk):
+        self.sha1.update(chunk)
+        self.size += len(chunk)
+        self.file.write(self.compressor.compress(chunk))
+
+    def close(self):
+        self.file.write(self.compressor.flush())
+        self.file.close()
+        return self.sha1.hexdigest()
+
+    def discard(self):
+        '''Drops a body that was cut short.'''
+
+        self.file.close()
+        os.remove(self.tmp_path)
+
+
+class ResponseCache(object):
+    '''The cache rooted at root. Safe to share between threads.'''
+
+    def __init__(self, root):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        if not os.path.isdir(self.blob_dir):
+            os.makedirs(self.blob_dir)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, INDEX_FNAME),
+                                    check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(SCHEMA)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest + '.gz')
+
+    def get(self, key):
+        '''Returns the entry for key as a dict, or None.'''
+
+        with self.lock:
+            cursor = self.conn.execute('SELECT * FROM responses WHERE key = ?', (key,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([d[0] for d in cursor.description], row))
+
+    def conditional_headers(self, entry):
+        '''Returns the If-None-Match / If-Modified-Since headers for revalidating entry.'''
+
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def read(self, entry):
+        '''Returns the uncompressed body of entry.'''
+
+        with gzip.open(self.blob_path(entry['hash']), 'rb') as infile:
+            return infile.read()
+
+    def writer(self):
+        '''Returns a BlobWriter to stream a new body into; pass it to put() when done.'''
+
+        return BlobWriter(self.blob_dir)
+
+    def put(self, key, writer, etag=None, last_modified=None):
+        '''Stores the body written to writer under key, deduplicated by content hash.'''
+
+        digest = writer.close()
+        path = self.blob_path(digest)
+        if os.path.isfile(path): # same payload already stored
+            os.remove(writer.tmp_path)
+        else:
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    pass
+            os.rename(writer.tmp_path, path)
+
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, digest, etag, last_modified, now, now, writer.size,
+                 os.path.getsize(path)))
+        return digest
+
+    def touch(self, key):
+        '''Marks key as just revalidated (the server answered 304).'''
+
+        with self.lock:
+            self.conn.execute('UPDATE responses SET validated_at = ? WHERE key = ?',
+                              (time.time(), key))
+
+    def usage(self):
+        '''Returns (bytes of all bodies uncompressed, bytes on disk).'''
+
+        with self.lock:
+            raw = self.conn.execute('SELECT SUM(size) FROM responses').fetchone()[0] or 0
+            stored = self.conn.execute(
+                'SELECT SUM(compressed_size) FROM '
+                '(SELECT DISTINCT hash, compressed_size FROM responses)').fetchone()[0] or 0
+        return (raw, stored)
+
+    def keys(self, like='%'):
+        '''Returns the cached keys matching a SQL LIKE pattern.'''
+
+        with self.lock:
+            return [r[0] for r in self.conn.execute(
+                'SELECT key FROM responses WHERE key LIKE ? ORDER BY key', (like,))]
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(file_dir):
+    '''Returns the shared ResponseCache for the data rooted at file_dir.'''
+
+    root = os.path.abspath(os.path.join(file_dir, CACHE_DIRNAME))
+    with _caches_lock:
+        if root not in _caches:
+            _caches[root] = ResponseCache(root)
+        return _caches[root]
@@ -0,0 +1,137 @@
+'''
+Array engine for the time-weighted scoring metric of NBATestScrape.
+
+Every point scored at second t of a game lasting max_time seconds counts
+(max_time - t) / max_time, so early points weigh more. The metric at time t
+is the weighted sum of all points scored up to t. With reverse=True the
+game is read from the end, i.e. time t counts as max_time - 1 - t.
+
+The metric is computed for a whole batch of games at once as a
+(games x seconds) matrix: points are scattered into the matrix, weighted,
+and summed with a cumulative sum along the time axis.
+'''
+
+import numpy as np
+import NBADecode
+
+
+GAMETIME = 48 * 60
+
+
+def average_scores_from_events(games, times, points, max_times, reverse=False):
+    '''
+    Inputs:
+    games     - game index (row of the result) of every scoring event
+    times     - second of the game of every scoring event
+    points    - points scored in every scoring event
+    max_times - length in seconds of every game
+
+    Returns:
+    A (games x max(max_times)) float array of the metric at each second.
+    Past the end of a game its row stays at the game's final value.
+    '''
+
+    max_times = np.asarray(max_times, dtype=np.int64)
+    games = np.asarray(games, dtype=np.int64)
+    times = np.asarray(times, dtype=np.int64)
+    points = np.asarray(points, dtype=np.float64)
+    width = int(max_times.max()) if len(max_times) else 0
+
+    # Events outside [0, max_time) never counted
+    game_lengths = max_times[games]
+    inside = (times >= 0) & (times < game_lengths)
+    games, times, points = games[inside], times[inside], points[inside]
+    if reverse:
+        times = game_lengths[inside] - 1 - times
+
+    scored = np.zeros((len(max_times), width))
+    np.add.at(scored, (games, times), points)
+
+    seconds = np.arange(width)
+    weights = (max_times[:, None] - seconds[None, :]) / max_times[:, None].astype(np.float64)
+    return np.cumsum(scored * np.clip(weights, 0, None), axis=1)
+
+
+def average_scores_batch(data, max_times=GAMETIME, reverse=False):
+    '''
+    Given a list of games as lists of (time, total score) tuples (one team's
+    output of format_game_data), returns the metric for each game as a
+    (games x seconds) array. max_times is one length for all games or one
+    per game.
+    '''
+
+    if np.isscalar(max_times):
+        max_times = [max_times] * len(data)
+
+    games, times, points = [], [], []
+    for i, game in enumerate(data):
+        last_score = 0
+        for t, score in sorted(game):
+            games.append(i)
+            times.append(t)
+            points.append(score - last_score)
+            last_score = score
+
+    return average_scores_from_events(games, times, points, max_times, reverse=reverse)
+
+
+def average_score_diffs_batch(data1, data2, max_times=GAMETIME, reverse=False):
+    '''Like average_scores_batch, but returns team1 - team2 for every game.'''
+
+    return (average_scores_batch(data1, max_times=max_times, reverse=reverse) -
+            average_scores_batch(data2, max_times=max_times, reverse=reverse))
+
+
+def decoded_score_events(decoded, score_key):
+    '''
+    Returns (games, times, points) of the scoring events of one side
+    ('away_score' or 'home_score') of decoded rows from NBADecode.
+    '''
+
+    offsets = decoded['offsets']
+    row_games = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    scores = decoded[score_key]
+    has_score = scores != NBADecode.NO_SCORE
+    games = row_games[has_score]
+    times = decoded['seconds_elapsed'][has_score]
+    scores = scores[has_score]
+
+    previous = np.concatenate([[0], scores[:-1]])
+    first_of_game = np.concatenate([[True], games[1:] != games[:-1]])
+    previous[first_of_game] = 0
+    points = scores - previous
+    changed = points != 0
+    return (games[changed], times[changed], points[changed])
+
+
+def decoded_game_lengths(decoded):
+    '''Returns the length in seconds of every game of decoded rows from NBADecode.'''
+
+    offsets = decoded['offsets']
+    if len(offsets) < 2:
+        return np.zeros(0, dtype=np.int64)
+    max_periods = np.maximum.reduceat(decoded['period'], offsets[:-1])
+    return NBADecode.game_length(max_periods)
+
+
+def average_score_diffs_decoded(decoded, reverse=False):
+    '''
+    Returns the metric (away - home) for every game of decoded rows from
+    NBADecode (e.g. NBADecode.decode_season), along with each game's length.
+    Overtime games get their full length.
+    '''
+
+    max_times = decoded_game_lengths(decoded)
+    away = average_scores_from_events(*decoded_score_events(decoded, 'away_score'),
+                                      max_times=max_times, reverse=reverse)
+    home = average_scores_from_events(*decoded_score_events(decoded, 'home_score'),
+                                      max_times=max_times, reverse=reverse)
+    return (away - home, max_times)
+
+
+def season_average_score_diffs(year, reverse=False):
+    '''Returns (gameids, metric matrix, game lengths) for a regular season.'''
+
+    decoded = NBADecode.decode_season(year)
+    diffs, max_times = average_score_diffs_decoded(decoded, reverse=reverse)
+    return (decoded['gameids'], diffs, max_times)
@@ -3,32 +3,56 @@ This script scrapes play-by-play game data from the api used by
 http://stats.nba.com/game/#!/GAMEID/playbyplay/
 '''
 
+import argparse
 import json
 import os
+import re
+import threading
+import time
 import urlparse
+import Queue
 import requests
-from NBAUtils import FILE_DIR
+import NBAAggregates
+import NBAFiles
+import NBAHttp
+import NBAManifest
+import NBAMetrics
+import NBAPipeline
+import NBAResponseCache
+from NBAMetrics import count, log, timed
+from NBAUtils import FILE_DIR, CorruptGameError, add_player_index_entry, add_team_index_entry, \
+    corrupt_game_ids, get_teams, get_winner, has_game, index_game, index_players, is_final, \
+    load_game, player_rows, season_dirname
 
 
 START_PERIOD = 1
 END_PERIOD = 10
 MAX_REGULAR_GAMES = 1230
 MAX_PLAYOFF_GAMES = 105
-HEADERS = {
-    'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12) AppleWebKit/602.1.43 (KHTML, like Gecko) Version/10.0 Safari/602.1.43',
-    'referer': 'http://stats.nba.com/scores/',
-}
+NUM_SERIES = [8, 4, 2, 1] # series per playoff round
+WINS_TO_ADVANCE = 4
+MAX_WORKERS = 8
+MAX_MISSES = 10 # consecutive nonexistent games before an update stops probing
+REFRESH_WINDOW = 24 * 60 * 60 # seconds; recently saved games are refetched by updates
+BASE_URL = 'http://stats.nba.com/stats/playbyplayv2'
+CHUNK_SIZE = 64 * 1024 # bytes read from the response stream at a time
+CACHE_RESPONSES = False # keep compressed raw responses, see NBAResponseCache
+GROUP_COMMIT = None # an NBAFiles.GroupCommit to share fsyncs between workers
+PARSERS = 2 # parse stage workers of the pipeline
+WRITERS = 2 # write stage workers of the pipeline
 
 
 def create_url(gameid, start_period, end_period):
     '''Creates play-by-play url for the given params.'''
 
-    return 'http://stats.nba.com/stats/playbyplayv2?GameID={gameid}&StartPeriod' \
-           '={start_period}&EndPeriod={end_period}'.format(
-               gameid=gameid,
-               start_period=start_period,
-               end_period=end_period,
-           )
+    with timed('url'):
+        return '{base}?GameID={gameid}&StartPeriod' \
+               '={start_period}&EndPeriod={end_period}'.format(
+                   base=BASE_URL,
+                   gameid=gameid,
+                   start_period=start_period,
+                   end_period=end_period,
+               )
 
 
 def parse_url(url):
@@ -49,7 +73,7 @@ def deconstruct_url(url):
 
     _, params = parse_url(url)
     gameid = params['GameID'][0]
-    print 'gameid = {}'.format(gameid)
+    log('gameid = {}'.format(gameid))
 
     if gameid[2] == '2': # regular season url
         year = gameid[3:5]
@@ -69,23 +93,209 @@ def is_valid_url(game_url):
     '''Checks to see if url is valid play-by-play data.'''
 
     base, params = parse_url(game_url)
-    return not (base != 'http://stats.nba.com/stats/playbyplayv2'
+    return not (base != BASE_URL
          or 'GameID' not in params
          or 'StartPeriod' not in params
          or 'EndPeriod' not in params)
 
 
-def request_game_data(game_url):
-    '''Requests the passed-in url to see if there is data.'''
+class RowSetExtractor(object):
+    '''
+    Pulls the raw text of the first "rowSet" array out of a playbyplayv2
+    response as it streams in, without building the rest of the document.
+    Feed it chunks until done is set; text then holds the array, e.g. '[]'.
+    '''
+
+    KEY = '"rowSet"'
+    SPECIAL = re.compile(r'["\\\[\]]') # quote, backslash, brackets
+
+    def __init__(self):
+        self.buf = ''      # unscanned input
+        self.parts = []    # scanned pieces of the array
+        self.started = False
+        self.depth = 0
+        self.in_string = False
+        self.done = False
+        self.text = None
+
+    def feed(self, chunk):
+        if self.done:
+            return
+        self.buf += chunk
+        if not self.started and not self.find_start():
+            return
+        self.scan()
+
+    def find_start(self):
+        '''Skips ahead to the '[' after the first "rowSet" key.'''
+
+        i = self.buf.find(self.KEY)
+        if i < 0:
+            self.buf = self.buf[-len(self.KEY):] # key may straddle chunks
+            return False
+        j = self.buf.find('[', i + len(self.KEY))
+        if j < 0:
+            self.buf = self.buf[i:]
+            return False
+        self.buf = self.buf[j:]
+        self.started = True
+        return True
+
+    def scan(self):
+        '''Tracks bracket depth outside strings until the array closes.'''
+
+        buf = self.buf
+        pos = 0
+        while True:
+            m = self.SPECIAL.search(buf, pos)
+            if m is None:
+                break
+            c = m.group()
+            pos = m.end()
+            if c == '\\':
+                if pos == len(buf): # escaped char is in the next chunk
+                    pos -= 1
+                    break
+                pos += 1
+            elif c == '"':
+                self.in_string = not self.in_string
+            elif self.in_string:
+                continue
+            elif c == '[':
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.parts.append(buf[:pos])
+                    self.text = ''.join(self.parts)
+                    self.parts = []
+                    self.buf = ''
+                    self.done = True
+                    return
+        self.parts.append(buf[:pos])
+        self.buf = buf[pos:]
+
+
+def request_game_data(game_url, raw=False, cache_responses=None):
+    '''
+    Requests the passed-in url to see if there is data. Only the first
+    result set's rows are parsed, straight from the response stream. With
+    raw=True their JSON text is returned instead of the parsed rows.
+
+    With cache_responses (default CACHE_RESPONSES) on, the response body is
+    also saved to the response cache, and a url that is already cached is
+    requested conditionally so an unchanged game costs a 304 instead of a
+    full download.
+    '''
+
+    with timed('http'):
+        text = stream_rowset(game_url, cache_responses)
+    return text if raw else json.loads(text)
+
+
+def stream_rowset(game_url, cache_responses=None):
+    '''
+    Returns the JSON text of the first rowSet in the response to game_url.
+    The body is read inside NBAHttp.fetch, so one cut short is requested
+    again like any other failed request.
+    '''
 
     base, params = parse_url(game_url)
-    response = requests.get(base, params=params, headers=HEADERS, timeout=2)
-    response.raise_for_status() # Raise exception if invalid response
-    data = response.json()['resultSets'][0]['rowSet']
-    return data
+    if cache_responses is None:
+        cache_responses = CACHE_RESPONSES
+
+    if not cache_responses:
+        def read(response):
+            extractor = RowSetExtractor()
+            for chunk in response.iter_content(CHUNK_SIZE):
+                extractor.feed(chunk) # keeps reading after done so the connection is reused
+            return extractor
 
-def get_game_data(game_url, save=True, prefix=''):
-    '''Returns play-by-play data as a list of lists.'''
+        extractor = NBAHttp.fetch(base, params=params, stream=True, consume=read)
+    else:
+        cache = get_response_cache()
+        key = NBAResponseCache.normalize_url(base, params)
+        entry = cache.get(key)
+
+        def read_and_cache(response):
+            extractor = RowSetExtractor()
+            if response.status_code == 304:
+                response.close()
+                cache.touch(key)
+                count('not_modified')
+                extractor.feed(cache.read(entry))
+                return extractor
+            writer = cache.writer()
+            try:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    extractor.feed(chunk)
+                    writer.write(chunk)
+            except Exception:
+                writer.discard()
+                raise
+            cache.put(key, writer, etag=response.headers.get('etag'),
+                      last_modified=response.headers.get('last-modified'))
+            return extractor
+
+        extractor = NBAHttp.fetch(base, params=params, stream=True,
+                                  headers=cache.conditional_headers(entry),
+                                  consume=read_and_cache)
+
+    if not extractor.done:
+        raise ValueError('No rowSet in response from {}'.format(game_url))
+    return extractor.text
+
+
+def cached_game_data(game_url, raw=False):
+    '''
+    Returns the rows of a game from the response cache alone, without any
+    request, or None if the url isn't cached.
+    '''
+
+    base, params = parse_url(game_url)
+    cache = get_response_cache()
+    entry = cache.get(NBAResponseCache.normalize_url(base, params))
+    if entry is None:
+        return None
+    extractor = RowSetExtractor()
+    extractor.feed(cache.read(entry))
+    return extractor.text if raw else json.loads(extractor.text)
+
+
+def get_response_cache():
+    '''Returns the raw response cache for FILE_DIR.'''
+
+    return NBAResponseCache.get_cache(FILE_DIR)
+
+
+def revalidate_season(year):
+    '''
+    Revalidates every cached regular season response of a year with
+    conditional requests, whatever CACHE_RESPONSES is set to, updating the
+    cache with the payloads that changed. Returns the gameids whose payload
+    changed.
+    '''
+
+    cache = get_response_cache()
+    changed = []
+    for key in cache.keys('%GameID=002{:02d}%'.format(int(year))):
+        before = cache.get(key)['hash']
+        request_game_data(key, raw=True, cache_responses=True)
+        if cache.get(key)['hash'] != before:
+            changed.append(parse_url(key)[1]['GameID'][0])
+    return changed
+
+
+def get_game_data(game_url, save=True, prefix='', manifest=None, refresh=False):
+    '''
+    Returns play-by-play data as a list of lists. If a manifest is passed in,
+    it is used instead of the filesystem to decide whether the game is saved
+    or known to not exist, and the outcome of any request is recorded in it.
+    Games the manifest has as partial (not over when saved) are requested
+    again, as is every game if refresh is set. A saved file that turns out
+    to be corrupt is removed and requested again, and one that turns out to
+    be missing is requested again.
+    '''
 
     if not prefix:
         prefix = FILE_DIR
@@ -95,45 +305,265 @@ def get_game_data(game_url, save=True, prefix=''):
 
     # Check to see if we've saved this data before
     fname = params['GameID'][0]
-    print 'Getting game data for GameId = {}'.format(fname)
+    log('Getting game data for GameId = {}'.format(fname))
     fpath = os.path.join(prefix, fname)
-    if os.path.isfile(fpath):
-        print 'File {} found, loading and returning'.format(fname)
-        with open(fpath, 'r') as infile:
-            return json.load(infile)
+    status = manifest.status(fname) if manifest else None
+    stale = refresh or status == NBAManifest.PARTIAL
+    if not stale and status == NBAManifest.EMPTY:
+        log('The url {} is known to point to a nonexistent game. Returning.'.format(game_url))
+        count('known_empty')
+        return
+    if not stale and (status == NBAManifest.FETCHED or
+                      (status is None and has_game(prefix, fname))):
+        log('File {} found, loading and returning'.format(fname))
+        try:
+            with timed('load'):
+                data = load_game(prefix, fname)
+        except CorruptGameError as e:
+            log('{}. Removing it and requesting again'.format(e))
+            count('corrupt_games')
+            os.remove(e.fpath)
+            stale = True
+        except IOError as e:
+            # The manifest has it as fetched but the file is gone; the
+            # manifest is corrected once the game is requested again
+            log('{}. Requesting it again'.format(e))
+            count('missing_games')
+            stale = True
+        else:
+            count('cache_hits')
+            if manifest and status is None: # saved before the manifest existed
+                manifest.record(fname, NBAManifest.FETCHED, url=game_url, prefix=prefix,
+                                nbytes=len(json.dumps(data)))
+            return data
 
     # Request data
-    print 'No file found, sending request'
-    data = request_game_data(game_url)
+    log('Sending request' if stale else 'No file found, sending request')
+    text = request_game_data(game_url, raw=True)
+    with timed('decode'):
+        data = json.loads(text)
     if not data:
-        print 'The url {} points to a nonexistent game. Returning.'.format(game_url)
+        log('The url {} points to a nonexistent game. Returning.'.format(game_url))
+        count('empty_games')
+        if manifest:
+            manifest.record(fname, NBAManifest.EMPTY, url=game_url, prefix=prefix)
         return
 
     # Save data
     if save:
-        assert not os.path.isfile(fpath) # we check this above
-        if not os.path.exists(prefix):   # make intermediate dirs, if necessar
-            os.makedirs(prefix)
-        with open(fpath, 'w+') as outfile:
-            print 'Saving {} to disk'.format(fname)
-            json.dump(data, outfile)
+        assert stale or not has_game(prefix, fname) # we check this above
+        log('Saving {} to disk'.format(fname))
+        with timed('write'):
+            make_dirs(prefix)
+            write_game(fpath, text) # the raw text is already valid JSON
+        with timed('index'):
+            index_game(prefix, data)
+            index_players(prefix, data)
+            get_aggregates().record_game(data)
+        count('games_saved')
+        count('bytes_written', len(text))
+        if manifest:
+            status = NBAManifest.FETCHED if is_final(data) else NBAManifest.PARTIAL
+            manifest.record(fname, status, url=game_url, prefix=prefix, nbytes=len(text))
 
     return data
 
 
+def write_game(fpath, text):
+    '''
+    Replaces fpath with text atomically (temp file, fsync, rename), so a
+    crash never leaves a truncated game behind. Goes through GROUP_COMMIT
+    if it is set.
+    '''
+
+    if GROUP_COMMIT:
+        GROUP_COMMIT.write(fpath, text)
+    else:
+        NBAFiles.atomic_write(fpath, text)
+
+
+def make_dirs(path):
+    '''Makes path and any intermediate dirs. Safe to call from several threads.'''
+
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def run_workers(func, items, workers=1):
+    '''
+    Calls func on every item using a pool of `workers` threads. Items are
+    fed through a bounded queue, so at most ~2 * workers are in flight and
+    the items iterable is consumed lazily. The first exception raised by func
+    is re-raised here once all workers have stopped.
+    '''
+
+    if workers <= 1:
+        for item in items:
+            func(item)
+        return
+
+    queue = Queue.Queue(maxsize=2 * workers)
+    errors = []
+    done = object()
+
+    def worker():
+        while True:
+            item = queue.get()
+            if item is done:
+                return
+            if errors: # another worker failed, drain without working
+                continue
+            try:
+                func(item)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    for item in items:
+        if errors:
+            break
+        queue.put(item)
+    for _ in threads:
+        queue.put(done)
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
+
+
+def save_games(jobs, workers=1, refresh=False):
+    '''
+    Saves games given an iterable of (url, prefix) jobs, fetching up to
+    `workers` games at once. Each GameID is only handed to one worker, so
+    every game file is written exactly once even if a url is repeated.
+    Games the manifest already has as fetched or nonexistent are skipped
+    without touching the filesystem or the network, unless refresh is set.
+    '''
+
+    manifest = get_manifest()
+
+    def save(job):
+        url, prefix = job
+        try:
+            get_game_data(url, prefix=prefix, manifest=manifest, refresh=refresh)
+        except (requests.RequestException, ValueError) as e:
+            # Keep going; the game can be retried with retry_dead_letters().
+            # ValueError covers responses without a (complete) rowSet.
+            log('Failed to get {}: {}'.format(url, e))
+            record_dead_letter(url, prefix, e)
+
+    run_workers(save, pending_jobs(jobs, manifest, refresh), workers=workers)
+
+
+def pending_jobs(jobs, manifest, refresh=False):
+    '''
+    Filters (url, prefix) jobs down to the first job of each GameID, and
+    unless refresh is set, to games the manifest doesn't have as fetched or
+    nonexistent.
+    '''
+
+    seen = set()
+    for url, prefix in jobs:
+        gameid = parse_url(url)[1]['GameID'][0]
+        if gameid in seen:
+            continue
+        seen.add(gameid)
+        if not refresh and manifest.status(gameid) in (NBAManifest.FETCHED,
+                                                       NBAManifest.EMPTY):
+            continue
+        yield (url, prefix)
+
+
+def get_manifest():
+    '''Returns the scrape manifest for FILE_DIR.'''
+
+    return NBAManifest.get_manifest(FILE_DIR)
+
+
+def get_aggregates():
+    '''Returns the game summaries table for FILE_DIR.'''
+
+    return NBAAggregates.get_aggregates(FILE_DIR)
+
+
+##### DEAD LETTERS
+def record_dead_letter(url, prefix, error):
+    '''Marks a (url, prefix) job as failed in the manifest.'''
+
+    gameid = parse_url(url)[1]['GameID'][0]
+    reason = ' '.join(str(error).split()) # keep it on one line
+    get_manifest().record(gameid, NBAManifest.FAILED, url=url, prefix=prefix,
+                          error=reason)
+    count('failed_games')
+
+
+def load_dead_letters():
+    '''Returns the list of failed (url, prefix) jobs.'''
+
+    return get_manifest().failed()
+
+
+def retry_dead_letters(workers=1):
+    '''Retries every failed game. Games that fail again stay failed.'''
+
+    save_games(load_dead_letters(), workers=workers)
+
+
+def verify_season(year):
+    '''
+    Removes the corrupt game files of a year and marks them as failed, so
+    retry_dead_letters fetches them again. Returns the number removed.
+    '''
+
+    season_dir = os.path.join(FILE_DIR, season_dirname(year))
+    removed = 0
+    for prefix in [season_dir] + [os.path.join(season_dir, 'Round' + str(r)) for r in range(1, 5)]:
+        if not os.path.isdir(prefix):
+            continue
+        for gameid in corrupt_game_ids(prefix):
+            log('Removing corrupt game file {}'.format(os.path.join(prefix, gameid)))
+            os.remove(os.path.join(prefix, gameid))
+            record_dead_letter(create_url(gameid, START_PERIOD, END_PERIOD), prefix,
+                               'corrupt game file')
+            removed += 1
+    return removed
+
+
+def print_progress(year):
+    '''Prints how much of a season has been scraped, according to the manifest.'''
+
+    names = {'2': 'regular season', '4': 'playoffs'}
+    report = get_manifest().progress(year)
+    for season_type in sorted(report):
+        counts = report[season_type]
+        print '{} {}: {} fetched, {} in progress, {} nonexistent, {} failed, {} bytes'.format(
+            year, names.get(season_type, season_type),
+            counts.get(NBAManifest.FETCHED, 0), counts.get(NBAManifest.PARTIAL, 0),
+            counts.get(NBAManifest.EMPTY, 0), counts.get(NBAManifest.FAILED, 0),
+            counts['bytes'])
+
+
 def create_regular_gameid(year, game_number):
     '''
     Inputs:
     year - the last two digits of the *beginning* year of the season. E.g.
            for the 2015-2016 season, year = 15. For the 1998-1999 season,
-           year = 98.
+           year = 98, and for the 2005-2006 season, year = 5 (padded to '05').
     game_number - the absolute game number of the game in the range [1, 1230] (padded 4 digits)
 
     Returns:
     The gameid for the desired game as a string.
     '''
 
-    return '002{year}0{game_number:04d}'.format(year=year, game_number=game_number)
+    return '002{year:02d}0{game_number:04d}'.format(year=int(year), game_number=game_number)
 
 
 def create_playoff_gameid(year, p_round, series, game_number):
@@ -141,7 +571,7 @@ def create_playoff_gameid(year, p_round, series, game_number):
     Inputs:
     year    - the last two digits of the *beginning* year of the season. E.g.
               for the 2015-2016 season, year = 15. For the 1998-1999 season,
-              year = 98.
+              year = 98, and for the 2005-2006 season, year = 5 (padded to '05').
     p_round - the round of the playoffs in the range [1, 4]
     series  - the series number in the range [0, 7] for the first round, [0, 3]
               for the second round, etc.
@@ -152,8 +582,8 @@ def create_playoff_gameid(year, p_round, series, game_number):
     The gameid for the desired game as a string.
     '''
 
-    return '004{year}00{p_round}{series}{game_number}'.format(
-        year=year, p_round=p_round, series=series, game_number=game_number
+    return '004{year:02d}00{p_round}{series}{game_number}'.format(
+        year=int(year), p_round=p_round, series=series, game_number=game_number
     )
 
 
@@ -179,20 +609,17 @@ def playoff_url_generator(year):
     Inputs:
     year - the last two digits of the *beginning* year of the season.
 
-    Creates a generator for playoff game urls.
-
-    TODO: method that checks if url actually corresponds to a game so we
-    can tell when a playoff series has ended
+    Creates a generator for every possible playoff game url. See
+    save_playoffs for a discovery that stops once a series is decided.
     '''
 
     assert len(str(year)) <= 2
 
-    num_series = [8, 4, 2, 1]
     # For each round, iterate through each series. For each series, iterate
     # through each game. There is no checking to see whether the url corresponds
     # to an existing game. This checking should be done by the caller of
     # this function.
-    for p_round, series in zip(range(1, 5), num_series):
+    for p_round, series in zip(range(1, 5), NUM_SERIES):
         for s in range(series):
             for game in range(1, 8):
                 gameid = create_playoff_gameid(year, p_round, s, game)
@@ -200,27 +627,398 @@ def playoff_url_generator(year):
                 yield url
 
 
-def save_regular_season(year):
+def regular_season_jobs(year):
+    '''Generator for (url, prefix) jobs of a regular season.'''
+
+    prefix = os.path.join(FILE_DIR, season_dirname(year))
+    for url in regular_url_generator(year):
+        yield (url, prefix)
+
+
+def save_regular_season(year, workers=1):
     '''Saves the passed-in regular season to disk.'''
 
     assert len(str(year)) <= 2
 
-    g = regular_url_generator(year)
-    for url in g:
-        get_game_data(url, prefix=os.path.join(FILE_DIR, str(year)))
+    save_games(regular_season_jobs(year), workers=workers)
+
+
+def save_series(year, p_round, series, manifest=None):
+    '''
+    Saves the games of one playoff series, in order, until a game doesn't
+    exist or a team has won WINS_TO_ADVANCE games. The winner of each game is
+    taken from the rows already returned for it; games that aren't over
+    don't count. Returns the number of games found. A game the manifest has
+    as nonexistent is requested again, since it may have been played since,
+    so a series (or a round whose game 1s were missing) picks up where the
+    last run stopped.
+    '''
+
+    prefix = os.path.join(FILE_DIR, season_dirname(year), 'Round' + str(p_round))
+    wins = {}
+    for game in range(1, 8):
+        gameid = create_playoff_gameid(year, p_round, series, game)
+        url = create_url(gameid, START_PERIOD, END_PERIOD)
+        reprobe = manifest is not None and manifest.status(gameid) == NBAManifest.EMPTY
+        try:
+            data = get_game_data(url, prefix=prefix, manifest=manifest, refresh=reprobe)
+        except (requests.RequestException, ValueError) as e:
+            # Can't tell whether the series goes on, so stop and retry later
+            log('Failed to get {}: {}'.format(url, e))
+            record_dead_letter(url, prefix, e)
+            return game - 1
+        if not data:
+            return game - 1
+
+        winner = get_winner(data) if is_final(data) else None # a live game isn't won yet
+        if winner:
+            wins[winner] = wins.get(winner, 0) + 1
+            if wins[winner] == WINS_TO_ADVANCE:
+                log('Series {}-{} won by {}'.format(p_round, series, winner))
+                return game
+
+    return 7
+
+
+def saved_frontier(year, manifest):
+    '''Returns the highest game number n such that games 1..n of a regular season are saved.'''
+
+    saved = (NBAManifest.FETCHED, NBAManifest.PARTIAL)
+    n = 0
+    while n < MAX_REGULAR_GAMES and manifest.status(create_regular_gameid(year, n + 1)) in saved:
+        n += 1
+    return n
+
+
+def saved_final(prefix, gameid):
+    '''Checks whether the saved rows of a game show it as over. Unreadable games are not.'''
+
+    try:
+        return is_final(load_game(prefix, gameid))
+    except (IOError, ValueError):
+        return False
+
+
+def update_regular_season(year, workers=1, max_misses=MAX_MISSES,
+                          refresh_window=REFRESH_WINDOW):
+    '''
+    Fetches only what is new in a regular season that is under way:
+    1. games saved before they were over are fetched again, as are games
+       saved in the last refresh_window seconds (e.g. last night's games)
+       whose saved rows don't show a finished game. A finished game is not
+       refetched, so its save time stays put and it drops out of the window.
+    2. games past the highest contiguous saved game number are probed in
+       order until max_misses in a row don't exist (yet)
+    '''
+
+    assert len(str(year)) <= 2
+
+    manifest = get_manifest()
+    prefix = os.path.join(FILE_DIR, season_dirname(year))
+
+    # 1. Refresh games that might still change
+    stale = set(manifest.gameids(year, NBAManifest.PARTIAL))
+    stale.update(g for g in manifest.recent(year, time.time() - refresh_window)
+                 if manifest.status(g) == NBAManifest.PARTIAL or not saved_final(prefix, g))
+    stale = [g for g in stale if g[2] == '2']
+    log('Refreshing {} games of {}'.format(len(stale), year))
+    save_games([(create_url(g, START_PERIOD, END_PERIOD), prefix) for g in sorted(stale)],
+               workers=workers, refresh=True)
+
+    # 2. Probe forward, a batch of game numbers at a time
+    game_number = saved_frontier(year, manifest) + 1
+    misses = 0
+    while misses < max_misses and game_number <= MAX_REGULAR_GAMES:
+        batch = range(game_number, min(game_number + max(workers, 1), MAX_REGULAR_GAMES + 1))
+        game_number = batch[-1] + 1
+        gameids = [create_regular_gameid(year, n) for n in batch]
+        # Nonexistent games may have been played since, so they're probed again
+        jobs = [(create_url(g, START_PERIOD, END_PERIOD), prefix) for g in gameids
+                if manifest.status(g) not in (NBAManifest.FETCHED, NBAManifest.PARTIAL)]
+        save_games(jobs, workers=workers, refresh=True)
 
+        for gameid in gameids:
+            if manifest.status(gameid) == NBAManifest.EMPTY:
+                misses += 1
+            elif manifest.status(gameid) != NBAManifest.FAILED:
+                misses = 0
 
-def save_playoffs(year):
-    '''Saves the playoffs to disk, organizing by round.'''
+
+def save_playoffs(year, workers=1):
+    '''
+    Saves the playoffs to disk, organizing by round. Series of a round are
+    fetched in parallel, each one stopping after it is decided, and rounds
+    that haven't started yet are skipped. Run again as the playoffs go on:
+    saved games are loaded from disk and only the first missing game of
+    each series, and the game 1s of the next round, are requested.
+    '''
 
     assert len(str(year)) <= 2
 
-    g = playoff_url_generator(year)
-    for url in g:
-        _, p_round, _, _ = deconstruct_url(url)
-        get_game_data(url, prefix=os.path.join(FILE_DIR, str(year), 'Round' + p_round))
+    manifest = get_manifest()
+    for p_round, num_series in zip(range(1, 5), NUM_SERIES):
+        found = []
+        run_workers(lambda s: found.append(save_series(year, p_round, s, manifest)),
+                    range(num_series), workers=workers)
+        if not any(found):
+            log('Round {} of {} has not started. Stopping.'.format(p_round, year))
+            return
+
+
+def backfill(years, regular=True, playoffs=True, workers=MAX_WORKERS):
+    '''
+    Saves several seasons to disk. The regular seasons share one worker pool
+    across all years; the playoffs are then discovered year by year.
+    '''
+
+    def jobs():
+        for year in years:
+            assert len(str(year)) <= 2
+            for job in regular_season_jobs(year):
+                yield job
+
+    if regular:
+        save_games(jobs(), workers=workers)
+    if playoffs:
+        for year in years:
+            save_playoffs(year, workers=workers)
+
+
+##### PIPELINE
+def fetch_game(job, manifest, refresh=False):
+    '''
+    Fetch stage of pipeline_games. Returns (url, prefix, gameid, text) for a
+    (url, prefix) job, or None if the game is already saved or the request
+    failed (it is then recorded as a dead letter).
+    '''
+
+    url, prefix = job
+    gameid = parse_url(url)[1]['GameID'][0]
+    if not refresh and manifest.status(gameid) is None and has_game(prefix, gameid):
+        log('File {} found, skipping'.format(gameid))
+        fpath = os.path.join(prefix, gameid)
+        manifest.record(gameid, NBAManifest.FETCHED, url=url, prefix=prefix,
+                        nbytes=os.path.getsize(fpath) if os.path.isfile(fpath) else None)
+        count('cache_hits')
+        return None
+
+    log('Requesting game data for GameId = {}'.format(gameid))
+    try:
+        text = request_game_data(url, raw=True)
+    except (requests.RequestException, ValueError) as e:
+        log('Failed to get {}: {}'.format(url, e))
+        record_dead_letter(url, prefix, e)
+        return None
+    return (url, prefix, gameid, text)
+
+
+def parse_game(fetched):
+    '''
+    Parse stage of pipeline_games. Decodes and checks the rows of a fetched
+    game and works out everything the write stage needs to index it, so
+    only plain values go back when it runs in another process. Returns a
+    dict; 'error' is set if the rows are malformed and 'empty' if the game
+    doesn't exist.
+    '''
+
+    url, prefix, gameid, text = fetched
+    parsed = {'url': url, 'prefix': prefix, 'gameid': gameid, 'text': text,
+              'error': None, 'empty': False}
+    try:
+        data = json.loads(text)
+        if not isinstance(data, list) or not all(isinstance(row, list) for row in data):
+            raise ValueError('rows of {} are not a list of lists'.format(gameid))
+        if not data:
+            parsed['empty'] = True
+            return parsed
+        parsed['final'] = is_final(data)
+        parsed['teams'] = sorted(get_teams(data))
+        parsed['players'] = dict(player_rows(data))
+        parsed['aggregates'] = NBAAggregates.summarize_game(data)
+    except ValueError as e:
+        parsed['error'] = e
+    return parsed
+
+
+def save_parsed_game(parsed, manifest):
+    '''Write stage of pipeline_games. Saves and indexes a parsed game and records it.'''
+
+    url, prefix, gameid = parsed['url'], parsed['prefix'], parsed['gameid']
+    if parsed['error']:
+        log('Bad data for {}: {}'.format(url, parsed['error']))
+        record_dead_letter(url, prefix, parsed['error'])
+        return
+    if parsed['empty']:
+        log('The url {} points to a nonexistent game.'.format(url))
+        count('empty_games')
+        manifest.record(gameid, NBAManifest.EMPTY, url=url, prefix=prefix)
+        return
+
+    text = parsed['text']
+    log('Saving {} to disk'.format(gameid))
+    with timed('write'):
+        make_dirs(prefix)
+        write_game(os.path.join(prefix, gameid), text)
+    with timed('index'):
+        add_team_index_entry(prefix, gameid, parsed['teams'])
+        add_player_index_entry(prefix, gameid, parsed['players'])
+        get_aggregates().record(*parsed['aggregates'])
+    count('games_saved')
+    count('bytes_written', len(text))
+    status = NBAManifest.FETCHED if parsed['final'] else NBAManifest.PARTIAL
+    manifest.record(gameid, status, url=url, prefix=prefix, nbytes=len(text))
+
+
+def pipeline_games(jobs, fetchers=MAX_WORKERS, parsers=PARSERS, writers=WRITERS,
+                   parse_processes=False, refresh=False, queue_size=NBAPipeline.QUEUE_SIZE):
+    '''
+    Saves games given an iterable of (url, prefix) jobs like save_games, but
+    with fetching, parsing and writing overlapped: `fetchers` threads request
+    games, `parsers` workers (processes with parse_processes) decode and
+    check them, and `writers` threads save, index and record them, with a
+    bounded queue of queue_size games between stages. Throughput is then
+    set by the slowest stage rather than the sum of all three.
+    '''
+
+    manifest = get_manifest()
+    NBAPipeline.Pipeline([
+        NBAPipeline.Stage('fetch', lambda job: fetch_game(job, manifest, refresh),
+                          workers=fetchers),
+        NBAPipeline.Stage('parse', parse_game, workers=parsers, processes=parse_processes),
+        NBAPipeline.Stage('save', lambda parsed: save_parsed_game(parsed, manifest),
+                          workers=writers),
+    ], queue_size=queue_size).run(pending_jobs(jobs, manifest, refresh))
+
+
+def playoff_jobs(year):
+    '''Generator for (url, prefix) jobs of every possible playoff game of a year.'''
+
+    for url in playoff_url_generator(year):
+        p_round = parse_url(url)[1]['GameID'][0][-3]
+        yield (url, os.path.join(FILE_DIR, season_dirname(year), 'Round' + p_round))
+
+
+def pipeline_backfill(years, regular=True, playoffs=True, **options):
+    '''
+    Saves several seasons through one pipeline (see pipeline_games for the
+    options). Playoff series can't be discovered game by game in a
+    pipeline, so every possible playoff game is requested and those that
+    weren't played are recorded as nonexistent.
+    '''
+
+    def jobs():
+        for year in years:
+            assert len(str(year)) <= 2
+            if regular:
+                for job in regular_season_jobs(year):
+                    yield job
+            if playoffs:
+                for job in playoff_jobs(year):
+                    yield job
+
+    pipeline_games(jobs(), **options)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Scrape NBA play-by-play data.')
+    parser.add_argument('years', nargs='*', type=int,
+                        help='last two digits of the beginning year of each season')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help='max number of games fetched at once')
+    parser.add_argument('--rate', type=float, default=NBAHttp.REQUESTS_PER_SECOND,
+                        help='max requests per second to stats.nba.com (0 = no limit)')
+    parser.add_argument('--connect-timeout', type=float, default=NBAHttp.CONNECT_TIMEOUT,
+                        help='seconds to wait for a connection')
+    parser.add_argument('--read-timeout', type=float, default=NBAHttp.READ_TIMEOUT,
+                        help='seconds to wait for a response')
+    parser.add_argument('--retries', type=int, default=NBAHttp.MAX_RETRIES,
+                        help='max retries per request before giving up on a game')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='retry the games in the dead letter file first')
+    parser.add_argument('--verify', action='store_true',
+                        help='check the saved files of each season and fetch corrupt ones again')
+    parser.add_argument('--group-commit', type=int, default=0,
+                        help='fsync and rename saved games in batches of up to this many')
+    parser.add_argument('--progress', action='store_true',
+                        help='only print how much of each season has been scraped')
+    parser.add_argument('--base-url', default=BASE_URL,
+                        help='play-by-play endpoint, e.g. of a local NBAMockServer')
+    parser.add_argument('--cache-responses', action='store_true',
+                        help='keep compressed raw responses and revalidate them conditionally')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='revalidate the cached responses of each regular season and '
+                             'save the games that changed again')
+    parser.add_argument('--update', action='store_true',
+                        help='only fetch new and unfinished regular season games')
+    parser.add_argument('--no-regular', dest='regular', action='store_false',
+                        help='skip the regular season')
+    parser.add_argument('--no-playoffs', dest='playoffs', action='store_false',
+                        help='skip the playoffs')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='overlap fetching, parsing and writing in separate stages')
+    parser.add_argument('--parsers', type=int, default=PARSERS,
+                        help='parse stage workers of the pipeline')
+    parser.add_argument('--writers', type=int, default=WRITERS,
+                        help='write stage workers of the pipeline')
+    parser.add_argument('--parse-processes', action='store_true',
+                        help='run the parse stage in worker processes instead of threads')
+    parser.add_argument('--quiet', action='store_true',
+                        help="don't print a line for every game")
+    parser.add_argument('--metrics',
+                        help='file to export per-stage timings and counters to')
+    parser.add_argument('--metrics-format', choices=['jsonl', 'prometheus'], default='jsonl')
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help='seconds between metrics exports')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    # save_regular_season(16)
-    save_playoffs(15)
+    # e.g. python NBAScrapeGames.py 14 15 16 --workers 8 --rate 4
+    #      python NBAScrapeGames.py 14 15 16 --pipeline --workers 16 --parsers 4 --parse-processes
+    args = parse_args()
+    BASE_URL = args.base_url
+    CACHE_RESPONSES = args.cache_responses
+    NBAMetrics.QUIET = args.quiet
+    if args.progress:
+        for year in args.years:
+            print_progress(year)
+        raise SystemExit
+    NBAHttp.configure(pool_size=args.workers, rate=args.rate,
+                      connect_timeout=args.connect_timeout,
+                      read_timeout=args.read_timeout,
+                      max_retries=args.retries)
+    writer = None
+    if args.metrics:
+        writer = NBAMetrics.MetricsWriter(NBAMetrics.METRICS, args.metrics,
+                                          fmt=args.metrics_format,
+                                          interval=args.metrics_interval).start()
+    if args.group_commit > 1:
+        GROUP_COMMIT = NBAFiles.GroupCommit(max_batch=args.group_commit)
+    try:
+        if args.verify:
+            for year in args.years:
+                verify_season(year)
+        if args.retry_failed or args.verify:
+            retry_dead_letters(workers=args.workers)
+        if args.revalidate:
+            CACHE_RESPONSES = True # changed games are saved from the fresh cache entries
+            for year in args.years:
+                changed = revalidate_season(year)
+                log('{} games of {} changed upstream'.format(len(changed), year))
+                prefix = os.path.join(FILE_DIR, season_dirname(year))
+                save_games([(create_url(g, START_PERIOD, END_PERIOD), prefix) for g in changed],
+                           workers=args.workers, refresh=True)
+        elif args.update:
+            for year in args.years:
+                update_regular_season(year, workers=args.workers)
+        elif args.pipeline:
+            pipeline_backfill(args.years, regular=args.regular, playoffs=args.playoffs,
+                              fetchers=args.workers, parsers=args.parsers,
+                              writers=args.writers, parse_processes=args.parse_processes)
+        else:
+            backfill(args.years, regular=args.regular, playoffs=args.playoffs,
+                     workers=args.workers)
+    finally:
+        if writer:
+            writer.stop()
+        print NBAMetrics.METRICS.summary()
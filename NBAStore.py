@@ -0,0 +1,298 @@
+'''
+Columnar storage for a directory of saved games (a regular season or a
+playoff round). All rows of all games in the directory are kept column by
+column in a hidden .store folder next to the per-game JSON files:
+
+    .store/meta.json  - gameids, row offsets, column kinds and vocabularies
+    .store/c{i}.npy   - one array per column, memory-mapped on load
+
+Columns holding only ints or nulls (period, player/team ids, ...) are stored
+as the smallest int type that fits, with that type's minimum for null.
+Everything else (clock, score, player names, team abbreviations,
+descriptions, ...) is dictionary encoded: an array of small int codes into a
+vocabulary of distinct values, with -1 for null. Rows decode back to exactly
+what json.load would have returned.
+
+Whole rows are decoded a block of BLOCK_ROWS rows (dozens of games) at a
+time, column by column into one object array, and the last CACHED_BLOCKS
+blocks are kept. Loading every game of a folder then decodes each column
+once per block rather than once per game, and a game's rows are one slice
+of a block. Callers that only need a few columns should still ask for just
+those (see NBAUtils.load_columns).
+'''
+
+import collections
+import json
+import os
+import shutil
+import threading
+import numpy as np
+import NBAFiles
+
+
+STORE_DIRNAME = '.store'
+META_FNAME = 'meta.json'
+NULL_CODE = -1
+INT_TYPES = [np.int8, np.int16, np.int32, np.int64]
+BLOCK_ROWS = 8 * 1024 # rows decoded at once for whole-row loads
+CACHED_BLOCKS = 8 # decoded row blocks kept per store
+
+# Column kinds
+INT = 'int'
+DICT = 'dict'
+
+
+def store_path(path):
+    return os.path.join(path, STORE_DIRNAME)
+
+
+def column_fname(i):
+    return 'c{}.npy'.format(i)
+
+
+def smallest_int_type(low, high):
+    '''Returns the smallest int type holding [low, high] with its minimum to spare.'''
+
+    for dtype in INT_TYPES:
+        info = np.iinfo(dtype)
+        if info.min < low and high <= info.max:
+            return dtype
+    raise ValueError('Values out of int64 range')
+
+
+def column_kind(values):
+    '''Returns INT if every value is an int or None, else DICT.'''
+
+    for v in values:
+        if v is not None and (isinstance(v, bool) or not isinstance(v, (int, long))):
+            return DICT
+    return INT
+
+
+def encode_column(values):
+    '''Returns (kind, array, vocab) for a list of column values.'''
+
+    kind = column_kind(values)
+    if kind == INT:
+        present = [v for v in values if v is not None] or [0]
+        dtype = smallest_int_type(min(present), max(present))
+        null = np.iinfo(dtype).min
+        array = np.array([null if v is None else v for v in values], dtype=dtype)
+        return (kind, array, None)
+
+    vocab = []
+    codes = {}
+    encoded = []
+    for v in values:
+        if v is None:
+            encoded.append(NULL_CODE)
+            continue
+        code = codes.get(v)
+        if code is None:
+            code = codes[v] = len(vocab)
+            vocab.append(v)
+        encoded.append(code)
+    array = np.array(encoded, dtype=smallest_int_type(NULL_CODE, len(vocab)))
+    return (kind, array, vocab)
+
+
+def write_store(path, games):
+    '''
+    Writes a store for path given a list of (gameid, rows) pairs, replacing
+    any existing one. The new store is built next to the old one and swapped
+    in at the end, so readers never see a half written store.
+    '''
+
+    games = sorted(games)
+    gameids = [gameid for gameid, _ in games]
+    offsets = [0]
+    for _, rows in games:
+        offsets.append(offsets[-1] + len(rows))
+    num_columns = max([len(rows[0]) for _, rows in games if rows] or [0])
+
+    tmp_path = store_path(path) + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    columns = []
+    for i in range(num_columns):
+        values = [row[i] for _, rows in games for row in rows]
+        kind, array, vocab = encode_column(values)
+        np.save(os.path.join(tmp_path, column_fname(i)), array)
+        columns.append({'kind': kind, 'vocab': vocab})
+
+    meta = {'gameids': gameids, 'offsets': offsets, 'columns': columns}
+    with open(os.path.join(tmp_path, META_FNAME), 'w') as outfile:
+        json.dump(meta, outfile)
+    if NBAFiles.SYNC:
+        for fname in os.listdir(tmp_path):
+            NBAFiles.fsync_path(os.path.join(tmp_path, fname))
+        NBAFiles.fsync_path(tmp_path)
+
+    # Swap the new store in. The old one is moved aside rather than deleted
+    # first, so a crash in between leaves a store for open_store to recover.
+    final_path = store_path(path)
+    old_path = final_path + '.old'
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(final_path):
+        os.rename(final_path, old_path)
+    os.rename(tmp_path, final_path)
+    if NBAFiles.SYNC:
+        NBAFiles.fsync_path(path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+
+class SeasonStore(object):
+    '''Read side of a store. Column arrays are memory-mapped on first use.'''
+
+    def __init__(self, path):
+        self.path = store_path(path)
+        with open(os.path.join(self.path, META_FNAME), 'r') as infile:
+            meta = json.load(infile)
+        self.gameids = [str(g) for g in meta['gameids']]
+        self.offsets = meta['offsets']
+        self.kinds = [c['kind'] for c in meta['columns']]
+        self.vocabs = [c['vocab'] for c in meta['columns']]
+        self.index = dict((g, i) for i, g in enumerate(self.gameids))
+        self.arrays = {}
+        self.blocks = collections.OrderedDict() # block number -> decoded rows, LRU
+        self.blocks_lock = threading.Lock()
+        # Decoding tables; code -1 (null) picks the trailing None
+        self.lookups = [np.array(v + [None], dtype=object) if v is not None else None
+                        for v in self.vocabs]
+
+    def __contains__(self, gameid):
+        return gameid in self.index
+
+    def __len__(self):
+        return len(self.gameids)
+
+    @property
+    def num_columns(self):
+        return len(self.kinds)
+
+    def column(self, i):
+        '''Returns the raw (memory-mapped) array of column i for every row.'''
+
+        if i not in self.arrays:
+            self.arrays[i] = np.load(os.path.join(self.path, column_fname(i)), mmap_mode='r')
+        return self.arrays[i]
+
+    def game_slice(self, gameid):
+        '''Returns the (start, stop) row range of gameid.'''
+
+        i = self.index[gameid]
+        return (self.offsets[i], self.offsets[i + 1])
+
+    def decode(self, i, start=0, stop=None):
+        '''Returns the values of column i for rows [start, stop) as a list.'''
+
+        return self.decode_array(i, start, stop).tolist()
+
+    def decode_array(self, i, start=0, stop=None):
+        '''Returns the values of column i for rows [start, stop) as an object array.'''
+
+        array = self.column(i)[start:stop]
+        if self.kinds[i] == DICT:
+            return self.lookups[i][array]
+        values = array.astype(object)
+        values[array == np.iinfo(array.dtype).min] = None
+        return values
+
+    def decode_at(self, i, rows):
+        '''Returns the values of column i for an array of row numbers as a list.'''
+
+        array = self.column(i)[rows]
+        if self.kinds[i] == DICT:
+            return self.lookups[i][array].tolist()
+        values = array.astype(object)
+        values[array == np.iinfo(array.dtype).min] = None
+        return values.tolist()
+
+    def match(self, i, values):
+        '''
+        Returns a bool array over all rows, set where column i holds one of
+        values. Values are compared to codes, so nothing is decoded.
+        '''
+
+        array = np.asarray(self.column(i))
+        if self.kinds[i] == DICT:
+            codes = [c for c, v in enumerate(self.vocabs[i]) if v in values]
+            if None in values:
+                codes.append(NULL_CODE)
+        else:
+            codes = [v for v in values if isinstance(v, (int, long)) and not isinstance(v, bool)]
+            if None in values:
+                codes.append(np.iinfo(array.dtype).min)
+        return np.in1d(array, codes)
+
+    def row_block(self, b):
+        '''
+        Returns rows [b * BLOCK_ROWS, (b + 1) * BLOCK_ROWS) decoded into a 2-D
+        object array, from the block cache if there.
+        '''
+
+        with self.blocks_lock:
+            block = self.blocks.pop(b, None)
+            if block is not None:
+                self.blocks[b] = block
+                return block
+        start = b * BLOCK_ROWS
+        stop = min(start + BLOCK_ROWS, self.offsets[-1])
+        block = np.empty((stop - start, self.num_columns), dtype=object)
+        for i in range(self.num_columns):
+            block[:, i] = self.decode_array(i, start, stop)
+        with self.blocks_lock:
+            self.blocks[b] = block
+            while len(self.blocks) > CACHED_BLOCKS:
+                self.blocks.popitem(last=False)
+        return block
+
+    def rows_between(self, start, stop):
+        '''Returns rows [start, stop) as a list of lists.'''
+
+        rows = []
+        while start < stop:
+            base = start // BLOCK_ROWS * BLOCK_ROWS
+            end = min(stop, base + BLOCK_ROWS)
+            rows.extend(self.row_block(base // BLOCK_ROWS)[start - base:end - base].tolist())
+            start = end
+        return rows
+
+    def rows(self, gameid):
+        '''Returns the rows of gameid as a list of lists, like json.load would.'''
+
+        start, stop = self.game_slice(gameid)
+        return self.rows_between(start, stop)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(path):
+    '''
+    Returns the SeasonStore for path, or None if there isn't one. Stores are
+    cached and reopened when their meta file changes.
+    '''
+
+    meta_path = os.path.join(store_path(path), META_FNAME)
+    try:
+        mtime = os.path.getmtime(meta_path)
+    except OSError:
+        old_path = store_path(path) + '.old'
+        if os.path.isfile(os.path.join(old_path, META_FNAME)) and \
+                not os.path.exists(store_path(path)): # crashed mid-swap in write_store
+            os.rename(old_path, store_path(path))
+            return open_store(path)
+        return None
+
+    key = os.path.abspath(path)
+    with _stores_lock:
+        cached = _stores.get(key)
+        if cached is None or cached[0] != mtime:
+            cached = _stores[key] = (mtime, SeasonStore(path))
+        return cached[1]
@@ -11,7 +11,7 @@ https://udger.com/resources/ua-list/os-detail?os=macOS%2010.12%20Sierra
 Breakdown of data (33 items):
 0  - gameId
 1  - eventNumber (seems buggy)
-2  - NAN
+2  - eventType
 3  - NAN
 4  - period
 5  - time (est)
@@ -19,7 +19,7 @@ Breakdown of data (33 items):
 7  - homeEvent
 8  - NAN
 9  - awayEvent
-10 - score
+10 - score (away - home)
 11 - NAN
 12 - NAN (player something?)
 13 - playerId1 (?)
@@ -50,20 +50,18 @@ import json
 import os
 import urlparse
 import time
-import requests
+import NBADecode
+import NBAEvents
+import NBAFiles
+import NBAHttp
+import NBAScoring
+import NBAUtils
+from NBAColumns import PERIOD_INDEX, PERIOD_TIME_INDEX, SCORE_INDEX
 
 FILE_DIR = './data/'
-PERIOD_INDEX = 4
-PERIOD_TIME_INDEX = 6
-SCORE_INDEX = 10
 GAMETIME = 48 * 60
 OT_LENGTH = 5 * 60
 
-HEADERS = {
-    'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12) AppleWebKit/602.1.43 (KHTML, like Gecko) Version/10.0 Safari/602.1.43',
-    'referer': 'http://stats.nba.com/scores/',
-}
-
 warriors_url = 'http://stats.nba.com/stats/playbyplayv2?EndPeriod=10&EndRange=55800&GameID=0041600221&RangeType=2&Season=2016-17&SeasonType=Playoffs&StartPeriod=1&StartRange=0'
 boston_url = 'http://stats.nba.com/stats/playbyplayv2?EndPeriod=10&EndRange=55800&GameID=0041600202&RangeType=2&Season=2016-17&SeasonType=Playoffs&StartPeriod=1&StartRange=0'
 
@@ -89,27 +87,26 @@ def get_game_data(game_url, save=True):
     fpath = FILE_DIR + fname
     if os.path.isfile(fpath):
         print 'File {} found, loading and returning'.format(fname)
-        with open(fpath, 'r') as infile:
-            return json.load(infile)
+        return NBAUtils.load_game(FILE_DIR, fname)
 
     print 'No file found, sending request'
-    response = requests.get(base, params=params, headers=HEADERS, timeout=2)
-    response.raise_for_status() # Raise exception if invalid response
+    response = NBAHttp.fetch(base, params=params)
     data = response.json()['resultSets'][0]['rowSet']
 
     # Save data
     if save:
         assert not os.path.isfile(fpath) # we check this above
-        with open(fpath, 'w') as outfile:
-            print 'Saving {} to disk'.format(fname)
-            json.dump(data, outfile)
+        print 'Saving {} to disk'.format(fname)
+        NBAFiles.atomic_write(fpath, json.dumps(data)) # never leaves a truncated file
 
     return data
 
 
 def get_score(data_row):
-    '''Returns score as a list [teamScore1, teamScore2].'''
+    '''Returns score as a list [teamScore1, teamScore2]. data_row may be an Event.'''
 
+    if isinstance(data_row, NBAEvents.Event):
+        return data_row.score
     score = data_row[SCORE_INDEX]
     if score:
         return map(int, str(score).replace(' ','').split('-'))
@@ -117,17 +114,23 @@ def get_score(data_row):
 
 
 def get_seconds_elapsed(data_row):
-    '''Returns overall seconds elapsed in the game.'''
+    '''
+    Returns overall seconds elapsed in the game. Overtime periods are 5 minutes.
+    data_row may be an Event.
+    '''
 
+    if isinstance(data_row, NBAEvents.Event):
+        return data_row.seconds_elapsed
     period = data_row[PERIOD_INDEX]
     period_time = data_row[PERIOD_TIME_INDEX]
-    period_seconds = 12 * 60
+    period_seconds = 12 * 60 if period <= 4 else OT_LENGTH
+    period_start = (period - 1) * 12 * 60 if period <= 4 else GAMETIME + (period - 5) * OT_LENGTH
 
     # Time elapsed in current period
     time_struct = time.strptime(str(period_time), '%M:%S')
     seconds_elapsed = period_seconds - (time_struct.tm_min * 60 + time_struct.tm_sec)
 
-    return (period - 1) * period_seconds + seconds_elapsed
+    return period_start + seconds_elapsed
 
 
 def format_game_data(game_url):
@@ -136,80 +139,56 @@ def format_game_data(game_url):
     the game length (in case of overtime).
     '''
 
-    team1 = [(0, 0)]
-    team2 = [(0, 0)]
-    last_score1 = 0
-    last_score2 = 0
     data = get_game_data(game_url)
+    decoded = NBADecode.decode_game(data)
 
-    for row in data:
-        time_elapsed = get_seconds_elapsed(row)
-
-        score1 = score2 = None
-        score = get_score(row)
-        if score:
-            score1, score2 = get_score(row)
-
-        if score1 and score1 != last_score1:
-            assert not (score2 and score2 != last_score2) # teams can't score at same time
-            team1.append((time_elapsed, score1))
-            last_score1 = score1
-        elif score2 and score2 != last_score2:
-            team2.append((time_elapsed, score2))
-            last_score2 = score2
+    # Only rows with a score, and of those only the ones where a score changed
+    has_score = decoded['away_score'] != NBADecode.NO_SCORE
+    times = decoded['seconds_elapsed'][has_score]
+    score1 = decoded['away_score'][has_score]
+    score2 = decoded['home_score'][has_score]
+    changed1 = score1 != np.concatenate([[0], score1[:-1]])
+    changed2 = score2 != np.concatenate([[0], score2[:-1]])
+    assert not (changed1 & changed2).any() # teams can't score at same time
 
-    max_time = GAMETIME
-    max_period = max(map(lambda x: x[PERIOD_INDEX], data))
-    max_time = GAMETIME + (max_period - 4) * OT_LENGTH
+    team1 = [(0, 0)] + zip(times[changed1].tolist(), score1[changed1].tolist())
+    team2 = [(0, 0)] + zip(times[changed2].tolist(), score2[changed2].tolist())
+    max_time = int(NBADecode.game_length(decoded['period'].max()))
 
     return (team1, team2, max_time)
 
 
-def calculate_average_scores(data, max_time=GAMETIME):
-    '''Returns list of average score at each time t.'''
+def calculate_average_scores(data, max_time=GAMETIME, reverse=False):
+    '''Returns list of average score at each time t. See NBAScoring.'''
 
-    score_dict = dict(data)
-    avg = 0.0
-    last_score = 0
-    avgs = [] # average over time
-    for t in range(max_time):
-        t_score = 0
-        if t in score_dict:
-            t_score = score_dict[t] - last_score
-            last_score = t_score
-        avg += ((max_time - t) * t_score) / float(max_time)
-        avgs.append(avg)
+    return NBAScoring.average_scores_batch([data], [max_time], reverse=reverse)[0].tolist()
 
-    return avgs
 
-
-def calculate_average_score(data):
+def calculate_average_score(data, max_time=GAMETIME):
     '''Calculate the average score for the whole game.'''
 
-    return calculate_average_scores(data)[-1]
+    return calculate_average_scores(data, max_time=max_time)[-1]
 
 
 def calculate_average_score_diffs(data1, data2, reverse=False, max_time=GAMETIME):
     '''
     Given data from format_game_data(), returns the average score difference
-    at each time (team1 - team2).
+    at each time (team1 - team2). With reverse=True the statistic is
+    calculated starting at the end of the game.
     '''
 
-    if reverse:
-        # In this case, we'll calculate the statistic starting at the end of the game.
-        data1 = data1[::-1]
-        data2 = data2[::-1]
-
-    team_avgs1 = calculate_average_scores(data1, max_time=max_time)
-    team_avgs2 = calculate_average_scores(data2, max_time=max_time)
-
-    return np.subtract(team_avgs1, team_avgs2).tolist()
+    return NBAScoring.average_score_diffs_batch(
+        [data1], [data2], max_times=[max_time], reverse=reverse)[0].tolist()
 
 
 def calculate_average_score_diff(data_tup, reverse=False):
-    '''Calculates the average score difference for the game (team1 - team2).'''
+    '''
+    Calculates the average score difference for the game (team1 - team2),
+    given the (team1, team2, max_time) tuple of format_game_data().
+    '''
 
-    return calculate_average_score_diffs(data_tup, reverse=reverse)[-1]
+    data1, data2, max_time = data_tup
+    return calculate_average_score_diffs(data1, data2, reverse=reverse, max_time=max_time)[-1]
 
 
 def plot_time_data(data, title='', max_time=GAMETIME):
@@ -223,4 +202,4 @@ def plot_time_data(data, title='', max_time=GAMETIME):
 if __name__ == '__main__':
     data1, data2, max_time = format_game_data(boston_url)
     score_diffs = calculate_average_score_diffs(data1, data2, max_time=max_time)
-    plot_time_data(score_diffs, 'Average Score Difference vs. Time', max_time=max_tim   e)
+    plot_time_data(score_diffs, 'Average Score Difference vs. Time', max_time=max_time)
@@ -0,0 +1,268 @@
+'''
+Game-state timelines: a game's play-by-play turned into dense arrays
+sampled every `resolution` seconds of game time:
+
+    margin     - away score - home score
+    period     - period being played
+    possession - 1 if the away team has the ball, -1 the home team, 0 unknown
+
+Possession is approximated from the events: the ball goes to the other team
+after a made shot or a turnover, stays with the shooter's team on a miss or
+a free throw, and goes to the rebounding team on a rebound.
+
+Timelines are cached per game as .npz files in a hidden .timelines folder
+next to the games and rebuilt when the game changes. A season's timelines
+are stacked into (games x samples) matrices so league-wide curves are
+plain reductions:
+
+    batch = season_timelines(15)
+    average_margin(batch), comeback_rate(batch, 15), win_probability(batch)
+'''
+
+import os
+import numpy as np
+import NBADecode
+import NBAEvents
+import NBAStore
+import NBAUtils
+
+
+CACHE_DIRNAME = '.timelines'
+RESOLUTION = 1 # seconds between samples
+AWAY = 1
+HOME = -1
+
+# Event types
+MADE_SHOT = 1
+MISSED_SHOT = 2
+FREE_THROW = 3
+REBOUND = 4
+TURNOVER = 5
+
+
+class Timeline(object):
+    '''The sampled state of one game. Sample i is the state at i * resolution seconds.'''
+
+    __slots__ = ('gameid', 'resolution', 'margin', 'period', 'possession')
+
+    def __init__(self, gameid, resolution, margin, period, possession):
+        self.gameid = gameid
+        self.resolution = resolution
+        self.margin = margin
+        self.period = period
+        self.possession = possession
+
+    def __len__(self):
+        return len(self.margin)
+
+    @property
+    def elapsed(self):
+        return np.arange(len(self)) * self.resolution
+
+    @property
+    def final_margin(self):
+        return int(self.margin[-1]) if len(self) else 0
+
+
+def period_at(elapsed):
+    '''Returns the period being played after elapsed seconds. Works on arrays too.'''
+
+    elapsed = np.asarray(elapsed)
+    regulation = NBADecode.NUM_PERIODS * NBADecode.PERIOD_LENGTH
+    return np.where(elapsed < regulation,
+                    elapsed // NBADecode.PERIOD_LENGTH + 1,
+                    NBADecode.NUM_PERIODS + 1 + (elapsed - regulation) // NBADecode.OT_LENGTH)
+
+
+def forward_fill(values, known):
+    '''Carries values[i] forward over the rows where known is False (0 before the first).'''
+
+    last = np.maximum.accumulate(np.where(known, np.arange(len(values)), -1))
+    return np.where(last >= 0, values[np.maximum(last, 0)], 0)
+
+
+def event_possession(pbp, away_code, home_code):
+    '''Returns, for every event, which side has the ball after it (0 = no change).'''
+
+    team = pbp.team_abbrevs[:, 0]
+    side = np.where(team == away_code, AWAY, np.where(team == home_code, HOME, 0))
+    event_type = pbp.event_type
+    keeps = np.in1d(event_type, [MISSED_SHOT, FREE_THROW, REBOUND])
+    flips = np.in1d(event_type, [MADE_SHOT, TURNOVER])
+    return np.where(keeps, side, np.where(flips, -side, 0))
+
+
+def build_timeline(pbp, resolution=RESOLUTION):
+    '''Builds the Timeline of a NBAEvents.PlayByPlay.'''
+
+    if not len(pbp):
+        empty = np.zeros(0, dtype=np.int16)
+        return Timeline(pbp.gameid, resolution, empty, empty.astype(np.int8),
+                        empty.astype(np.int8))
+
+    length = int(NBADecode.game_length(int(pbp.period.max())))
+    samples = np.arange(0, length + 1, resolution) # up to and including the final buzzer
+
+    # State after the last event at or before each sample
+    elapsed = np.maximum.accumulate(np.asarray(pbp.seconds_elapsed))
+    event = np.searchsorted(elapsed, samples, side='right') - 1
+    before_first = event < 0
+    event = np.maximum(event, 0)
+
+    margins = NBADecode.fill_scores(pbp.away_score) - NBADecode.fill_scores(pbp.home_score)
+    margin = np.where(before_first, 0, margins[event])
+
+    away, home = NBAUtils.get_sides(pbp)
+    unknown = NBAEvents.NULL - 1 # matches no row, not even those without a team
+    changes = event_possession(pbp,
+                               NBAEvents.TEAM_ABBREVS.encode(away) if away else unknown,
+                               NBAEvents.TEAM_ABBREVS.encode(home) if home else unknown)
+    possessions = forward_fill(changes, changes != 0)
+    possession = np.where(before_first, 0, possessions[event])
+
+    return Timeline(pbp.gameid, resolution, margin.astype(np.int16),
+                    period_at(samples).astype(np.int8), possession.astype(np.int8))
+
+
+##### CACHE
+def source_stamp(path, gameid):
+    '''Returns a stamp of what a game is loaded from, which changes when the game does.'''
+
+    fpath = os.path.join(path, gameid)
+    if os.path.isfile(fpath):
+        st = os.stat(fpath)
+        return np.array([st.st_mtime, st.st_size])
+    meta_path = os.path.join(NBAStore.store_path(path), NBAStore.META_FNAME)
+    return np.array([os.path.getmtime(meta_path), -1.0])
+
+
+def cache_path(path, gameid):
+    return os.path.join(path, CACHE_DIRNAME, gameid + '.npz')
+
+
+def load_timeline(path, gameid, resolution=RESOLUTION):
+    '''
+    Returns the Timeline of a game saved at path, from the cache if it is
+    still current, building and caching it otherwise.
+    '''
+
+    stamp = source_stamp(path, gameid)
+    fpath = cache_path(path, gameid)
+    try:
+        with np.load(fpath) as cached:
+            if (cached['stamp'] == stamp).all() and int(cached['resolution']) == resolution:
+                return Timeline(gameid, resolution, cached['margin'], cached['period'],
+                                cached['possession'])
+    except (IOError, KeyError, ValueError):
+        pass # not cached yet, or unreadable
+
+    timeline = build_timeline(NBAEvents.load_events(path, gameid), resolution)
+    if not os.path.isdir(os.path.dirname(fpath)):
+        try:
+            os.makedirs(os.path.dirname(fpath))
+        except OSError:
+            pass
+    tmp_path = fpath + '.tmp.npz'
+    np.savez(tmp_path, stamp=stamp, resolution=resolution, margin=timeline.margin,
+             period=timeline.period, possession=timeline.possession)
+    os.rename(tmp_path, fpath)
+    return timeline
+
+
+##### SEASONS
+class TimelineBatch(object):
+    '''
+    Timelines of many games stacked into (games x samples) matrices. Games
+    shorter than the longest one are padded: margin keeps its final value,
+    period and possession are 0. active marks the real samples.
+    '''
+
+    def __init__(self, timelines, resolution=RESOLUTION):
+        self.gameids = [t.gameid for t in timelines]
+        self.resolution = resolution
+        self.lengths = np.array([len(t) for t in timelines], dtype=np.int64)
+        width = int(self.lengths.max()) if len(timelines) else 0
+        self.active = np.arange(width)[None, :] < self.lengths[:, None]
+        self.margin = np.zeros((len(timelines), width), dtype=np.int16)
+        self.period = np.zeros((len(timelines), width), dtype=np.int8)
+        self.possession = np.zeros((len(timelines), width), dtype=np.int8)
+        for g, t in enumerate(timelines):
+            n = len(t)
+            self.margin[g, :n] = t.margin
+            self.margin[g, n:] = t.final_margin
+            self.period[g, :n] = t.period
+            self.possession[g, :n] = t.possession
+
+    def __len__(self):
+        return len(self.gameids)
+
+    @property
+    def elapsed(self):
+        return np.arange(self.margin.shape[1]) * self.resolution
+
+    @property
+    def final_margin(self):
+        return self.margin[:, -1].astype(np.int64) if len(self) else np.zeros(0, np.int64)
+
+
+def season_timelines(year, resolution=RESOLUTION, regular=True, playoffs=False):
+    '''Returns the TimelineBatch of the saved games of a year.'''
+
+    season_dir = os.path.join(NBAUtils.FILE_DIR, NBAUtils.season_dirname(year))
+    paths = [season_dir] if regular else []
+    if playoffs:
+        paths.extend(os.path.join(season_dir, 'Round' + str(r)) for r in range(1, 5))
+
+    timelines = []
+    for path in paths:
+        if os.path.isdir(path):
+            timelines.extend(load_timeline(path, gameid, resolution)
+                             for gameid in sorted(NBAUtils.game_ids(path)))
+    return TimelineBatch(timelines, resolution)
+
+
+##### LEAGUE-WIDE CURVES
+def average_margin(batch, absolute=True):
+    '''
+    Returns the average margin (absolute by default, else away - home) at
+    every sample, over the games still being played.
+    '''
+
+    margin = np.abs(batch.margin) if absolute else batch.margin
+    played = batch.active.sum(axis=0)
+    return (margin * batch.active).sum(axis=0) / np.maximum(played, 1).astype(np.float64)
+
+
+def comeback_rate(batch, deficit):
+    '''Returns the fraction of decided games whose winner trailed by deficit or more.'''
+
+    winner = np.sign(batch.final_margin)
+    decided = winner != 0
+    # Margin from the winner's side; its minimum is the largest deficit overcome
+    trailed = -(np.where(batch.active, batch.margin * winner[:, None], 0).min(axis=1))
+    return float((trailed[decided] >= deficit).mean()) if decided.any() else 0.0
+
+
+def win_probability(batch, time_step=60, max_margin=20):
+    '''
+    Returns (P, counts): P[i, j] is the fraction of game states i * time_step
+    seconds in with margin j - max_margin (away - home, clipped) whose away
+    team went on to win, and counts[i, j] how many states it is based on.
+    Regulation only, so every game contributes equally to each time bucket.
+    '''
+
+    regulation = NBADecode.NUM_PERIODS * NBADecode.PERIOD_LENGTH
+    samples = min(batch.margin.shape[1], regulation // batch.resolution)
+    buckets = (np.arange(samples) * batch.resolution) // time_step
+    decided = np.sign(batch.final_margin) != 0
+
+    margin = np.clip(batch.margin[decided, :samples], -max_margin, max_margin) + max_margin
+    away_won = (batch.final_margin[decided] > 0)[:, None] * np.ones(samples, dtype=bool)
+    time_index = np.broadcast_to(buckets, margin.shape)
+
+    shape = (int(buckets.max()) + 1 if samples else 0, 2 * max_margin + 1)
+    counts = np.zeros(shape, dtype=np.int64)
+    wins = np.zeros(shape, dtype=np.int64)
+    np.add.at(counts, (time_index.ravel(), margin.ravel()), 1)
+    np.add.at(wins, (time_index.ravel(), margin.ravel()), away_won.ravel())
+    return (wins / np.maximum(counts, 1).astype(np.float64), counts)
@@ -7,11 +7,25 @@ Utility functions for dealing with already saved data.
 # Team bucketing type thing? makes 30 folders of 82 files each i.e. each team
 # gets a folder with all its data
 
+import collections
 import json
+import multiprocessing
 import os
+import pickle
+import threading
+import Queue
+import NBAEvents
+import NBAStore
+from NBAColumns import EVENT_TYPE_INDEX, PERIOD_INDEX, PLAYER_ID_INDICES, ROW_HEADERS, \
+    SCORE_INDEX, TABBREV_INDICES
+from NBAMetrics import log
 
 FILE_DIR = './data/'
-TABBREV_INDICES = [18, 25, 32]
+END_OF_PERIOD = 13 # event type
+TEAM_INDEX_FNAME = '.team_index' # one per season folder
+PLAYER_INDEX_FNAME = '.player_index' # one per season folder
+REGULAR = '2' # season types, the third digit of a gameid
+PLAYOFFS = '4'
 
 TEAMS = set([
     'ATL',
@@ -47,59 +61,471 @@ TEAMS = set([
 ])
 
 
-##### GENERATORS
-def data_generator(path):
-    '''Creates a generator for the data contained at path.'''
+##### LOADING
+def season_dirname(year):
+    '''
+    Returns the folder name of a season under FILE_DIR: its year without
+    padding, e.g. '15' for 2015-16 and '5' for 2005-06 (gameid '0020500001').
+    year may be an int or the two digits of a gameid.
+    '''
+
+    return str(int(year))
 
-    assert os.path.isdir(path)
 
+def json_game_ids(path):
+    '''Returns the gameids saved as JSON files at path.'''
+
+    gameids = []
     for fname in os.listdir(path):
         if fname[0] == '.': # skip hidden files
             continue
-        full_path = os.path.join(path, fname)
-        if os.path.isdir(full_path): # skip directories (not recursive)
+        if os.path.isdir(os.path.join(path, fname)): # skip directories (not recursive)
             continue
-        with open(full_path, 'r') as infile:
+        gameids.append(fname)
+    return gameids
+
+
+def game_ids(path):
+    '''Returns the gameids saved at path, either as JSON files or in its store.'''
+
+    gameids = json_game_ids(path)
+    store = NBAStore.open_store(path)
+    if store:
+        saved = set(gameids)
+        gameids.extend(g for g in store.gameids if g not in saved)
+    return gameids
+
+
+def corrupt_game_ids(path):
+    '''Returns the gameids at path whose JSON file is damaged.'''
+
+    corrupt = []
+    for gameid in json_game_ids(path):
+        try:
+            read_game_file(os.path.join(path, gameid))
+        except CorruptGameError:
+            corrupt.append(gameid)
+    return corrupt
+
+
+def has_game(path, gameid):
+    '''Checks whether gameid is saved at path.'''
+
+    if os.path.isfile(os.path.join(path, gameid)):
+        return True
+    store = NBAStore.open_store(path)
+    return bool(store) and gameid in store
+
+
+class GameCache(object):
+    '''
+    In-process LRU cache of loaded games, keyed by (folder, gameid). Entries
+    remember a stamp of where they were loaded from (the JSON file's mtime
+    and size, or the store object) and are dropped when it changes. Both the
+    number of games and their approximate size in bytes of JSON are bounded.
+    Cached rows are shared, so callers must not modify them.
+    '''
+
+    ROW_BYTES = 700 # approximate JSON size of a row, for games from a store
+
+    def __init__(self, max_games=2048, max_bytes=512 * 1024 * 1024):
+        self.max_games = max_games
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict() # key -> (stamp, nbytes, data)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, stamp):
+        '''Returns the cached data for key if it was loaded with the same stamp.'''
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] == stamp:
+                self.entries[key] = entry # most recently used goes last
+                self.hits += 1
+                return entry[2]
+            if entry is not None: # stale
+                self.nbytes -= entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, stamp, data, nbytes):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            if nbytes > self.max_bytes or not self.max_games:
+                return
+            self.entries[key] = (stamp, nbytes, data)
+            self.nbytes += nbytes
+            while len(self.entries) > self.max_games or self.nbytes > self.max_bytes:
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        '''Returns a dict of hits, misses, evictions, games and bytes.'''
+
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'games': len(self.entries), 'bytes': self.nbytes}
+
+
+GAME_CACHE = GameCache()
+
+
+class CorruptGameError(ValueError):
+    '''A saved game file that isn't a complete JSON list of rows, e.g. from a crash mid-write.'''
+
+    def __init__(self, fpath, reason):
+        ValueError.__init__(self, 'Corrupt game file {}: {}'.format(fpath, reason))
+        self.fpath = fpath
+        self.reason = reason
+
+    def __reduce__(self): # so it survives the trip back from a worker process
+        return (CorruptGameError, (self.fpath, str(self.reason)))
+
+
+def read_game_file(fpath):
+    '''Reads and checks a saved game file. Raises CorruptGameError if it is damaged.'''
+
+    with open(fpath, 'r') as infile:
+        try:
             data = json.load(infile)
-            yield data
+        except ValueError as e:
+            raise CorruptGameError(fpath, e)
+    if not isinstance(data, list) or not all(isinstance(row, list) for row in data):
+        raise CorruptGameError(fpath, 'not a list of rows')
+    return data
+
+
+def load_game(path, gameid):
+    '''
+    Returns the rows of a game saved at path, preferring its JSON file.
+    Games are served from GAME_CACHE while their source is unchanged.
+    Raises CorruptGameError if the JSON file is damaged.
+    '''
+
+    fpath = os.path.join(path, gameid)
+    key = (os.path.abspath(path), gameid)
+    try:
+        st = os.stat(fpath)
+    except OSError:
+        st = None
+
+    if st is not None:
+        stamp = (st.st_mtime, st.st_size)
+        data = GAME_CACHE.get(key, stamp)
+        if data is None:
+            data = read_game_file(fpath)
+            GAME_CACHE.put(key, stamp, data, st.st_size)
+        return data
+
+    store = NBAStore.open_store(path)
+    if store and gameid in store:
+        data = GAME_CACHE.get(key, store)
+        if data is None:
+            data = store.rows(gameid)
+            GAME_CACHE.put(key, store, data, len(data) * GameCache.ROW_BYTES)
+        return data
+    raise IOError('No saved game {} at {}'.format(gameid, path))
+
+
+class GameColumns(object):
+    '''
+    Some columns of all rows of a game. Behaves like the list of rows as
+    far as those columns go: data[r][i] is column i of row r, and asking for
+    a column that wasn't loaded raises KeyError.
+    '''
+
+    __slots__ = ('gameid', 'columns', 'length')
+
+    def __init__(self, gameid, columns, length):
+        self.gameid = gameid
+        self.columns = columns # column index -> list of values
+        self.length = length
+
+    @classmethod
+    def from_rows(cls, gameid, data, columns):
+        return cls(gameid, dict((i, [row[i] for row in data]) for i in columns), len(data))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, r):
+        if r < 0:
+            r += self.length
+        if not 0 <= r < self.length:
+            raise IndexError(r)
+        return RowView(self, r)
+
+    def __iter__(self):
+        for r in xrange(self.length):
+            yield RowView(self, r)
+
+
+class RowView(object):
+    '''Row r of a GameColumns.'''
+
+    __slots__ = ('game', 'r')
+
+    def __init__(self, game, r):
+        self.game = game
+        self.r = r
+
+    def __getitem__(self, i):
+        return self.game.columns[i][self.r]
+
+
+def load_columns(path, gameid, columns):
+    '''
+    Returns a GameColumns of a game saved at path. Compacted games only
+    decode the requested columns; JSON files still have to be parsed whole.
+    '''
+
+    if not os.path.isfile(os.path.join(path, gameid)):
+        store = NBAStore.open_store(path)
+        if store and gameid in store:
+            start, stop = store.game_slice(gameid)
+            return GameColumns(gameid, dict(
+                (i, store.decode(i, start, stop) if i < store.num_columns else
+                 [None] * (stop - start)) for i in columns), stop - start)
+    return GameColumns.from_rows(gameid, load_game(path, gameid), columns)
+
+
+def load_first_row(path, gameid, read_size=4096):
+    '''
+    Returns the first row of a game saved at path, or None if it has none.
+    JSON files are only read and parsed up to the end of that row.
+    '''
+
+    fpath = os.path.join(path, gameid)
+    if not os.path.isfile(fpath):
+        store = NBAStore.open_store(path)
+        if store and gameid in store:
+            start, stop = store.game_slice(gameid)
+            return store.rows_between(start, min(start + 1, stop))[0] if stop > start else None
+        raise IOError('No saved game {} at {}'.format(gameid, path))
+
+    decoder = json.JSONDecoder()
+    with open(fpath, 'r') as infile:
+        text = ''
+        while True:
+            chunk = infile.read(read_size)
+            text += chunk
+            head = text.lstrip()
+            if head[:1] not in ('', '['):
+                raise CorruptGameError(fpath, 'not a list of rows')
+            body = head[1:].lstrip()
+            if body[:1] == ']':
+                return None
+            try:
+                return decoder.raw_decode(body)[0]
+            except ValueError:
+                if not chunk: # whole file read
+                    raise CorruptGameError(fpath, 'truncated first row')
+                read_size *= 2 # row doesn't end in what has been read yet
+
+
+##### GENERATORS
+# The season generators take an optional per-game map function and a number
+# of processes. With processes set, loading and mapping each game happens in
+# a process pool and only func's result is sent back to the parent. func must
+# be a module-level function so it can be pickled.
+#
+# With columns set, games are loaded as GameColumns holding only those
+# columns. With chunk_size set, results come in lists of up to chunk_size
+# games, and in a pool each chunk is one job.
+def load_and_map(job):
+    '''Loads one game and applies func to it. Runs in the worker processes.'''
+
+    path, gameid, func, columns = job
+    if columns is None:
+        data = load_game(path, gameid)
+    else:
+        data = load_columns(path, gameid, columns)
+    return func(data) if func else data
+
+
+def load_and_map_chunk(job):
+    '''Loads and maps a chunk of games. Runs in the worker processes.'''
+
+    refs, func, columns = job
+    return [load_and_map((path, gameid, func, columns)) for path, gameid in refs]
+
+
+def run_guarded(job):
+    '''
+    Runs worker(job) for a (worker, job) pair and returns (True, result), or
+    (False, exception) if it raised, so the parent can re-raise it.
+    Runs in the worker processes.
+    '''
+
+    worker, job = job
+    try:
+        return (True, worker(job))
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError('{}: {}'.format(type(e).__name__, e))
+        return (False, e)
+
+
+def unguarded(outcome):
+    '''Returns the result of a run_guarded outcome, raising its exception if it failed.'''
+
+    ok, value = outcome
+    if not ok:
+        raise value
+    return value
+
+
+def map_games(refs, func=None, processes=None, ordered=True, max_pending=None,
+              columns=None, chunk_size=None):
+    '''
+    Generator for func(data) of every (path, gameid) in refs. Without
+    processes the games are loaded one by one in this process. Otherwise at
+    most max_pending (default 4 per process) jobs are in flight at once, and
+    results come back in order or, with ordered=False, as they complete.
+    See above for columns and chunk_size.
+    '''
+
+    if chunk_size:
+        refs = list(refs)
+        jobs = ((refs[i:i + chunk_size], func, columns)
+                for i in range(0, len(refs), chunk_size))
+        worker = load_and_map_chunk
+    else:
+        jobs = ((path, gameid, func, columns) for path, gameid in refs)
+        worker = load_and_map
+
+    if not processes:
+        for job in jobs:
+            yield worker(job)
+        return
+
+    max_pending = max_pending or 4 * processes
+    pool = multiprocessing.Pool(processes)
+    pending = collections.deque() # ordered: AsyncResults not yet yielded
+    done = Queue.Queue()          # unordered: outcomes of finished jobs
+    num_pending = [0]             # unordered: jobs not yet yielded
+    try:
+        if ordered:
+            for job in jobs:
+                pending.append(pool.apply_async(worker, (job,)))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        else:
+            # apply_async has no error callback in Python 2, so failures come
+            # back as outcomes; otherwise a failed job would never call back
+            for job in jobs:
+                pool.apply_async(run_guarded, ((worker, job),), callback=done.put)
+                num_pending[0] += 1
+                if num_pending[0] >= max_pending:
+                    num_pending[0] -= 1
+                    yield unguarded(done.get())
+            while num_pending[0]:
+                num_pending[0] -= 1
+                yield unguarded(done.get())
+        pool.close()
+    finally:
+        # Jobs still in flight (after an error, or if the caller stopped
+        # early) are waited for first: terminate() can hang in Python 2
+        # while a worker is blocked sending back a large result.
+        for result in pending:
+            result.wait()
+        for _ in range(num_pending[0]):
+            done.get()
+        pool.terminate()
+        pool.join()
+
+
+def data_generator(path, func=None, processes=None, ordered=True, columns=None,
+                   chunk_size=None):
+    '''Creates a generator for the data contained at path.'''
+
+    assert os.path.isdir(path)
+
+    refs = [(path, gameid) for gameid in game_ids(path)]
+    return map_games(refs, func=func, processes=processes, ordered=ordered,
+                     columns=columns, chunk_size=chunk_size)
 
 
-def regular_data_generator(year):
+def regular_data_generator(year, func=None, processes=None, ordered=True, columns=None,
+                           chunk_size=None):
     '''Generator for regular season data.'''
 
-    path = os.path.join(FILE_DIR, str(year))
+    path = os.path.join(FILE_DIR, season_dirname(year))
 
-    return data_generator(path)
+    return data_generator(path, func=func, processes=processes, ordered=ordered,
+                          columns=columns, chunk_size=chunk_size)
 
 
-def team_data_generator(year, teamname):
-    '''Generator for a team's data (for a single year).'''
+def team_data_generator(year, teamname, func=None, processes=None, ordered=True,
+                        columns=None, chunk_size=None, season_type=REGULAR):
+    '''
+    Generator for a team's data (for a single year), read through the team
+    index. Regular season games only unless season_type says otherwise.
+    '''
 
     assert teamname in TEAMS
-    path = os.path.join(FILE_DIR, str(year), teamname)
-    return data_generator(path)
+    season_dir = os.path.join(FILE_DIR, season_dirname(year))
+    refs = [(os.path.join(season_dir, relpath), gameid)
+            for relpath, gameid in team_games(year, teamname, season_type)]
+    return map_games(refs, func=func, processes=processes, ordered=ordered,
+                     columns=columns, chunk_size=chunk_size)
 
 
-def playoff_data_generator(year):
-    '''Generator for the entire playoffs.'''
+def playoff_data_generator(year, func=None, processes=None, ordered=True, columns=None,
+                           chunk_size=None):
+    '''Generator for the entire playoffs. Rounds that weren't played are skipped.'''
 
+    refs = []
     for r in range(1, 5):
-        g = playoff_round_data_generator(year, r)
-        for data in g:
-            yield data
+        path = os.path.join(FILE_DIR, season_dirname(year), 'Round' + str(r))
+        if os.path.isdir(path):
+            refs.extend((path, gameid) for gameid in game_ids(path))
+    return map_games(refs, func=func, processes=processes, ordered=ordered,
+                     columns=columns, chunk_size=chunk_size)
 
 
-def playoff_round_data_generator(year, p_round):
+def playoff_round_data_generator(year, p_round, func=None, processes=None, ordered=True,
+                                 columns=None, chunk_size=None):
     '''Generator for a specific round of the playoffs.'''
 
     assert p_round >= 1 and p_round <= 4
-    path = os.path.join(FILE_DIR, str(year), 'Round' + str(p_round))
-    return data_generator(path)
+    path = os.path.join(FILE_DIR, season_dirname(year), 'Round' + str(p_round))
+    return data_generator(path, func=func, processes=processes, ordered=ordered,
+                          columns=columns, chunk_size=chunk_size)
+
+
+def first_row_generator(path):
+    '''Generator of (gameid, first row) of every game saved at path. See load_first_row.'''
+
+    for gameid in game_ids(path):
+        yield (gameid, load_first_row(path, gameid))
 
 
 ##### HELPER FUNCTIONS
 def get_teams(data):
-    '''Given all rows of data (list of lists), return a list of the two teams involved.'''
+    '''
+    Given all rows of data (list of lists) or a PlayByPlay, return a list of
+    the two teams involved.
+    '''
+
+    if isinstance(data, NBAEvents.PlayByPlay):
+        return data.teams()
 
     t1 = TABBREV_INDICES[0]
     t2 = TABBREV_INDICES[1]
@@ -121,39 +547,346 @@ def get_teams(data):
 
 
 def get_gameid(data):
-    '''Given all rows of data (list of lists), return a list of the two teams involved.'''
+    '''
+    Given all rows of data (list of lists), a PlayByPlay or a GameColumns,
+    return the gameid.
+    '''
 
+    if isinstance(data, (NBAEvents.PlayByPlay, GameColumns)):
+        return data.gameid
     return str(data[0][0])
 
 
+def parse_score(score):
+    '''Parses a score string like '98 - 101' into a tuple of ints, or None.'''
+
+    if not score:
+        return None
+    return tuple(map(int, str(score).replace(' ', '').split('-')))
+
+
+def get_sides(data):
+    '''
+    Given all rows of data (list of lists), return [away team, home team],
+    i.e. the teams of the left and right side of the score strings. Which
+    side belongs to which team is worked out from the team of the player who
+    scored when that side changed. A side that can't be worked out is None.
+    '''
+
+    sides = [None, None]
+    last = (0, 0)
+    for row in data:
+        score = parse_score(row[SCORE_INDEX])
+        if not score:
+            continue
+        team = row[TABBREV_INDICES[0]]
+        for i in range(2):
+            if score[i] != last[i] and team and sides[i] is None:
+                sides[i] = team
+        last = score
+        if None not in sides:
+            break
+
+    teams = get_teams(data)
+    if len(teams) == 2: # a side nobody was seen scoring on is the other team
+        if sides[0] is None and sides[1] in teams:
+            sides[0] = [t for t in teams if t != sides[1]][0]
+        if sides[1] is None and sides[0] in teams:
+            sides[1] = [t for t in teams if t != sides[0]][0]
+    return sides
+
+
+def get_final_scores(data):
+    '''
+    Given all rows of data (list of lists), return a dict of team -> final
+    score. See get_sides for which score belongs to which team.
+    '''
+
+    last = (0, 0)
+    for row in reversed(data):
+        score = parse_score(row[SCORE_INDEX])
+        if score:
+            last = score
+            break
+
+    return dict((team, s) for team, s in zip(get_sides(data), last) if team)
+
+
+def get_winner(data):
+    '''Given all rows of data (list of lists), return the winning team, or None.'''
+
+    scores = get_final_scores(data)
+    if len(scores) != 2:
+        return None
+    (t1, s1), (t2, s2) = scores.items()
+    if s1 == s2:
+        return None
+    return t1 if s1 > s2 else t2
+
+
+def is_final(data):
+    '''
+    Given all rows of data (list of lists), checks whether the game is over:
+    the last event ends the 4th period or an overtime, and someone is ahead.
+    '''
+
+    if not data:
+        return False
+    last = data[-1]
+    return (last[EVENT_TYPE_INDEX] == END_OF_PERIOD and last[PERIOD_INDEX] >= 4
+            and get_winner(data) is not None)
+
+
 ##### ORGANIZING DATA
+def compact(path, remove_json=False):
+    '''
+    Moves every game saved at path into its columnar store, merging with
+    whatever the store already has. If remove_json is set, the JSON files of
+    the compacted games are deleted afterwards.
+    '''
+
+    if not os.path.isdir(path):
+        return
+    json_ids = json_game_ids(path)
+    if not json_ids:
+        return
+
+    games = dict((gameid, load_game(path, gameid)) for gameid in game_ids(path))
+    log('Compacting {} games at {}'.format(len(games), path))
+    NBAStore.write_store(path, games.items())
+
+    if remove_json:
+        for gameid in json_ids:
+            os.remove(os.path.join(path, gameid))
+
+
+def compact_season(year, remove_json=False):
+    '''Compacts the regular season and every playoff round of a year.'''
+
+    compact(os.path.join(FILE_DIR, season_dirname(year)), remove_json=remove_json)
+    for r in range(1, 5):
+        compact(os.path.join(FILE_DIR, season_dirname(year), 'Round' + str(r)),
+                remove_json=remove_json)
+
+
+##### TEAM INDEX
+# Each season folder has an append-only .team_index file with one line per
+# saved game: gameid, the two teams, season type and the subfolder (e.g.
+# 'Round1') the game lives in. Later lines win over earlier ones.
+team_index_lock = threading.Lock()
+team_index_cache = {} # path -> (size, index)
+
+
+def season_dir_of(prefix):
+    '''Returns (season folder, subfolder) of a folder games are saved to.'''
+
+    prefix = os.path.normpath(prefix)
+    if os.path.basename(prefix).startswith('Round'):
+        return (os.path.dirname(prefix), os.path.basename(prefix))
+    return (prefix, '')
+
+
+def index_game(prefix, data):
+    '''Adds a game saved at prefix to the team index of its season.'''
+
+    add_team_index_entry(prefix, get_gameid(data), get_teams(data))
+
+
+def add_team_index_entry(prefix, gameid, teams):
+    '''Adds a game saved at prefix to the team index given its teams.'''
+
+    season_dir, relpath = season_dir_of(prefix)
+    line = '{}\t{}\t{}\t{}\n'.format(gameid, ','.join(sorted(teams)), gameid[2], relpath)
+    with team_index_lock:
+        with open(os.path.join(season_dir, TEAM_INDEX_FNAME), 'a') as outfile:
+            outfile.write(line) # one short append, so a crash can only tear the last line
+
+
+def load_team_index(year):
+    '''Returns the team index of a season as a dict of gameid -> (teams, season_type, relpath).'''
+
+    path = os.path.join(FILE_DIR, season_dirname(year), TEAM_INDEX_FNAME)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return {}
+
+    with team_index_lock:
+        cached = team_index_cache.get(path)
+        if cached and cached[0] == size:
+            return cached[1]
+
+        index = {}
+        with open(path, 'r') as infile:
+            for line in infile:
+                fields = line.rstrip('\n').split('\t')
+                if not line.endswith('\n') or len(fields) != 4:
+                    continue # torn by a crash mid-append; bucket_by_team re-adds it
+                gameid, teams, season_type, relpath = fields
+                index[gameid] = (teams.split(','), season_type, relpath)
+        team_index_cache[path] = (size, index)
+        return index
+
+
+def team_games(year, teamname, season_type=REGULAR):
+    '''
+    Returns the sorted (relpath, gameid) pairs of a team's games in a
+    season of season_type (REGULAR or PLAYOFFS; None for both).
+    '''
+
+    index = load_team_index(year)
+    return sorted((relpath, gameid) for gameid, (teams, kind, relpath) in index.iteritems()
+                  if teamname in teams and season_type in (None, kind))
+
+
 def bucket_by_team(year):
-    '''Buckets games by team. The result is 30 folders with 82 files in each.'''
-
-    g = regular_data_generator(year)
-    for data in g:
-        teams = get_teams(data)
-        gameid = get_gameid(data)
-
-        prefix1 = os.path.join(FILE_DIR, str(year), teams[0])
-        prefix2 = os.path.join(FILE_DIR, str(year), teams[1])
-
-        if not os.path.exists(prefix1):   # make intermediate dirs, if necessar
-            os.makedirs(prefix1)
-        if not os.path.exists(prefix2):
-            os.makedirs(prefix2)
-
-        fpath1 = os.path.join(prefix1, gameid)
-        fpath2 = os.path.join(prefix2, gameid)
-
-        if not os.path.isfile(fpath1):
-            with open(fpath1, 'w+') as outfile:
-                print 'Saving {} to folder for {}'.format(gameid, teams[0])
-                json.dump(data, outfile)
-        if not os.path.isfile(fpath2):
-            with open(fpath2, 'w+') as outfile:
-                print 'Saving {} to folder for {}'.format(gameid, teams[1])
-                json.dump(data, outfile)
+    '''
+    Adds every saved game of a season that isn't in the team index yet to
+    it. Games are not copied anywhere; team_data_generator reads through the
+    index instead.
+    '''
+
+    season_dir = os.path.join(FILE_DIR, season_dirname(year))
+    index = load_team_index(year)
+    prefixes = [season_dir] + [os.path.join(season_dir, 'Round' + str(r)) for r in range(1, 5)]
+    for prefix in prefixes:
+        if not os.path.isdir(prefix):
+            continue
+        for gameid in game_ids(prefix):
+            if gameid not in index:
+                log('Indexing {}'.format(gameid))
+                index_game(prefix, load_columns(prefix, gameid, TABBREV_INDICES))
+
+
+##### PLAYER INDEX
+# Each season folder also has an append-only .player_index file with one line
+# per saved game: gameid, subfolder, and the row numbers of the rows each
+# player appears in, as 'gameid<TAB>relpath<TAB>id:1,5,9;id:2,3'. Later lines
+# for a game replace earlier ones.
+player_index_lock = threading.Lock()
+player_index_cache = {} # path -> (size, index)
+
+
+def player_rows(data):
+    '''Returns a dict of player id -> row numbers of the rows of data the player appears in.'''
+
+    rows = collections.defaultdict(list)
+    for r, row in enumerate(data):
+        for playerid in set(row[i] for i in PLAYER_ID_INDICES):
+            if playerid:
+                rows[playerid].append(r)
+    return rows
+
+
+def index_players(prefix, data):
+    '''Adds a game saved at prefix to the player index of its season.'''
+
+    add_player_index_entry(prefix, get_gameid(data), player_rows(data))
+
+
+def add_player_index_entry(prefix, gameid, rows_by_player):
+    '''Adds a game saved at prefix to the player index given its player_rows.'''
+
+    season_dir, relpath = season_dir_of(prefix)
+    entries = ';'.join('{}:{}'.format(playerid, ','.join(map(str, rows)))
+                       for playerid, rows in sorted(rows_by_player.items()))
+    line = '{}\t{}\t{}\n'.format(gameid, relpath, entries)
+    with player_index_lock:
+        with open(os.path.join(season_dir, PLAYER_INDEX_FNAME), 'a') as outfile:
+            outfile.write(line)
+
+
+def load_player_index(year):
+    '''
+    Returns the player index of a season as a dict of
+    player id -> {gameid: (relpath, row numbers)}.
+    '''
+
+    return read_player_index(year)[0]
+
+
+def read_player_index(year):
+    '''Returns (player index, set of indexed gameids) of a season. See load_player_index.'''
+
+    path = os.path.join(FILE_DIR, season_dirname(year), PLAYER_INDEX_FNAME)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return ({}, set())
+
+    with player_index_lock:
+        cached = player_index_cache.get(path)
+        if cached and cached[0] == size:
+            return cached[1:]
+
+        index = collections.defaultdict(dict)
+        players_of = {} # gameid -> player ids, to drop them when the game is indexed again
+        with open(path, 'r') as infile:
+            for line in infile:
+                fields = line.rstrip('\n').split('\t')
+                if not line.endswith('\n') or len(fields) != 3:
+                    continue # torn by a crash mid-append; index_season_players re-adds it
+                gameid, relpath, entries = fields
+                for playerid in players_of.pop(gameid, ()):
+                    del index[playerid][gameid]
+                players = []
+                for entry in entries.split(';') if entries else ():
+                    playerid, rows = entry.split(':')
+                    playerid = int(playerid)
+                    index[playerid][gameid] = (relpath, map(int, rows.split(',')))
+                    players.append(playerid)
+                players_of[gameid] = players
+        index = dict((playerid, games) for playerid, games in index.iteritems() if games)
+        games = set(players_of)
+        player_index_cache[path] = (size, index, games)
+        return (index, games)
+
+
+def player_games(year, playerid):
+    '''Returns the sorted (relpath, gameid, row numbers) of a player's games in a season.'''
+
+    games = load_player_index(year).get(playerid, {})
+    return sorted((relpath, gameid, rows) for gameid, (relpath, rows) in games.iteritems())
+
+
+def player_events(playerid, years, columns=None):
+    '''
+    Generator of the rows a player appears in over several seasons, found
+    through the player index. Only the player's games are read, and of
+    compacted games only the player's rows (and only columns, if given).
+    '''
+
+    for year in years:
+        season_dir = os.path.join(FILE_DIR, season_dirname(year))
+        for relpath, gameid, rows in player_games(year, playerid):
+            path = os.path.join(season_dir, relpath)
+            store = NBAStore.open_store(path)
+            if not os.path.isfile(os.path.join(path, gameid)) and store and gameid in store:
+                start, _ = store.game_slice(gameid)
+                rows = [start + r for r in rows]
+                values = [store.decode_at(i, rows) for i in
+                          (columns if columns is not None else range(store.num_columns))]
+                for row in zip(*values):
+                    yield list(row)
+            else:
+                data = load_game(path, gameid)
+                for r in rows:
+                    yield [data[r][i] for i in columns] if columns is not None else data[r]
+
+
+def index_season_players(year):
+    '''Adds every saved game of a season that isn't in the player index yet to it.'''
+
+    season_dir = os.path.join(FILE_DIR, season_dirname(year))
+    _, indexed = read_player_index(year)
+    prefixes = [season_dir] + [os.path.join(season_dir, 'Round' + str(r)) for r in range(1, 5)]
+    for prefix in prefixes:
+        if not os.path.isdir(prefix):
+            continue
+        for gameid in game_ids(prefix):
+            if gameid not in indexed:
+                log('Indexing players of {}'.format(gameid))
+                index_players(prefix, load_columns(prefix, gameid, PLAYER_ID_INDICES))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,76 @@
+'''
+Shared fixture of the offline tests: a local NBAMockServer for every test,
+with the scraper pointed at it and at a fresh FILE_DIR.
+'''
+
+import shutil
+import tempfile
+import unittest
+import NBAAggregates
+import NBAHttp
+import NBAManifest
+import NBAMetrics
+import NBAMockServer
+import NBAResponseCache
+import NBAScrapeGames
+import NBAUtils
+
+
+class MockServerTestCase(unittest.TestCase):
+    '''
+    Runs each test against its own NBAMockServer, serving the recordings in
+    self.recordings and made-up games otherwise, with FILE_DIR set to a temp
+    folder and no rate limit. Subclasses can change the season length
+    (GAMES), the number of playoff rounds played (PLAYOFF_ROUNDS) and the
+    failures the server injects (SERVER_OPTIONS). Every module global
+    touched is restored and every open manifest, aggregates table and
+    response cache is dropped afterwards.
+    '''
+
+    GAMES = 6
+    PLAYOFF_ROUNDS = NBAMockServer.PLAYOFF_ROUNDS
+    SERVER_OPTIONS = {} # passed on to NBAMockServer.MockStatsServer
+
+    def setUp(self):
+        self.file_dir = tempfile.mkdtemp(prefix='nba-test-')
+        self.recordings = tempfile.mkdtemp(prefix='nba-recordings-')
+        self.saved = (NBAUtils.FILE_DIR, NBAScrapeGames.BASE_URL,
+                      NBAScrapeGames.MAX_REGULAR_GAMES, NBAScrapeGames.CACHE_RESPONSES,
+                      NBAMockServer.REGULAR_GAMES, NBAMockServer.PLAYOFF_ROUNDS,
+                      NBAMetrics.QUIET)
+        NBAScrapeGames.FILE_DIR = NBAUtils.FILE_DIR = self.file_dir
+        NBAScrapeGames.MAX_REGULAR_GAMES = NBAMockServer.REGULAR_GAMES = self.GAMES
+        NBAMockServer.PLAYOFF_ROUNDS = self.PLAYOFF_ROUNDS
+        NBAMetrics.QUIET = True
+        self.http = (NBAHttp.READ_TIMEOUT, NBAHttp.MAX_RETRIES, NBAHttp.BACKOFF_BASE)
+        self.server = NBAMockServer.MockStatsServer(recordings=self.recordings,
+                                                    **self.SERVER_OPTIONS).start()
+        NBAScrapeGames.BASE_URL = self.server.base_url
+        NBAHttp.configure(rate=0)
+
+    def tearDown(self):
+        read_timeout, max_retries, backoff_base = self.http
+        # A new session also hangs up the kept-alive connections to the server
+        NBAHttp.configure(pool_size=NBAHttp.POOL_SIZE, rate=NBAHttp.REQUESTS_PER_SECOND,
+                          read_timeout=read_timeout, max_retries=max_retries,
+                          backoff_base=backoff_base)
+        self.server.stop()
+        for manifest in NBAManifest._manifests.values():
+            manifest.close()
+        NBAManifest._manifests.clear()
+        for aggregates in NBAAggregates._aggregates.values():
+            aggregates.close()
+        NBAAggregates._aggregates.clear()
+        NBAResponseCache._caches.clear()
+        (NBAUtils.FILE_DIR, NBAScrapeGames.BASE_URL,
+         NBAScrapeGames.MAX_REGULAR_GAMES, NBAScrapeGames.CACHE_RESPONSES,
+         NBAMockServer.REGULAR_GAMES, NBAMockServer.PLAYOFF_ROUNDS,
+         NBAMetrics.QUIET) = self.saved
+        NBAScrapeGames.FILE_DIR = NBAUtils.FILE_DIR
+        shutil.rmtree(self.file_dir)
+        shutil.rmtree(self.recordings)
+
+    def requests(self):
+        '''Returns the number of requests the mock server has answered so far.'''
+
+        return self.server.counts.get('requests', 0)
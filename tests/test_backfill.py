@@ -0,0 +1,143 @@
+'''
+Offline checks of the sharded backfill in NBABackfill, with the shards run
+in this process against a local NBAMockServer.
+
+    python -m unittest discover tests
+'''
+
+import os
+import unittest
+import NBAAggregates
+import NBABackfill
+import NBAManifest
+import NBAMockServer
+import NBAScrapeGames
+import NBAUtils
+from fixtures import MockServerTestCase
+
+
+YEAR = 15
+SHARDS = 3
+
+
+class ShardOfTest(unittest.TestCase):
+    def test_deterministic_partition(self):
+        keys = [NBAScrapeGames.create_regular_gameid(YEAR, n) for n in range(1, 1231)]
+        shards = [NBABackfill.shard_of(k, 4) for k in keys]
+        self.assertEqual(shards, [NBABackfill.shard_of(k, 4) for k in keys])
+        self.assertEqual(set(shards), set(range(4)))
+        self.assertTrue(all(shards.count(s) > 200 for s in range(4))) # roughly even
+
+    def test_series_stay_together(self):
+        owners = [NBABackfill.playoff_shard_series(YEAR, shard, SHARDS)
+                  for shard in range(SHARDS)]
+        everything = sorted(sum(owners, []))
+        self.assertEqual(len(everything), sum(NBAScrapeGames.NUM_SERIES))
+        self.assertEqual(len(set(everything)), len(everything))
+
+
+class BackfillTest(MockServerTestCase):
+    GAMES = 20
+    PLAYOFF_ROUNDS = 1
+
+    def run_shards(self):
+        return [NBABackfill.run_shard([YEAR], shard, SHARDS, workers=2)
+                for shard in range(SHARDS)]
+
+    def test_shards_merge_into_file_dir(self):
+        self.assertEqual(self.run_shards(), [True] * SHARDS)
+        shard_games = [counts.get(NBAManifest.FETCHED, 0)
+                       for _, _, counts in NBABackfill.shard_status()]
+        self.assertEqual(len(shard_games), SHARDS)
+
+        copied = NBABackfill.merge_shards()
+        self.assertEqual(copied, sum(shard_games))
+
+        manifest = NBAScrapeGames.get_manifest()
+        fetched = manifest.gameids(YEAR, NBAManifest.FETCHED)
+        regular = [g for g in fetched if g[2] == NBAUtils.REGULAR]
+        playoffs = [g for g in fetched if g[2] == NBAUtils.PLAYOFFS]
+        self.assertEqual(len(regular), self.GAMES)
+        self.assertEqual(len(fetched), copied)
+        for gameid in fetched:
+            prefix = os.path.join(self.file_dir, NBABackfill.game_relpath(gameid))
+            self.assertTrue(os.path.isfile(os.path.join(prefix, gameid)))
+        self.assertEqual(sorted(NBAUtils.load_team_index(YEAR)), fetched)
+        self.assertEqual(sorted(NBAUtils.read_player_index(YEAR)[1]), fetched)
+        summaries = NBAAggregates.get_aggregates(self.file_dir).games(YEAR)
+        self.assertEqual(len(summaries), len(fetched))
+        self.assertTrue(playoffs)
+
+        # Merging again copies nothing
+        self.assertEqual(NBABackfill.merge_shards(), 0)
+
+    def test_2000s_season(self):
+        year = 5 # 2005-06
+        self.assertEqual(NBAScrapeGames.create_regular_gameid(year, 1), '0020500001')
+        self.assertEqual(NBAScrapeGames.create_playoff_gameid(year, 1, 0, 1), '0040500101')
+        for shard in range(SHARDS):
+            self.assertTrue(NBABackfill.run_shard([year], shard, SHARDS, workers=2))
+        copied = NBABackfill.merge_shards()
+
+        fetched = NBAScrapeGames.get_manifest().gameids(year, NBAManifest.FETCHED)
+        self.assertEqual(len(fetched), copied)
+        self.assertEqual(len([g for g in fetched if g[2] == NBAUtils.REGULAR]), self.GAMES)
+        self.assertTrue(all(g.startswith('00') and g[3:5] == '05' for g in fetched))
+        for gameid in fetched:
+            self.assertEqual(NBABackfill.game_relpath(gameid).split(os.sep)[0], '5')
+            self.assertTrue(NBAUtils.has_game(
+                os.path.join(self.file_dir, NBABackfill.game_relpath(gameid)), gameid))
+        self.assertEqual(len(list(NBAUtils.regular_data_generator(year))), self.GAMES)
+        self.assertEqual(sorted(NBAUtils.load_team_index(year)), fetched)
+
+    def test_series_cut_short_by_a_failure_are_finished(self):
+        # Game 2 of every series fails once, which stops the series there
+        self.server.bad_responses = dict(
+            (NBAScrapeGames.create_playoff_gameid(YEAR, 1, s, 2), 1) for s in range(8))
+        played = [g for g in (NBAScrapeGames.create_playoff_gameid(YEAR, 1, s, n)
+                              for s in range(8) for n in range(1, 8))
+                  if NBAMockServer.synthetic_rows(g)]
+        for shard in range(SHARDS):
+            self.assertTrue(NBABackfill.run_shard([YEAR], shard, SHARDS, regular=False))
+        self.assertEqual(self.server.counts.get('bad_responses'), 8)
+
+        NBABackfill.merge_shards()
+        fetched = NBAScrapeGames.get_manifest().gameids(YEAR, NBAManifest.FETCHED)
+        self.assertEqual(fetched, sorted(played))
+
+    def test_finished_shards_are_skipped(self):
+        self.run_shards()
+        before = self.requests()
+        self.assertEqual(self.run_shards(), [True] * SHARDS)
+        self.assertEqual(self.requests(), before)
+
+    def test_unfinished_shard_resumes(self):
+        self.run_shards()
+        shard_dir = os.path.join(NBABackfill.default_shard_root(),
+                                 NBABackfill.shard_name(1, SHARDS))
+        os.remove(os.path.join(shard_dir, NBABackfill.DONE_FNAME))
+        empty = NBAManifest.get_manifest(shard_dir).gameids(YEAR, NBAManifest.EMPTY)
+        before = self.requests()
+        self.assertTrue(NBABackfill.run_shard([YEAR], 1, SHARDS))
+        self.assertTrue(NBABackfill.is_done(shard_dir, NBABackfill.shard_parts([YEAR])))
+        # Saved games come from its manifest; only missing playoff games are probed again
+        self.assertLessEqual(self.requests() - before, len(empty))
+
+    def test_local_shards_run_as_processes(self):
+        unfinished = NBABackfill.run_local([YEAR], SHARDS, regular=False, workers=2, rate=0,
+                                           base_url=self.server.base_url)
+        self.assertEqual(unfinished, [])
+        parts = NBABackfill.shard_parts([YEAR], regular=False)
+        status = NBABackfill.shard_status()
+        self.assertEqual(len(status), SHARDS)
+        self.assertTrue(all(NBABackfill.is_done(shard_dir, parts) for shard_dir, _, _ in status))
+
+        copied = NBABackfill.merge_shards()
+        fetched = NBAScrapeGames.get_manifest().gameids(YEAR, NBAManifest.FETCHED)
+        self.assertEqual(copied, len(fetched))
+        self.assertEqual(set(g[-3] for g in fetched), set('1')) # only round 1 was played
+        self.assertEqual(set(g[-2] for g in fetched), set(str(s) for s in range(8)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+'''
+Offline checks of the crash-safe writes in NBAFiles.
+
+    python -m unittest discover tests
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import NBAFiles
+
+
+class AtomicWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='nba-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_replaces_and_cleans_up(self):
+        path = os.path.join(self.folder, 'game')
+        NBAFiles.atomic_write(path, 'old')
+        NBAFiles.atomic_write(path, 'new')
+        with open(path, 'rb') as infile:
+            self.assertEqual(infile.read(), 'new')
+        self.assertEqual(os.listdir(self.folder), ['game'])
+
+    def test_failed_rename_leaves_no_temp_file(self):
+        path = os.path.join(self.folder, 'taken')
+        os.makedirs(os.path.join(path, 'child')) # a non-empty folder can't be renamed over
+        with self.assertRaises(OSError):
+            NBAFiles.atomic_write(path, 'data')
+        self.assertEqual(os.listdir(self.folder), ['taken'])
+
+
+class GroupCommitTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='nba-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_all(self, group, names, threads):
+        errors = []
+
+        def writer(chunk):
+            try:
+                for name in chunk:
+                    group.write(os.path.join(self.folder, name), 'data of ' + name)
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=writer, args=(names[i::threads],))
+                   for i in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        return errors
+
+    def test_concurrent_writes_are_batched(self):
+        group = NBAFiles.GroupCommit(max_batch=8, max_delay=0.05)
+        names = ['game{:03d}'.format(i) for i in range(64)]
+        self.assertEqual(self.write_all(group, names, threads=16), [])
+
+        self.assertEqual(sorted(os.listdir(self.folder)), names) # no temp files left behind
+        for name in names:
+            with open(os.path.join(self.folder, name), 'rb') as infile:
+                self.assertEqual(infile.read(), 'data of ' + name)
+        self.assertEqual(group.files, len(names))
+        self.assertLess(group.commits, len(names))
+
+    def test_batch_size_is_capped(self):
+        group = NBAFiles.GroupCommit(max_batch=4, max_delay=0.5)
+        names = ['game{:03d}'.format(i) for i in range(16)]
+        self.assertEqual(self.write_all(group, names, threads=16), [])
+        self.assertEqual(group.files, 16)
+        self.assertGreaterEqual(group.commits, 4)
+
+    def test_errors_reach_every_writer_of_the_batch(self):
+        group = NBAFiles.GroupCommit(max_batch=4, max_delay=0.2)
+        os.makedirs(os.path.join(self.folder, 'taken', 'child'))
+        errors = self.write_all(group, ['a', 'taken', 'b', 'c'], threads=4) # one batch
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(all(isinstance(e, OSError) for e in errors))
+        leftover = [f for f in os.listdir(self.folder) if f.startswith('.')]
+        self.assertEqual(leftover, []) # temp files of the failed batch are removed
+
+    def test_any_error_reaches_every_writer(self):
+        group = NBAFiles.GroupCommit(max_batch=4, max_delay=0.2)
+
+        def commit(entries):
+            raise RuntimeError('commit failed')
+
+        group.commit = commit
+        errors = self.write_all(group, ['a', 'b', 'c', 'd'], threads=4)
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(all(isinstance(e, RuntimeError) for e in errors))
+
+
+if __name__ == '__main__':
+    unittest.main()
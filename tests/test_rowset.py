@@ -0,0 +1,144 @@
+'''
+Offline checks of the streaming rowSet extraction in NBAScrapeGames, on
+made-up documents and against a local NBAMockServer.
+
+    python -m unittest discover tests
+'''
+
+import json
+import os
+import random
+import unittest
+import NBAHttp
+import NBAManifest
+import NBAMockServer
+import NBAScrapeGames
+from NBAScrapeGames import RowSetExtractor
+from fixtures import MockServerTestCase
+
+
+TRICKY_ROWS = [
+    [1, 'plain', None, 2.5],
+    [2, 'brackets [in] a ]string[', '"quoted"', 'back\\slash'],
+    [3, 'escaped quote \\" then ]', u'unicode \u00e9', ''],
+    [4, '\\', '\\\\', '"rowSet": [1, 2]'],
+    [],
+    [[5, [6]], {'nested': ['a', ']']}],
+]
+
+
+def extract(text, chunk_sizes):
+    '''Feeds text to a RowSetExtractor in chunks of the given sizes (cycled).'''
+
+    extractor = RowSetExtractor()
+    pos = 0
+    i = 0
+    while pos < len(text):
+        size = chunk_sizes[i % len(chunk_sizes)]
+        extractor.feed(text[pos:pos + size])
+        pos += size
+        i += 1
+    return extractor
+
+
+def game_url(n):
+    return NBAScrapeGames.create_url(NBAScrapeGames.create_regular_gameid(15, n),
+                                     NBAScrapeGames.START_PERIOD, NBAScrapeGames.END_PERIOD)
+
+
+class RowSetExtractorTest(unittest.TestCase):
+    def document(self, rows):
+        return json.dumps({
+            'resource': 'playbyplay',
+            'parameters': {'GameID': '0021500001', 'note': 'no "rowSet" here ]'},
+            'resultSets': [
+                {'name': 'PlayByPlay', 'headers': ['A', 'B'], 'rowSet': rows},
+                {'name': 'AvailableVideo', 'rowSet': [[1]]},
+            ],
+        })
+
+    def test_whole_document(self):
+        extractor = extract(self.document(TRICKY_ROWS), [10 ** 6])
+        self.assertTrue(extractor.done)
+        self.assertEqual(json.loads(extractor.text), TRICKY_ROWS)
+
+    def test_random_chunk_splits(self):
+        rand = random.Random(0)
+        text = self.document(TRICKY_ROWS)
+        for _ in range(300):
+            sizes = [rand.randint(1, 12) for _ in range(rand.randint(1, 5))]
+            extractor = extract(text, sizes)
+            self.assertTrue(extractor.done, sizes)
+            self.assertEqual(json.loads(extractor.text), TRICKY_ROWS, sizes)
+
+    def test_key_split_across_chunks(self):
+        text = self.document(TRICKY_ROWS)
+        key = text.index('"rowSet"')
+        for cut in range(key, key + len('"rowSet": [') + 1):
+            extractor = RowSetExtractor()
+            extractor.feed(text[:cut])
+            extractor.feed(text[cut:])
+            self.assertEqual(json.loads(extractor.text), TRICKY_ROWS, cut)
+
+    def test_empty_rowset(self):
+        self.assertEqual(extract(self.document([]), [3]).text, '[]')
+
+    def test_missing_or_cut_short(self):
+        self.assertFalse(extract(json.dumps({'resultSets': []}), [5]).done)
+        text = self.document(TRICKY_ROWS)
+        self.assertFalse(extract(text[:text.index('unicode')], [7]).done)
+
+
+class MockServerTest(MockServerTestCase):
+    def test_matches_full_parse(self):
+        gameid = NBAScrapeGames.create_regular_gameid(15, 1)
+        rows = NBAScrapeGames.request_game_data(game_url(1))
+        self.assertEqual(rows, json.loads(json.dumps(NBAMockServer.synthetic_rows(gameid))))
+        self.assertEqual(NBAScrapeGames.request_game_data(game_url(7)), []) # no such game
+
+    def test_bad_response_is_dead_lettered(self):
+        gameid = NBAScrapeGames.create_regular_gameid(15, 3)
+        with open(os.path.join(self.recordings, gameid), 'w') as outfile:
+            json.dump({'resultSets': []}, outfile)
+        with self.assertRaises(ValueError):
+            NBAScrapeGames.request_game_data(game_url(3))
+
+        NBAScrapeGames.save_regular_season(15)
+        manifest = NBAScrapeGames.get_manifest()
+        self.assertEqual(manifest.status(gameid), NBAManifest.FAILED)
+        self.assertEqual(len(manifest.gameids(15, NBAManifest.FETCHED)), 5)
+
+
+class StalledBodyTest(MockServerTestCase):
+    SERVER_OPTIONS = {'stall_rate': 0.5, 'hang': 1.0}
+
+    def setUp(self):
+        MockServerTestCase.setUp(self)
+        NBAHttp.configure(read_timeout=0.2, max_retries=6, backoff_base=0.01)
+
+    def test_stalled_body_is_retried(self):
+        NBAScrapeGames.save_regular_season(15)
+        manifest = NBAScrapeGames.get_manifest()
+        self.assertEqual(len(manifest.gameids(15, NBAManifest.FETCHED)), self.GAMES)
+        self.assertGreater(self.server.counts.get('stalled', 0), 0)
+
+    def test_gives_up_after_retries(self):
+        self.server.stall_rate = 1.0
+        NBAHttp.configure(max_retries=1)
+        with self.assertRaises(NBAHttp.FetchError):
+            NBAScrapeGames.request_game_data(game_url(1))
+        self.assertEqual(self.requests(), 2)
+
+    def test_stalled_body_is_not_cached(self):
+        NBAScrapeGames.CACHE_RESPONSES = True
+        self.server.stall_rate = 1.0
+        NBAHttp.configure(max_retries=1)
+        with self.assertRaises(NBAHttp.FetchError):
+            NBAScrapeGames.request_game_data(game_url(1))
+        cache = NBAScrapeGames.get_response_cache()
+        self.assertEqual(cache.keys(), [])
+        self.assertEqual(os.listdir(cache.blob_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+'''
+Offline checks of saving seasons with NBAScrapeGames against a local
+NBAMockServer.
+
+    python -m unittest discover tests
+'''
+
+import json
+import os
+import unittest
+import NBAManifest
+import NBAMockServer
+import NBAScrapeGames
+import NBAUtils
+from fixtures import MockServerTestCase
+
+
+YEAR = 15
+
+
+class PlayoffTest(MockServerTestCase):
+    PLAYOFF_ROUNDS = 1
+
+    def test_missing_saved_game_is_requested_again(self):
+        NBAScrapeGames.save_playoffs(YEAR)
+        manifest = NBAScrapeGames.get_manifest()
+        gameid = NBAScrapeGames.create_playoff_gameid(YEAR, 1, 0, 2)
+        prefix = os.path.join(self.file_dir, str(YEAR), 'Round1')
+        self.assertEqual(manifest.status(gameid), NBAManifest.FETCHED)
+        os.remove(os.path.join(prefix, gameid))
+
+        NBAScrapeGames.save_playoffs(YEAR)
+        self.assertTrue(NBAUtils.has_game(prefix, gameid))
+        self.assertEqual(manifest.status(gameid), NBAManifest.FETCHED)
+
+    def test_live_game_does_not_decide_a_series(self):
+        # A sweep whose game 4 is still being played, with the sweeper ahead
+        series = next(s for s in range(8) if not NBAMockServer.synthetic_rows(
+            NBAScrapeGames.create_playoff_gameid(YEAR, 1, s, 5)))
+        game4, game5 = [NBAScrapeGames.create_playoff_gameid(YEAR, 1, series, n)
+                        for n in (4, 5)]
+        live = NBAMockServer.synthetic_rows(game4)[:-1] # before the final buzzer
+        self.assertIsNotNone(NBAUtils.get_winner(live))
+        with open(os.path.join(self.recordings, game4), 'w') as outfile:
+            json.dump(live, outfile)
+
+        manifest = NBAScrapeGames.get_manifest()
+        self.assertEqual(NBAScrapeGames.save_series(YEAR, 1, series, manifest), 4)
+        self.assertEqual(manifest.status(game4), NBAManifest.PARTIAL)
+        self.assertEqual(manifest.status(game5), NBAManifest.EMPTY) # still probed
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+'''
+Offline checks of the columnar season store in NBAStore and of loading
+compacted games through NBAUtils.
+
+    python -m unittest discover tests
+'''
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import NBAMetrics
+import NBAMockServer
+import NBAScrapeGames
+import NBAStore
+import NBAUtils
+
+
+YEAR = 15
+GAMES = 12
+
+
+def saved_rows(gameid):
+    '''Returns the rows of a made-up game as json.load returns them from a saved file.'''
+
+    return json.loads(json.dumps(NBAMockServer.synthetic_rows(gameid)))
+
+
+class SeasonStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='nba-test-')
+        self.saved = (NBAStore.BLOCK_ROWS, NBAStore.CACHED_BLOCKS, NBAMetrics.QUIET)
+        NBAMetrics.QUIET = True
+        self.games = dict((g, saved_rows(g)) for g in
+                          [NBAScrapeGames.create_regular_gameid(YEAR, n)
+                           for n in range(1, GAMES + 1)])
+
+    def tearDown(self):
+        NBAStore.BLOCK_ROWS, NBAStore.CACHED_BLOCKS, NBAMetrics.QUIET = self.saved
+        NBAStore._stores.clear()
+        shutil.rmtree(self.folder)
+
+    def test_rows_round_trip(self):
+        self.games['0021500099'] = [] # a game without rows
+        NBAStore.write_store(self.folder, self.games.items())
+        store = NBAStore.open_store(self.folder)
+        self.assertEqual(sorted(store.gameids), sorted(self.games))
+        for gameid, rows in sorted(self.games.items()):
+            self.assertEqual(store.rows(gameid), rows, gameid)
+
+    def test_rows_across_blocks(self):
+        # Small blocks and a small cache, so games straddle blocks that get evicted
+        NBAStore.BLOCK_ROWS = 100
+        NBAStore.CACHED_BLOCKS = 2
+        NBAStore.write_store(self.folder, self.games.items())
+        store = NBAStore.open_store(self.folder)
+        for gameid in sorted(self.games, reverse=True):
+            self.assertEqual(store.rows(gameid), self.games[gameid], gameid)
+        self.assertLessEqual(len(store.blocks), 2)
+        start, stop = store.game_slice(sorted(self.games)[3])
+        self.assertEqual(store.rows_between(start + 50, stop - 50),
+                         self.games[sorted(self.games)[3]][50:-50])
+
+    def test_compacted_games_load_like_json(self):
+        for gameid, rows in self.games.items():
+            with open(os.path.join(self.folder, gameid), 'w') as outfile:
+                json.dump(rows, outfile)
+        NBAUtils.compact(self.folder, remove_json=True)
+        self.assertEqual(NBAUtils.json_game_ids(self.folder), [])
+        for gameid, rows in self.games.items():
+            self.assertEqual(NBAUtils.load_game(self.folder, gameid), rows, gameid)
+            self.assertEqual(NBAUtils.load_first_row(self.folder, gameid), rows[0])
+        data = list(NBAUtils.data_generator(self.folder, columns=[4, 10]))
+        self.assertEqual([len(game) for game in data],
+                         [len(self.games[g]) for g in sorted(self.games)])
+
+
+if __name__ == '__main__':
+    unittest.main()